@@ -0,0 +1,186 @@
+"""
+Admission control and load shedding for new chat requests.
+
+Before a new chat request is parsed, logged or sent to a provider, the
+admission controller compares three load signals to their limits: running
+chat streams, requests queued behind the upstream concurrency limits, and
+event-loop lag (how late a periodic timer fires, smoothed). When any signal is
+over its limit the request is rejected at once with a 503 and a jittered
+`Retry-After`, so a surge fails a fraction of requests quickly instead of
+slowing every stream until it times out.
+
+Health checks, stats and conversation reads form a protected lane that is
+never shed; cancelling, resuming and reading results are never shed either,
+since they free or reuse work rather than add it.
+"""
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from chat_streams import stream_registry
+from upstream_limits import upstream_limits
+from rate_limiting import is_new_chat_request
+from logging_config import logger, get_request_id
+from configuration import (
+    ADMISSION_CONTROL_ENABLED,
+    ADMISSION_MAX_RUNNING_STREAMS,
+    ADMISSION_MAX_QUEUED_UPSTREAM,
+    ADMISSION_MAX_LOOP_LAG_MS,
+    ADMISSION_LOOP_LAG_INTERVAL_MS,
+    ADMISSION_RETRY_AFTER_SECONDS
+)
+
+# Weight of each new lag sample in the smoothed event-loop lag
+LAG_ALPHA = 0.3
+
+# GET paths that are always admitted
+PROTECTED_PATH_PREFIXES = ("/health", "/stats", "/conversations")
+
+def request_lane(method: str, path: str) -> str:
+    """"chat" for new generations (sheddable), "protected" for health and reads, else "default"."""
+    if is_new_chat_request(method, path):
+        return "chat"
+    if method == "GET" and (path == "/" or path.startswith(PROTECTED_PATH_PREFIXES)):
+        return "protected"
+    return "default"
+
+class LoopLagMonitor:
+    """Measures event-loop lag as the overshoot of a periodic sleep."""
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval_seconds)
+            lag = max(0.0, time.monotonic() - started - self.interval_seconds)
+            self.lag_seconds += LAG_ALPHA * (lag - self.lag_seconds)
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+
+class AdmissionController:
+    """Decides whether a new chat request may start, from live load signals."""
+
+    def __init__(self, max_running_streams: int, max_queued_upstream: int,
+                 max_loop_lag_seconds: float, retry_after_seconds: float, lag_monitor: LoopLagMonitor):
+        self.max_running_streams = max_running_streams
+        self.max_queued_upstream = max_queued_upstream
+        self.max_loop_lag_seconds = max_loop_lag_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.lag_monitor = lag_monitor
+        self.admitted = 0
+        self.shed: Dict[str, int] = {"running_streams": 0, "queued_upstream": 0, "loop_lag": 0}
+        self.lane_requests: Dict[str, int] = {"chat": 0, "protected": 0, "default": 0}
+
+    def overload_reason(self) -> Optional[str]:
+        """The first load signal over its limit, or None if a new request may start."""
+        if self.max_running_streams > 0 and stream_registry.running() >= self.max_running_streams:
+            return "running_streams"
+        if self.max_queued_upstream > 0 and upstream_limits.queued() >= self.max_queued_upstream:
+            return "queued_upstream"
+        if self.max_loop_lag_seconds > 0 and self.lag_monitor.lag_seconds >= self.max_loop_lag_seconds:
+            return "loop_lag"
+        return None
+
+    def admit(self) -> Optional[str]:
+        """
+        Admit or shed a new chat request.
+
+        Returns:
+            None if admitted, otherwise the reason it was shed
+        """
+        reason = self.overload_reason()
+        if reason is None:
+            self.admitted += 1
+        else:
+            self.shed[reason] += 1
+        return reason
+
+    def retry_after(self) -> int:
+        """Seconds a shed client should wait, jittered so retries do not arrive together."""
+        return max(1, round(self.retry_after_seconds * random.uniform(1.0, 2.0)))
+
+    def stats(self) -> Dict[str, Any]:
+        shed = sum(self.shed.values())
+        decided = self.admitted + shed
+        return {
+            "enabled": ADMISSION_CONTROL_ENABLED,
+            "running_streams": stream_registry.running(),
+            "max_running_streams": self.max_running_streams,
+            "queued_upstream": upstream_limits.queued(),
+            "max_queued_upstream": self.max_queued_upstream,
+            "loop_lag_ms": round(self.lag_monitor.lag_seconds * 1000, 1),
+            "max_observed_loop_lag_ms": round(self.lag_monitor.max_lag_seconds * 1000, 1),
+            "max_loop_lag_ms": round(self.max_loop_lag_seconds * 1000, 1),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "shed_rate": round(shed / decided, 4) if decided else 0.0,
+            "lanes": self.lane_requests,
+        }
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that sheds new chat requests with 503 + Retry-After while
+    the server is overloaded, and lets the protected lane through untouched.
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not ADMISSION_CONTROL_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        lane = request_lane(scope["method"], scope["path"])
+        self.controller.lane_requests[lane] += 1
+        if lane == "chat":
+            reason = self.controller.admit()
+            if reason is not None:
+                retry_after = self.controller.retry_after()
+                logger.warning(f"Shedding {scope['method']} {scope['path']}: {reason} over limit")
+                response = JSONResponse(
+                    status_code=503,
+                    content={
+                        "status": "error",
+                        "code": 503,
+                        "message": f"Server overloaded ({reason}), retry in {retry_after} seconds",
+                        "request_id": get_request_id(),
+                        "timestamp": datetime.now(timezone.utc).isoformat()
+                    },
+                    headers={"Retry-After": str(retry_after)}
+                )
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
+
+# Process-wide admission controller
+loop_lag_monitor = LoopLagMonitor(ADMISSION_LOOP_LAG_INTERVAL_MS / 1000)
+admission_controller = AdmissionController(
+    ADMISSION_MAX_RUNNING_STREAMS,
+    ADMISSION_MAX_QUEUED_UPSTREAM,
+    ADMISSION_MAX_LOOP_LAG_MS / 1000,
+    ADMISSION_RETRY_AFTER_SECONDS,
+    loop_lag_monitor
+)
@@ -1,28 +1,118 @@
 # filepath: aiproviders.py
-from typing import List, Tuple, Dict, Any, AsyncGenerator
-import json
+from typing import List, Tuple, Dict, Any, AsyncGenerator, Optional
 import time
 from fastapi import HTTPException
-from models import ChatRequest, ConversationMessage
+from models import ChatRequest
 from logging_config import logger, debug_with_context, generate_conversation_id, log_conversation_entry, get_request_id
 import sentry_sdk
 from configuration import (
     # Single source of truth for provider configuration
     PROVIDER_SETTINGS,
     SUPPORTED_PROVIDERS,
-    RESPONSE_TIMEOUT,
-    SENTRY_DSN
+    SENTRY_DSN,
+    HEDGE_ENABLED
 )
-from providers import ProviderFactory
+from providers import ProviderFactory, BaseProvider
 from prompt_engineering import get_system_prompt
-from constants import SSEFormat
+from stream_events import StreamEvent, StreamAccumulator
+from hedging import hedged_stream
+from failover import failover_steps
+from deadlines import Deadline
+from degradation import Degradation
+from call_context import CallContext, CancellationToken
 import uuid
 
 # Initialize all providers
 ProviderFactory.initialize_all_providers()
 
-async def stream_response(request: ChatRequest, provider: str, conversation_id: str = None) -> AsyncGenerator[str, None]:
-    """Stream chat responses from an AI provider"""
+def generate_message_id(provider: str) -> str:
+    """Generate a unique message ID for a streamed response."""
+    return f"{provider}-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+
+def build_failover_chain(provider: str) -> List[Tuple[BaseProvider, str]]:
+    """Resolve a provider's failover chain to initialized provider instances."""
+    instances = ProviderFactory.get_all_providers()
+    return [
+        (instances[step_provider], model)
+        for step_provider, model in failover_steps(provider)
+        if step_provider in instances
+    ]
+
+def build_call_context(
+    request: ChatRequest,
+    provider: str,
+    message_id: str,
+    deadline: Optional[Deadline] = None,
+    degradation: Optional[Degradation] = None,
+    cancellation: Optional[CancellationToken] = None,
+    chain: Optional[List[Tuple[BaseProvider, str]]] = None
+) -> CallContext:
+    """
+    Build the call context for one request to a provider.
+    
+    Every provider in the chain gets the system prompt it would use for this
+    request on its own. Under degradation the economy model goes first and
+    max_tokens is capped; the rest of the chain follows it.
+    
+    Args:
+        chain: Optional (provider, model) steps; defaults to the provider's failover chain
+    """
+    if chain is None:
+        chain = build_failover_chain(provider)
+    max_tokens = None
+    if degradation is not None:
+        economy_step = (ProviderFactory.get_provider(provider), degradation.model)
+        chain = [economy_step] + [step for step in chain if step != economy_step]
+        max_tokens = degradation.max_tokens
+    system_prompts = {
+        step_provider.provider_name: get_system_prompt(request.messages, step_provider.provider_name)
+        for step_provider, _ in chain
+    }
+    return CallContext(
+        message_id=message_id,
+        chain=chain,
+        system_prompts=system_prompts,
+        max_tokens=max_tokens,
+        deadline=deadline,
+        cancellation=cancellation or CancellationToken()
+    )
+
+def usage_event(message_id: str, accumulator: StreamAccumulator) -> StreamEvent:
+    """
+    The stream's final usage event: the model that served the answer and the
+    token counts reported by every attempt (omitted if no provider reported any).
+    """
+    return StreamEvent.meta(StreamEvent.USAGE, message_id, {
+        "model": accumulator.model,
+        **(accumulator.usage or {})
+    }, model=accumulator.model)
+
+async def stream_response(
+    request: ChatRequest,
+    provider: str,
+    conversation_id: str = None,
+    accumulator: Optional[StreamAccumulator] = None,
+    message_id: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+    degradation: Optional[Degradation] = None,
+    cancellation: Optional[CancellationToken] = None
+) -> AsyncGenerator[StreamEvent, None]:
+    """
+    Stream chat response events from an AI provider.
+    
+    Args:
+        request: The validated chat request
+        provider: Provider name
+        conversation_id: Optional conversation ID (generated if not provided)
+        accumulator: Optional buffer that collects the response text; pass one
+            in to read the complete answer once the stream finishes
+        message_id: Optional message ID (generated if not provided)
+        deadline: Optional time budget; phases blown by a model fail over to
+            the next model, a spent total budget ends the stream
+        degradation: Optional downshift under load: start on the economy model
+            and cap max_tokens; the rest of the failover chain follows it
+        cancellation: Optional token to stop the generation cooperatively
+    """
     if provider not in SUPPORTED_PROVIDERS:
         raise HTTPException(status_code=400, detail=f"Provider {provider} not supported")
     
@@ -36,7 +126,8 @@ async def stream_response(request: ChatRequest, provider: str, conversation_id:
         sentry_sdk.set_tag("conversation_id", conversation_id)
         sentry_sdk.set_tag("request_id", request_id)
     
-    response_buffer = []
+    if accumulator is None:
+        accumulator = StreamAccumulator()
     
     debug_with_context(logger,
         "Starting stream_response", 
@@ -48,25 +139,34 @@ async def stream_response(request: ChatRequest, provider: str, conversation_id:
     )
 
     try:
-        message_id = f"{provider}-{int(time.time() * 1000)}"
+        if not message_id:
+            message_id = generate_message_id(provider)
         stream_start = time.time()
         chunks_sent = 0
         
         # Get the provider instance using the factory
         provider_instance = ProviderFactory.get_provider(provider)
         
-        # Update the system prompt based on the request messages
-        system_prompt = get_system_prompt(request.messages, provider)
-        provider_instance.system_prompt = system_prompt
+        # Everything request-specific travels in the context; provider instances are shared
+        context = build_call_context(request, provider, message_id, deadline, degradation, cancellation)
         
-        # Stream the response
-        async for chunk in provider_instance.try_with_models(request.messages, message_id):
-            response_buffer.append(chunk)
+        # Stream the response down the failover chain, hedging a slow first token if enabled
+        if HEDGE_ENABLED:
+            events = hedged_stream(request.messages, context, provider)
+        else:
+            events = provider_instance.try_with_models(request.messages, context)
+        async for event in events:
+            accumulator.add(event)
+            if event.kind == StreamEvent.USAGE:
+                # Summed across attempts and sent once, with the serving model, before done
+                continue
+            if event.is_done:
+                yield usage_event(message_id, accumulator)
             chunks_sent += 1
-            yield chunk
+            yield event
             
             # Check if the stream is done
-            if chunk == SSEFormat.DONE_MESSAGE:
+            if event.is_done:
                 stream_duration = time.time() - stream_start
                 debug_with_context(logger,
                     f"Stream completed for {provider}",
@@ -76,8 +176,7 @@ async def stream_response(request: ChatRequest, provider: str, conversation_id:
                     request_id=request_id
                 )
                 # Log the complete conversation (legacy logging)
-                complete_response = ''.join(response_buffer)
-                log_conversation_entry(conversation_id, request.messages[-1].content, complete_response)
+                log_conversation_entry(conversation_id, request.messages[-1].content, accumulator.text())
                 return
 
     except Exception as e:
@@ -0,0 +1,672 @@
+"""
+Batch chat jobs (/chat/batch).
+
+A job holds many chat requests and is executed in the background, so bulk
+workloads (evaluations, summarization runs) do not hold hundreds of SSE
+streams open. Requests run on a bounded worker pool: BATCH_WORKERS at once
+overall and BATCH_PROVIDER_CONCURRENCY per provider, through the regular
+streaming path (failover, context trimming, usage accounting).
+
+In native mode, requests for providers with a batch API (OpenAI Batch,
+Anthropic Message Batches) are submitted there instead, at the providers'
+batch discount but with up to 24 hours of latency. Requests a native batch
+does not answer (expired, cancelled, lost) run locally.
+BATCH_NATIVE_BACKEND=local replaces the provider batch APIs with an
+in-process stand-in for tests.
+
+Jobs are written to the batch_jobs table when created and then every
+BATCH_PERSIST_INTERVAL_SECONDS while they change. On startup, queued and
+running jobs are resumed: native batches are polled again and requests
+without a result are re-run.
+"""
+import asyncio
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from fastapi import HTTPException
+from models import ChatRequest, BatchChatRequest
+from aiproviders import stream_response, build_call_context
+from providers import ProviderFactory, BaseProvider
+from call_context import CallContext
+from stream_events import StreamAccumulator
+from deadlines import deadline_for_request
+from provider_stats import usage_stats
+from logging_config import logger, debug_with_context
+from configuration import (
+    SUPPORTED_PROVIDERS,
+    BATCH_WORKERS,
+    BATCH_PROVIDER_CONCURRENCY,
+    BATCH_DEFAULT_MODE,
+    BATCH_NATIVE_BACKEND,
+    BATCH_NATIVE_POLL_SECONDS,
+    BATCH_PERSIST_INTERVAL_SECONDS,
+    BATCH_JOB_RETENTION_SECONDS
+)
+import supabase_client
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def _succeeded(model: Optional[str], content: str, usage: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    return {"status": "succeeded", "model": model, "content": content, "usage": usage}
+
+def _failed(error: str) -> Dict[str, Any]:
+    return {"status": "failed", "error": error}
+
+async def run_chat_request(provider: str, request: ChatRequest) -> Dict[str, Any]:
+    """Run one chat request through the streaming path and return its outcome."""
+    accumulator = StreamAccumulator()
+    try:
+        async for _ in stream_response(request, provider, accumulator=accumulator,
+                                       deadline=deadline_for_request(None)):
+            pass
+    except HTTPException as e:
+        return _failed(str(e.detail))
+    except Exception as e:
+        return _failed(str(e))
+    return _succeeded(accumulator.model, accumulator.text(), accumulator.usage)
+
+class BatchJob:
+    """A batch job's requests, results and native batches."""
+
+    def __init__(self, job_id: str, items: List[Dict[str, Any]], mode: str,
+                 created_at: Optional[str] = None):
+        self.id = job_id
+        # {"custom_id", "provider", "messages"} per request
+        self.items = items
+        self.mode = mode
+        self.status = "queued"
+        self.created_at = created_at or _now()
+        self.updated_at = self.created_at
+        self.completed_at: Optional[str] = None
+        # Results by request index, and the indices in completion order
+        self.results: Dict[int, Dict[str, Any]] = {}
+        self.order: List[int] = []
+        # Native batch per provider: {"id", "backend", "submitted_at"}
+        self.native: Dict[str, Dict[str, Any]] = {}
+        # Unsaved changes
+        self.dirty = True
+        self.finished_at: Optional[float] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "cancelled")
+
+    @property
+    def changed(self) -> asyncio.Event:
+        """Set on the next change; fetch it before waiting."""
+        return self._changed
+
+    def touch(self) -> None:
+        self.dirty = True
+        self.updated_at = _now()
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def start(self) -> None:
+        if self.status == "queued":
+            self.status = "running"
+            self.touch()
+
+    def record(self, index: int, outcome: Dict[str, Any], via: Optional[str]) -> bool:
+        """Store a request's outcome; False if it already has one (e.g. cancelled meanwhile)."""
+        if index in self.results:
+            return False
+        item = self.items[index]
+        self.results[index] = {
+            "index": index,
+            "custom_id": item["custom_id"],
+            "provider": item["provider"],
+            "via": via,
+            **outcome
+        }
+        self.order.append(index)
+        if len(self.results) == len(self.items) and not self.finished:
+            self._finish("completed")
+        self.touch()
+        return True
+
+    def cancel(self) -> bool:
+        """Cancel the requests that have no result yet."""
+        if self.finished:
+            return False
+        self._finish("cancelled")
+        for index in range(len(self.items)):
+            if index not in self.results:
+                self.record(index, {"status": "cancelled"}, None)
+        self.touch()
+        return True
+
+    def _finish(self, status: str) -> None:
+        self.status = status
+        self.completed_at = _now()
+        self.finished_at = time.monotonic()
+
+    def summary(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for result in self.results.values():
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "mode": self.mode,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "completed_at": self.completed_at,
+            "total": len(self.items),
+            "completed": len(self.results),
+            "succeeded": counts.get("succeeded", 0),
+            "failed": counts.get("failed", 0),
+            "cancelled": counts.get("cancelled", 0),
+            "native_batches": {provider: native["id"] for provider, native in self.native.items()},
+        }
+
+    def results_page(self, offset: int, limit: int) -> List[Dict[str, Any]]:
+        """Results in completion order."""
+        return [self.results[index] for index in self.order[offset:offset + limit]]
+
+    def to_row(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "mode": self.mode,
+            "requests": self.items,
+            "results": [self.results[index] for index in self.order],
+            "native_batches": self.native,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "completed_at": self.completed_at,
+        }
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "BatchJob":
+        job = cls(row["id"], row["requests"], row["mode"], row.get("created_at"))
+        job.status = row["status"]
+        job.updated_at = row.get("updated_at") or job.created_at
+        job.completed_at = row.get("completed_at")
+        for result in row.get("results") or []:
+            job.results[result["index"]] = result
+            job.order.append(result["index"])
+        job.native = row.get("native_batches") or {}
+        job.dirty = False
+        if job.finished:
+            job.finished_at = time.monotonic()
+        return job
+
+class NativeBatchAPI(ABC):
+    """A provider's asynchronous batch API."""
+    name = ""
+
+    def __init__(self, provider: BaseProvider):
+        self.provider = provider
+
+    @abstractmethod
+    async def build_request(self, custom_id: str, request: ChatRequest) -> Dict[str, Any]:
+        """
+        Format one request for the batch.
+
+        Raises:
+            ContextWindowExceeded: If the conversation does not fit the model
+        """
+        pass
+
+    def call_context(self, custom_id: str, request: ChatRequest, model: str) -> CallContext:
+        """The call context of one batched request: the request's system prompt, no failover."""
+        return build_call_context(request, self.provider.provider_name, custom_id, chain=[(self.provider, model)])
+
+    @abstractmethod
+    async def submit(self, entries: List[Dict[str, Any]]) -> str:
+        """Create a batch and return its ID."""
+        pass
+
+    @abstractmethod
+    async def poll(self, batch_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        None while the batch is running, else the outcomes by custom_id.
+
+        Requests the batch did not answer (expired, cancelled) are left out.
+        """
+        pass
+
+    @abstractmethod
+    async def cancel(self, batch_id: str) -> None:
+        """Cancel a batch; requests it has already answered keep their results."""
+        pass
+
+class OpenAIBatchAPI(NativeBatchAPI):
+    """OpenAI Batch: a JSONL file of chat completion requests, answered within 24 hours."""
+    name = "openai"
+    ENDPOINT = "/v1/chat/completions"
+    # Errors of requests the batch never ran; these are retried locally
+    UNPROCESSED_ERRORS = ("batch_expired", "batch_cancelled")
+
+    async def build_request(self, custom_id: str, request: ChatRequest) -> Dict[str, Any]:
+        model = self.provider.default_model
+        context = self.call_context(custom_id, request, model)
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": self.ENDPOINT,
+            "body": {
+                "model": model,
+                "messages": await self.provider.prepare_messages(request.messages, model, context),
+                "temperature": context.temperature_for(self.provider),
+                "max_tokens": context.max_tokens_for(self.provider)
+            }
+        }
+
+    async def submit(self, entries: List[Dict[str, Any]]) -> str:
+        content = "\n".join(json.dumps(entry, ensure_ascii=False) for entry in entries).encode("utf-8")
+        input_file = await self.provider.client.files.create(file=("batch.jsonl", content), purpose="batch")
+        batch = await self.provider.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=self.ENDPOINT,
+            completion_window="24h"
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        batch = await self.provider.client.batches.retrieve(batch_id)
+        if batch.status not in ("completed", "failed", "expired", "cancelled"):
+            return None
+        outcomes = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await self.provider.client.files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                body = response.get("body") or {}
+                if response.get("status_code") == 200:
+                    usage = body.get("usage") or {}
+                    details = usage.get("prompt_tokens_details") or {}
+                    outcomes[record["custom_id"]] = _succeeded(
+                        body.get("model"),
+                        body["choices"][0]["message"].get("content") or "",
+                        self.provider.format_usage("", body.get("model"), usage.get("prompt_tokens"),
+                                                   usage.get("completion_tokens"),
+                                                   cache_read_tokens=details.get("cached_tokens")).data
+                    )
+                    continue
+                error = record.get("error") or body.get("error") or {}
+                if error.get("code") in self.UNPROCESSED_ERRORS:
+                    continue
+                outcomes[record["custom_id"]] = _failed(
+                    error.get("message") or f"HTTP {response.get('status_code')}"
+                )
+        return outcomes
+
+    async def cancel(self, batch_id: str) -> None:
+        await self.provider.client.batches.cancel(batch_id)
+
+class AnthropicBatchAPI(NativeBatchAPI):
+    """Anthropic Message Batches: up to 100,000 Messages requests, answered within 24 hours."""
+    name = "anthropic"
+
+    async def build_request(self, custom_id: str, request: ChatRequest) -> Dict[str, Any]:
+        model = self.provider.default_model
+        context = self.call_context(custom_id, request, model)
+        return {
+            "custom_id": custom_id,
+            "params": {
+                "model": model,
+                "max_tokens": context.max_tokens_for(self.provider),
+                "temperature": context.temperature_for(self.provider),
+                "system": self.provider.format_system(context.system_prompt_for(self.provider)),
+                "messages": await self.provider.prepare_messages(request.messages, model, context)
+            }
+        }
+
+    async def submit(self, entries: List[Dict[str, Any]]) -> str:
+        batch = await self.provider.client.messages.batches.create(requests=entries)
+        return batch.id
+
+    async def poll(self, batch_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        batch = await self.provider.client.messages.batches.retrieve(batch_id)
+        if batch.processing_status != "ended":
+            return None
+        outcomes = {}
+        async for entry in await self.provider.client.messages.batches.results(batch_id):
+            result = entry.result
+            if result.type == "succeeded":
+                message = result.message
+                usage = message.usage
+                cache_read = usage.cache_read_input_tokens or 0
+                cache_write = usage.cache_creation_input_tokens or 0
+                outcomes[entry.custom_id] = _succeeded(
+                    message.model,
+                    "".join(block.text for block in message.content if block.type == "text"),
+                    self.provider.format_usage("", message.model, usage.input_tokens + cache_read + cache_write,
+                                               usage.output_tokens, cache_read, cache_write).data
+                )
+            elif result.type == "errored":
+                error = getattr(result.error, "error", None)
+                outcomes[entry.custom_id] = _failed(getattr(error, "message", None) or "Request errored")
+            # canceled and expired requests are retried locally
+        return outcomes
+
+    async def cancel(self, batch_id: str) -> None:
+        await self.provider.client.messages.batches.cancel(batch_id)
+
+class LocalBatchAPI(NativeBatchAPI):
+    """
+    In-process stand-in for a provider batch API (BATCH_NATIVE_BACKEND=local).
+
+    Runs a batch's requests one after another through the streaming path.
+    Batches live in memory, so after a restart their requests run locally.
+    """
+    name = "local"
+
+    def __init__(self, provider: BaseProvider):
+        super().__init__(provider)
+        self._batches: Dict[str, asyncio.Task] = {}
+
+    async def build_request(self, custom_id: str, request: ChatRequest) -> Dict[str, Any]:
+        return {"custom_id": custom_id, "request": request}
+
+    async def submit(self, entries: List[Dict[str, Any]]) -> str:
+        batch_id = f"local-batch-{uuid.uuid4().hex}"
+        self._batches[batch_id] = asyncio.create_task(self._run(entries))
+        return batch_id
+
+    async def _run(self, entries: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        return {
+            entry["custom_id"]: await run_chat_request(self.provider.provider_name, entry["request"])
+            for entry in entries
+        }
+
+    async def poll(self, batch_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        task = self._batches.get(batch_id)
+        if task is None:
+            return {}
+        if not task.done():
+            return None
+        del self._batches[batch_id]
+        return {} if task.cancelled() else task.result()
+
+    async def cancel(self, batch_id: str) -> None:
+        task = self._batches.get(batch_id)
+        if task is not None:
+            task.cancel()
+
+NATIVE_BATCH_APIS = {"gpt": OpenAIBatchAPI, "claude": AnthropicBatchAPI}
+
+def _native_custom_id(index: int) -> str:
+    # Provider batch APIs restrict custom IDs, so requests are keyed by position
+    return f"request-{index}"
+
+class BatchJobManager:
+    """Runs batch jobs on a bounded worker pool with per-provider concurrency caps."""
+
+    def __init__(self, workers: int, provider_concurrency: Dict[str, int]):
+        self.workers = workers
+        self.provider_concurrency = provider_concurrency
+        self._jobs: Dict[str, BatchJob] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._native_apis: Dict[str, NativeBatchAPI] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+        # Native batch watchers by job ID
+        self._job_tasks: Dict[str, List[asyncio.Task]] = {}
+        self.in_flight = 0
+        self.jobs_submitted = 0
+        self.jobs_resumed = 0
+        self.requests_completed = 0
+        self.requests_failed = 0
+        self.native_batches = 0
+        self.native_fallbacks = 0
+
+    async def start(self) -> None:
+        """Start the workers and the persistence loop, then resume unfinished jobs."""
+        self._slots = asyncio.Semaphore(self.workers)
+        instances = ProviderFactory.get_all_providers()
+        for provider in SUPPORTED_PROVIDERS:
+            self._queues[provider] = asyncio.Queue()
+            for _ in range(max(1, self.provider_concurrency.get(provider, 1))):
+                self._tasks.append(asyncio.create_task(self._worker(provider)))
+            api_class = LocalBatchAPI if BATCH_NATIVE_BACKEND == "local" else NATIVE_BATCH_APIS.get(provider)
+            if api_class is not None and provider in instances:
+                self._native_apis[provider] = api_class(instances[provider])
+        self._tasks.append(asyncio.create_task(self._persist_loop()))
+
+        for row in await supabase_client.get_unfinished_batch_jobs():
+            job = BatchJob.from_row(row)
+            self._jobs[job.id] = job
+            self.jobs_resumed += 1
+            self._schedule(job)
+        if self.jobs_resumed:
+            logger.info(f"Resumed {self.jobs_resumed} batch jobs")
+
+    async def stop(self) -> None:
+        """Stop all work and save job progress; unfinished jobs resume on the next start."""
+        tasks = self._tasks + [task for tasks in self._job_tasks.values() for task in tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._job_tasks = {}
+        for job in list(self._jobs.values()):
+            if job.dirty:
+                await self._save(job)
+
+    async def submit(self, request: BatchChatRequest) -> BatchJob:
+        """Create a job, save it and queue its requests."""
+        items = [
+            {
+                "custom_id": item.custom_id if item.custom_id is not None else str(index),
+                "provider": item.provider,
+                "messages": [m.model_dump(mode="json", exclude_none=True) for m in item.messages]
+            }
+            for index, item in enumerate(request.requests)
+        ]
+        job = BatchJob(f"batch-{uuid.uuid4().hex}", items, request.mode or BATCH_DEFAULT_MODE)
+        self._jobs[job.id] = job
+        self.jobs_submitted += 1
+        # Saved before any work so a restart can resume it
+        await self._save(job)
+        self._schedule(job)
+        debug_with_context(logger,
+            "Batch job submitted",
+            job_id=job.id,
+            mode=job.mode,
+            requests=len(items)
+        )
+        return job
+
+    async def get(self, job_id: str) -> Optional[BatchJob]:
+        """A job from memory, or from storage once it has been evicted."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        row = await supabase_client.get_batch_job(job_id)
+        return BatchJob.from_row(row) if row else None
+
+    async def cancel(self, job: BatchJob) -> bool:
+        """Cancel a job's outstanding requests, including its native batches."""
+        if not job.cancel():
+            return False
+        for task in self._job_tasks.pop(job.id, []):
+            task.cancel()
+        for provider, native in job.native.items():
+            api = self._native_apis.get(provider)
+            if api is None:
+                continue
+            try:
+                await api.cancel(native["id"])
+            except Exception as e:
+                logger.warning(f"Could not cancel native batch {native['id']}: {str(e)}")
+        await self._save(job)
+        return True
+
+    async def follow(self, job: BatchJob) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Yield a job's results in completion order until it finishes.
+
+        A job loaded from storage that this process is not running only yields
+        the results saved so far.
+        """
+        position = 0
+        while True:
+            changed = job.changed
+            while position < len(job.order):
+                yield job.results[job.order[position]]
+                position += 1
+            if job.finished or self._jobs.get(job.id) is not job:
+                return
+            await changed.wait()
+
+    def _schedule(self, job: BatchJob) -> None:
+        """Queue a job's requests that have no result, or hand them to native batches."""
+        pending: Dict[str, List[int]] = {}
+        for index, item in enumerate(job.items):
+            if index not in job.results:
+                pending.setdefault(item["provider"], []).append(index)
+        for provider, indices in pending.items():
+            if provider not in self._queues:
+                # Possible after a restart with fewer supported providers
+                for index in indices:
+                    job.record(index, _failed(f"Provider {provider} not supported"), None)
+                continue
+            if provider in self._native_apis and (provider in job.native or job.mode == "native"):
+                task = asyncio.create_task(self._run_native(job, provider, indices))
+                self._job_tasks.setdefault(job.id, []).append(task)
+            else:
+                self._enqueue(job, provider, indices)
+
+    def _enqueue(self, job: BatchJob, provider: str, indices: List[int]) -> None:
+        for index in indices:
+            self._queues[provider].put_nowait((job, index))
+
+    def _record(self, job: BatchJob, index: int, outcome: Dict[str, Any], via: str) -> None:
+        if not job.record(index, outcome, via):
+            return
+        if outcome["status"] == "succeeded":
+            self.requests_completed += 1
+        else:
+            self.requests_failed += 1
+
+    async def _worker(self, provider: str) -> None:
+        queue = self._queues[provider]
+        while True:
+            job, index = await queue.get()
+            try:
+                if job.finished or index in job.results:
+                    continue
+                async with self._slots:
+                    job.start()
+                    self.in_flight += 1
+                    try:
+                        request = ChatRequest(messages=job.items[index]["messages"])
+                        outcome = await run_chat_request(provider, request)
+                    finally:
+                        self.in_flight -= 1
+                self._record(job, index, outcome, "local")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Batch worker error in job {job.id}: {str(e)}", exc_info=True)
+                self._record(job, index, _failed(str(e)), "local")
+            finally:
+                queue.task_done()
+
+    async def _run_native(self, job: BatchJob, provider: str, indices: List[int]) -> None:
+        """Submit (or, after a restart, resume) a provider's native batch and collect its results."""
+        api = self._native_apis[provider]
+        native = job.native.get(provider)
+        if native is None:
+            try:
+                entries = []
+                for index in indices:
+                    try:
+                        request = ChatRequest(messages=job.items[index]["messages"])
+                        entries.append(await api.build_request(_native_custom_id(index), request))
+                    except Exception as e:
+                        self._record(job, index, _failed(str(e)), "native")
+                if not entries:
+                    return
+                native = {"id": await api.submit(entries), "backend": api.name, "submitted_at": _now()}
+            except Exception as e:
+                logger.warning(f"Native batch submission to {provider} failed, running job {job.id} locally: {str(e)}")
+                self._fall_back(job, provider, indices)
+                return
+            job.native[provider] = native
+            self.native_batches += 1
+            job.start()
+            job.touch()
+            # Saved right away so a restart polls the batch instead of submitting it again
+            await self._save(job)
+
+        while True:
+            try:
+                outcomes = await api.poll(native["id"])
+            except Exception as e:
+                logger.warning(f"Polling native batch {native['id']} failed: {str(e)}")
+                outcomes = None
+            if outcomes is not None:
+                break
+            await asyncio.sleep(BATCH_NATIVE_POLL_SECONDS)
+
+        for index in indices:
+            outcome = outcomes.get(_native_custom_id(index))
+            if outcome is None:
+                continue
+            if outcome["status"] == "succeeded" and outcome.get("usage"):
+                usage_stats.record(provider, outcome["model"], outcome["usage"])
+            self._record(job, index, outcome, "native")
+        self._fall_back(job, provider, indices)
+
+    def _fall_back(self, job: BatchJob, provider: str, indices: List[int]) -> None:
+        """Run the requests a native batch left unanswered on the local workers."""
+        leftovers = [index for index in indices if index not in job.results]
+        if leftovers and not job.finished:
+            self.native_fallbacks += len(leftovers)
+            self._enqueue(job, provider, leftovers)
+
+    async def _save(self, job: BatchJob) -> None:
+        job.dirty = False
+        if not await supabase_client.save_batch_job(job.to_row()):
+            job.dirty = True
+
+    async def _persist_loop(self) -> None:
+        """Save changed jobs periodically and evict finished ones from memory."""
+        while True:
+            await asyncio.sleep(BATCH_PERSIST_INTERVAL_SECONDS)
+            now = time.monotonic()
+            for job in list(self._jobs.values()):
+                try:
+                    if job.dirty:
+                        await self._save(job)
+                    elif job.finished and now - job.finished_at > BATCH_JOB_RETENTION_SECONDS:
+                        del self._jobs[job.id]
+                        self._job_tasks.pop(job.id, None)
+                except Exception as e:
+                    logger.error(f"Error persisting batch job {job.id}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for job in self._jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "provider_concurrency": {provider: self.provider_concurrency.get(provider, 1) for provider in self._queues},
+            "native_apis": {provider: api.name for provider, api in self._native_apis.items()},
+            "jobs_in_memory": statuses,
+            "jobs_submitted": self.jobs_submitted,
+            "jobs_resumed": self.jobs_resumed,
+            "queued": {provider: queue.qsize() for provider, queue in self._queues.items()},
+            "in_flight": self.in_flight,
+            "requests_completed": self.requests_completed,
+            "requests_failed": self.requests_failed,
+            "native_batches": self.native_batches,
+            "native_fallbacks": self.native_fallbacks,
+        }
+
+# Process-wide batch job manager
+batch_jobs = BatchJobManager(BATCH_WORKERS, BATCH_PROVIDER_CONCURRENCY)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Benchmark for SSE frame coalescing.
+
+Simulates a fast provider (bursts of tiny deltas, as seen from Groq and Gemini)
+and a client that pays one socket write per frame, then compares frames/sec,
+CPU time and time to first token with and without coalescing.
+
+Usage:
+    python benchmark_streaming.py [--tokens 5000] [--burst 20] [--runs 3]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import time
+
+# Add the current directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from stream_events import StreamEvent, encode_sse
+from stream_coalescing import coalesce_events
+
+async def fake_provider(tokens: int, burst: int, message_id: str = "bench-1"):
+    """Yield `tokens` small deltas in bursts of `burst` separated by 1 ms."""
+    for i in range(tokens):
+        yield StreamEvent.delta(message_id, "tok ", "bench-model")
+        if (i + 1) % burst == 0:
+            await asyncio.sleep(0.001)
+        else:
+            await asyncio.sleep(0)
+    yield StreamEvent.done(message_id, "bench-model")
+
+async def run_once(tokens: int, burst: int, coalesce: bool):
+    """Stream once through the edge encoder into a real socket; return metrics."""
+    reader_sock, writer_sock = socket.socketpair()
+    reader_sock.setblocking(False)
+    writer_sock.setblocking(False)
+    loop = asyncio.get_running_loop()
+
+    async def drain_reader():
+        while True:
+            try:
+                data = await loop.sock_recv(reader_sock, 65536)
+            except OSError:
+                return
+            if not data:
+                return
+
+    drain_task = asyncio.create_task(drain_reader())
+
+    events = fake_provider(tokens, burst)
+    if coalesce:
+        events = coalesce_events(events)
+
+    frames = 0
+    ttft = None
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    async for event in events:
+        if ttft is None:
+            ttft = time.perf_counter() - wall_start
+        # One frame == one send == one write syscall, as with ASGI + uvicorn
+        await loop.sock_sendall(writer_sock, encode_sse(event).encode("utf-8"))
+        frames += 1
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    writer_sock.close()
+    await drain_task
+    reader_sock.close()
+    return {"frames": frames, "wall": wall, "cpu": cpu, "ttft": ttft}
+
+async def main(tokens: int, burst: int, runs: int):
+    print(f"Simulated stream: {tokens} deltas, bursts of {burst} every 1 ms, {runs} run(s) each\n")
+    print(f"{'mode':<12}{'frames':>8}{'deltas/frame':>14}{'frames/s':>10}{'wall (s)':>10}{'cpu (s)':>10}{'ttft (ms)':>11}")
+    for coalesce in (False, True):
+        results = [await run_once(tokens, burst, coalesce) for _ in range(runs)]
+        frames = sum(r["frames"] for r in results) / runs
+        wall = sum(r["wall"] for r in results) / runs
+        cpu = sum(r["cpu"] for r in results) / runs
+        ttft = sum(r["ttft"] for r in results) / runs
+        mode = "coalesced" if coalesce else "baseline"
+        print(f"{mode:<12}{frames:>8.0f}{tokens / frames:>14.1f}{frames / wall:>10.0f}{wall:>10.3f}{cpu:>10.3f}{ttft * 1000:>11.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=5000)
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.tokens, args.burst, args.runs))
@@ -0,0 +1,80 @@
+"""
+Per-request provider invocation context.
+
+Provider instances are process-wide singletons shared by every concurrent
+request, so nothing request-specific may be stored on them. Everything one
+request needs to call a provider travels in an immutable CallContext instead:
+the failover chain, the system prompt for each provider in it, generation
+parameters, the deadline and a cancellation token. Providers read their
+defaults (temperature, max_tokens, system prompt) from themselves only when
+the context leaves a value unset.
+"""
+import asyncio
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Mapping, Optional, Tuple
+from deadlines import Deadline
+
+if TYPE_CHECKING:
+    from providers.base import BaseProvider
+
+class CancellationToken:
+    """
+    Cooperative cancellation shared by every attempt of one request.
+
+    Provider streams check it between events and failover checks it between
+    steps; a cancelled token ends the request like a cancelled task, without
+    failing over or counting against the model's circuit.
+    """
+    __slots__ = ("reason",)
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        if self.reason is None:
+            self.reason = reason
+
+    def check(self) -> None:
+        """Raise CancelledError if the request was cancelled."""
+        if self.reason is not None:
+            raise asyncio.CancelledError(self.reason)
+
+@dataclass(frozen=True)
+class CallContext:
+    """Everything one request needs to call providers; never mutated once built."""
+    message_id: str
+    # (provider, model) steps to try in order
+    chain: Tuple[Tuple["BaseProvider", str], ...]
+    # System prompt per provider name; providers missing here use their own default
+    system_prompts: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+    # None: each provider's configured temperature
+    temperature: Optional[float] = None
+    # Upper bound on output tokens; None: each provider's configured max_tokens
+    max_tokens: Optional[int] = None
+    deadline: Optional[Deadline] = None
+    cancellation: CancellationToken = field(default_factory=CancellationToken)
+
+    def __post_init__(self):
+        object.__setattr__(self, "chain", tuple(self.chain))
+        if not isinstance(self.system_prompts, MappingProxyType):
+            object.__setattr__(self, "system_prompts", MappingProxyType(dict(self.system_prompts)))
+
+    def system_prompt_for(self, provider: "BaseProvider") -> str:
+        return self.system_prompts.get(provider.provider_name, provider.system_prompt)
+
+    def temperature_for(self, provider: "BaseProvider") -> float:
+        return provider.temperature if self.temperature is None else self.temperature
+
+    def max_tokens_for(self, provider: "BaseProvider") -> int:
+        if self.max_tokens is None:
+            return provider.max_tokens
+        return min(self.max_tokens, provider.max_tokens)
+
+    def with_chain(self, chain) -> "CallContext":
+        """A copy of this context with a different failover chain."""
+        return replace(self, chain=tuple(chain))
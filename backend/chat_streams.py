@@ -0,0 +1,289 @@
+"""
+Replayable chat streams.
+
+Each generation runs as a background task that publishes its events into a
+bounded replay buffer. HTTP responses are readers of that buffer, so a client
+can reconnect with `Last-Event-ID`, a retried POST carrying the same
+`Idempotency-Key` attaches to the existing generation instead of calling the
+provider again, and several readers (e.g. a second device) can follow the same
+stream.
+
+Generations are cancelled when their last reader has been gone for
+`STREAM_DISCONNECT_GRACE_SECONDS`, or explicitly by message ID. Cancellation
+propagates into the provider generator, which closes the SDK stream; partial
+output is still persisted by the stream's finish hook.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from logging_config import logger, debug_with_context
+from stream_events import StreamEvent, StreamAccumulator
+from configuration import STREAM_REPLAY_MAX_STREAMS, STREAM_REPLAY_TTL_SECONDS, STREAM_DISCONNECT_GRACE_SECONDS
+
+class IdempotencyKeyReused(ValueError):
+    """Raised when an Idempotency-Key is sent again with a different request."""
+
+class ChatStream:
+    """One upstream generation whose events can be replayed by any number of readers."""
+
+    def __init__(self, message_id: str, provider: str, conversation_id: str,
+                 idempotency_key: Optional[str] = None, singleflight_key: Optional[str] = None,
+                 cache_key: Optional[str] = None, near_duplicate_key: Optional[Any] = None,
+                 request_hash: Optional[str] = None):
+        self.message_id = message_id
+        self.provider = provider
+        self.conversation_id = conversation_id
+        self.idempotency_key = idempotency_key
+        # Fingerprint of the request the idempotency key was first sent with
+        self.request_hash = request_hash
+        self.singleflight_key = singleflight_key
+        # Response cache key the answer is stored under once it completes
+        self.cache_key = cache_key
+        # Near-duplicate cache key (NearDuplicateKey) the answer is indexed under
+        self.near_duplicate_key = near_duplicate_key
+        # Conversations of identical requests that joined this generation
+        self.shared_conversation_ids: List[str] = []
+        # Idempotency keys those requests were sent with
+        self.shared_idempotency_keys: List[str] = []
+        self.events: List[StreamEvent] = []
+        self.accumulator = StreamAccumulator()
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        self.cancel_reason: Optional[str] = None
+        self.readers = 0
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._abandon_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def status(self) -> str:
+        if not self.finished:
+            return "running"
+        if self.cancel_reason is not None:
+            return "cancelled"
+        if self.error is not None:
+            return "failed"
+        return "completed"
+
+    def cancel(self, reason: str) -> bool:
+        """
+        Abort the upstream generation.
+
+        Returns:
+            False if the stream had already finished
+        """
+        if self.finished or self._task is None:
+            return False
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+        self._task.cancel()
+        return True
+
+    def start(self, source: AsyncIterator[StreamEvent],
+              on_finish: Optional[Callable[["ChatStream"], Awaitable[None]]] = None) -> None:
+        """Start pumping events from the source into the replay buffer."""
+        self._task = asyncio.create_task(self._run(source, on_finish))
+
+    async def _run(self, source: AsyncIterator[StreamEvent],
+                   on_finish: Optional[Callable[["ChatStream"], Awaitable[None]]]) -> None:
+        try:
+            async for event in source:
+                self._publish(event)
+        except asyncio.CancelledError as e:
+            self.error = e
+            self.cancel_reason = self.cancel_reason or "cancelled"
+            debug_with_context(logger,
+                "Chat stream cancelled",
+                message_id=self.message_id,
+                reason=self.cancel_reason,
+                partial_chunks=self.accumulator.chunks
+            )
+            self._publish(StreamEvent.meta(StreamEvent.CANCELLED, self.message_id, {
+                "reason": self.cancel_reason,
+                "partial": True
+            }))
+        except Exception as e:
+            self.error = e
+            # End the stream with a clean error event instead of a dropped connection
+            data = {
+                "status": getattr(e, "status_code", 500),
+                "detail": getattr(e, "detail", None) or str(e)
+            }
+            retry_after = (getattr(e, "headers", None) or {}).get("Retry-After")
+            if retry_after:
+                data["retry_after"] = int(retry_after)
+            self._publish(StreamEvent.meta(StreamEvent.ERROR, self.message_id, data))
+        finally:
+            self.finished_at = time.monotonic()
+            self._notify()
+            if on_finish:
+                try:
+                    await on_finish(self)
+                except Exception as e:
+                    logger.error(f"Error finishing stream {self.message_id}: {str(e)}")
+
+    def _publish(self, event: StreamEvent) -> None:
+        event.seq = len(self.events) + 1
+        self.events.append(event)
+        self._notify()
+
+    def _notify(self) -> None:
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    async def read(self, after: int = 0) -> AsyncGenerator[StreamEvent, None]:
+        """
+        Yield buffered and live events with a sequence number greater than `after`.
+
+        A failed generation ends with its error event rather than raising.
+        """
+        index = max(0, after)
+        self.readers += 1
+        if self._abandon_handle is not None:
+            self._abandon_handle.cancel()
+            self._abandon_handle = None
+        try:
+            while True:
+                waiter = self._wakeup
+                if index < len(self.events):
+                    batch = self.events[index:]
+                    index += len(batch)
+                    for event in batch:
+                        yield event
+                    continue
+                if self.finished:
+                    return
+                await waiter.wait()
+        finally:
+            self.readers -= 1
+            if self.readers == 0 and not self.finished:
+                self._abandon_handle = asyncio.get_running_loop().call_later(
+                    STREAM_DISCONNECT_GRACE_SECONDS, self._cancel_if_abandoned
+                )
+
+    def _cancel_if_abandoned(self) -> None:
+        self._abandon_handle = None
+        if self.readers == 0 and self.cancel("client_disconnected"):
+            logger.info(f"Cancelled chat stream {self.message_id}: no readers left")
+
+class StreamRegistry:
+    """Bounded, TTL-evicted registry of chat streams keyed by message ID, idempotency key
+    and, while running, singleflight key."""
+
+    def __init__(self, max_streams: int, ttl_seconds: float):
+        self.max_streams = max_streams
+        self.ttl_seconds = ttl_seconds
+        self._streams: "OrderedDict[str, ChatStream]" = OrderedDict()
+        # Idempotency key -> (message ID, fingerprint of the request it was first sent with)
+        self._idempotency: Dict[str, Tuple[str, Optional[str]]] = {}
+        self._inflight: Dict[str, str] = {}
+        self.singleflight_hits = 0
+
+    def register(self, stream: ChatStream) -> None:
+        """Add a stream, evicting expired and excess finished streams."""
+        self._evict()
+        self._streams[stream.message_id] = stream
+        if stream.idempotency_key:
+            self._idempotency[stream.idempotency_key] = (stream.message_id, stream.request_hash)
+        if stream.singleflight_key:
+            self._inflight[stream.singleflight_key] = stream.message_id
+
+    def join_inflight(self, key: str, conversation_id: str, idempotency_key: Optional[str] = None,
+                      request_hash: Optional[str] = None) -> Optional[ChatStream]:
+        """
+        Attach a conversation to a running stream with the same singleflight key.
+
+        The joining request's idempotency key, if any, is bound to the shared
+        stream so a retry attaches to it instead of starting a new generation.
+
+        Returns:
+            The shared stream, or None if no identical generation is in flight
+        """
+        message_id = self._inflight.get(key)
+        stream = self._streams.get(message_id) if message_id else None
+        if stream is None or stream.finished:
+            self._inflight.pop(key, None)
+            return None
+        stream.shared_conversation_ids.append(conversation_id)
+        if idempotency_key:
+            self._idempotency[idempotency_key] = (stream.message_id, request_hash)
+            stream.shared_idempotency_keys.append(idempotency_key)
+        self.singleflight_hits += 1
+        return stream
+
+    def get(self, message_id: str) -> Optional[ChatStream]:
+        self._evict()
+        return self._streams.get(message_id)
+
+    def get_by_idempotency_key(self, key: str, request_hash: Optional[str]) -> Optional[ChatStream]:
+        """
+        Return the stream an idempotency key was first used for, if it is still kept.
+
+        Raises:
+            IdempotencyKeyReused: If the key was first sent with a different request
+        """
+        self._evict()
+        message_id, first_request_hash = self._idempotency.get(key, (None, None))
+        stream = self._streams.get(message_id) if message_id else None
+        if stream and first_request_hash != request_hash:
+            raise IdempotencyKeyReused(f"Idempotency-Key {key} was already used with a different request")
+        return stream
+
+    def _remove(self, message_id: str) -> None:
+        stream = self._streams.pop(message_id, None)
+        if stream:
+            for key in [stream.idempotency_key, *stream.shared_idempotency_keys]:
+                if key and self._idempotency.get(key, (None,))[0] == message_id:
+                    del self._idempotency[key]
+        if stream and stream.singleflight_key and self._inflight.get(stream.singleflight_key) == message_id:
+            del self._inflight[stream.singleflight_key]
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        expired = [
+            message_id for message_id, stream in self._streams.items()
+            if stream.finished and now - stream.finished_at > self.ttl_seconds
+        ]
+        for message_id in expired:
+            self._remove(message_id)
+
+        # Over capacity: drop the oldest finished streams; running streams are kept
+        if len(self._streams) > self.max_streams:
+            for message_id in [m for m, s in self._streams.items() if s.finished]:
+                if len(self._streams) <= self.max_streams:
+                    break
+                self._remove(message_id)
+                debug_with_context(logger, "Evicted chat stream from replay registry", message_id=message_id)
+
+    def running(self) -> int:
+        """Number of generations still in progress."""
+        return sum(1 for stream in self._streams.values() if not stream.finished)
+
+    def stats(self) -> Dict[str, int]:
+        """Count registered streams by status."""
+        self._evict()
+        counts = {"running": 0, "completed": 0, "cancelled": 0, "failed": 0}
+        for stream in self._streams.values():
+            counts[stream.status] += 1
+        counts["readers"] = sum(stream.readers for stream in self._streams.values())
+        counts["singleflight_hits"] = self.singleflight_hits
+        return counts
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """Parse a Last-Event-ID header value; invalid values restart from the beginning."""
+    try:
+        return max(0, int(value)) if value else 0
+    except ValueError:
+        return 0
+
+# Process-wide registry
+stream_registry = StreamRegistry(STREAM_REPLAY_MAX_STREAMS, STREAM_REPLAY_TTL_SECONDS)
@@ -0,0 +1,156 @@
+"""
+Circuit breakers per (provider, model).
+
+Each breaker keeps a rolling window of call outcomes. When enough calls in the
+window failed, or were slower than CIRCUIT_SLOW_CALL_MS to their first token,
+the circuit opens and the model is skipped without being called. After
+CIRCUIT_OPEN_SECONDS it becomes half-open and lets a limited number of probe
+requests through: a healthy probe closes it, a failed or slow one reopens it.
+"""
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from logging_config import logger
+from configuration import (
+    CIRCUIT_BREAKER_ENABLED,
+    CIRCUIT_WINDOW_SECONDS,
+    CIRCUIT_MIN_REQUESTS,
+    CIRCUIT_ERROR_RATE,
+    CIRCUIT_SLOW_CALL_MS,
+    CIRCUIT_SLOW_CALL_RATE,
+    CIRCUIT_OPEN_SECONDS,
+    CIRCUIT_HALF_OPEN_PROBES
+)
+
+class CircuitBreaker:
+    """Rolling error-rate and latency breaker for one model."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self.state = self.CLOSED
+        self.opened_at: Optional[float] = None
+        self.trips = 0
+        self.rejected = 0
+        self._probes = 0
+        # (timestamp, failed, slow)
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls are currently being skipped (open and not yet due for probing)."""
+        return (CIRCUIT_BREAKER_ENABLED and self.state == self.OPEN
+                and time.monotonic() - self.opened_at < CIRCUIT_OPEN_SECONDS)
+
+    def allow_request(self) -> bool:
+        """Whether the model may be called now; reserves a probe slot when half-open."""
+        if not CIRCUIT_BREAKER_ENABLED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < CIRCUIT_OPEN_SECONDS:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probes = 0
+        if self.state == self.HALF_OPEN:
+            if self._probes >= CIRCUIT_HALF_OPEN_PROBES:
+                self.rejected += 1
+                return False
+            self._probes += 1
+        return True
+
+    def record_success(self, latency: float) -> None:
+        """Record a completed call; `latency` is its time to first token in seconds."""
+        slow = CIRCUIT_SLOW_CALL_MS > 0 and latency * 1000 > CIRCUIT_SLOW_CALL_MS
+        if self.state == self.HALF_OPEN:
+            self.release()
+            if slow:
+                self._trip("slow probe")
+            else:
+                self._close()
+            return
+        self._add(failed=False, slow=slow)
+
+    def record_failure(self) -> None:
+        """Record a call that raised before completing."""
+        if self.state == self.HALF_OPEN:
+            self.release()
+            self._trip("failed probe")
+            return
+        self._add(failed=True, slow=False)
+
+    def release(self) -> None:
+        """Free a half-open probe slot without an outcome (e.g. the call was cancelled)."""
+        if self._probes > 0:
+            self._probes -= 1
+
+    def _add(self, failed: bool, slow: bool) -> None:
+        now = time.monotonic()
+        self._outcomes.append((now, failed, slow))
+        self._prune(now)
+        total = len(self._outcomes)
+        if self.state != self.CLOSED or total < CIRCUIT_MIN_REQUESTS:
+            return
+        error_rate = sum(1 for _, f, _ in self._outcomes if f) / total
+        slow_rate = sum(1 for _, _, s in self._outcomes if s) / total
+        if error_rate >= CIRCUIT_ERROR_RATE:
+            self._trip(f"error rate {error_rate:.0%}")
+        elif CIRCUIT_SLOW_CALL_MS > 0 and slow_rate >= CIRCUIT_SLOW_CALL_RATE:
+            self._trip(f"slow call rate {slow_rate:.0%}")
+
+    def _prune(self, now: float) -> None:
+        while self._outcomes and now - self._outcomes[0][0] > CIRCUIT_WINDOW_SECONDS:
+            self._outcomes.popleft()
+
+    def _trip(self, reason: str) -> None:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self._outcomes.clear()
+        logger.warning(f"Circuit opened for {self.provider}:{self.model} ({reason})")
+
+    def _close(self) -> None:
+        self.state = self.CLOSED
+        self.opened_at = None
+        self._outcomes.clear()
+        logger.info(f"Circuit closed for {self.provider}:{self.model}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._prune(now)
+        total = len(self._outcomes)
+        return {
+            "state": self.state,
+            "requests": total,
+            "error_rate": round(sum(1 for _, f, _ in self._outcomes if f) / total, 4) if total else 0.0,
+            "slow_call_rate": round(sum(1 for _, _, s in self._outcomes if s) / total, 4) if total else 0.0,
+            "open_for_seconds": round(max(0.0, CIRCUIT_OPEN_SECONDS - (now - self.opened_at)), 1)
+                if self.state == self.OPEN else 0.0,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+class CircuitBreakerRegistry:
+    """Lazily created breakers keyed by (provider, model)."""
+
+    def __init__(self):
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, provider: str, model: str) -> CircuitBreaker:
+        key = (provider, model)
+        if key not in self._breakers:
+            self._breakers[key] = CircuitBreaker(provider, model)
+        return self._breakers[key]
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (provider, model), breaker in self._breakers.items():
+            result.setdefault(provider, {})[model] = breaker.snapshot()
+        return result
+
+# Process-wide breakers
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,197 @@
+"""
+Model comparison (/chat/compare).
+
+One request runs the same conversation on several sources ("provider:model")
+at once and multiplexes their answers into one stream. Every event carries
+the `source` that produced it, so clients can split the stream into columns.
+Each source ends with a `source_done` event; a final `summary` event reports
+per-source time to first token, tokens/sec and token usage before the done event.
+
+A source is exactly one model, without failover or hedging, so its timings
+describe that model. It still queues behind the model's upstream limit, is
+skipped while the model's circuit is open, and feeds the latency statistics.
+
+With `cancel="first_token"` the other sources are cancelled as soon as one
+sends its first token; with `cancel="first_complete"` as soon as one completes
+("fastest answer wins"). Cancelled sources end with a `cancelled` status.
+"""
+import asyncio
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from models import CompareChatRequest, ConversationMessage
+from providers import ProviderFactory
+from aiproviders import build_call_context
+from call_context import CallContext
+from deadlines import Deadline
+from stream_events import StreamEvent, StreamAccumulator
+from provider_stats import CHARS_PER_TOKEN
+from logging_config import logger, debug_with_context
+
+# Marks the end of a source's stream in the shared queue
+_END = object()
+
+class _Source:
+    """One model streaming into the queue shared by all sources of a comparison."""
+
+    def __init__(self, name: str, queue: asyncio.Queue, messages: List[ConversationMessage], context: CallContext):
+        self.name = name
+        self.provider, self.model = context.chain[0]
+        self.context = context
+        self.accumulator = StreamAccumulator()
+        self.status = "running"
+        self.error: Optional[Dict[str, Any]] = None
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._queue = queue
+        self._task = asyncio.create_task(self._pump(messages))
+
+    async def _pump(self, messages: List[ConversationMessage]) -> None:
+        try:
+            async for event in self.provider.try_with_models(messages, self.context):
+                self._queue.put_nowait((self, event))
+        except Exception as e:
+            self._queue.put_nowait((self, e))
+        else:
+            self._queue.put_nowait((self, _END))
+
+    def finish(self, status: str, error: Optional[BaseException] = None) -> None:
+        self.status = status
+        self.finished_at = time.monotonic()
+        if error is not None:
+            self.error = {
+                "status": getattr(error, "status_code", 500),
+                "detail": getattr(error, "detail", None) or str(error)
+            }
+
+    async def cancel(self, reason: str) -> None:
+        """Stop the source: the token tells its context why, the task cancel interrupts any wait."""
+        self.context.cancellation.cancel(reason)
+        if not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.status == "running":
+            self.finish("cancelled")
+
+    def metrics(self) -> Dict[str, Any]:
+        """Time to first token, output rate and usage of the source so far."""
+        end = self.finished_at or time.monotonic()
+        usage = self.accumulator.usage
+        output_tokens = usage.get("output_tokens") if usage else None
+        estimated = not output_tokens
+        if estimated:
+            output_tokens = round(len(self.accumulator.text()) / CHARS_PER_TOKEN)
+        # Output rate after the first token, so it is not skewed by queueing and TTFT
+        generating = end - self.first_token_at if self.first_token_at is not None else 0.0
+        metrics = {
+            "status": self.status,
+            "model": self.accumulator.model or self.model,
+            "ttft_ms": round((self.first_token_at - self.started_at) * 1000, 1)
+                if self.first_token_at is not None else None,
+            "duration_ms": round((end - self.started_at) * 1000, 1),
+            "output_chars": len(self.accumulator.text()),
+            "output_tokens": output_tokens,
+            "output_tokens_estimated": estimated,
+            "tokens_per_second": round(output_tokens / generating, 1) if generating > 0 and output_tokens else None,
+            "usage": usage,
+        }
+        if self.error is not None:
+            metrics["error"] = self.error
+        return metrics
+
+def _tagged(event: StreamEvent, source: _Source) -> StreamEvent:
+    event.source = source.name
+    return event
+
+def _source_done(message_id: str, source: _Source) -> StreamEvent:
+    return _tagged(StreamEvent.meta(StreamEvent.SOURCE_DONE, message_id, source.metrics(),
+                                    model=source.accumulator.model), source)
+
+async def compare_stream(
+    request: CompareChatRequest,
+    message_id: str,
+    deadline: Optional[Deadline] = None
+) -> AsyncGenerator[StreamEvent, None]:
+    """
+    Stream every source's answer to the request, tagged by source, then a summary.
+
+    Sources whose provider is not initialized fail at once with a `source_done`
+    event; the comparison itself only ends with the summary and done events.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    sources: List[_Source] = []
+    failed_to_start: Dict[str, Dict[str, Any]] = {}
+    for name in request.sources:
+        provider_name, _, model = name.partition(":")
+        try:
+            provider = ProviderFactory.get_provider(provider_name)
+        except Exception as e:
+            failed_to_start[name] = {"status": getattr(e, "status_code", 500),
+                                     "detail": getattr(e, "detail", None) or str(e)}
+            continue
+        context = build_call_context(request, provider_name, message_id, deadline, chain=[(provider, model)])
+        sources.append(_Source(name, queue, request.messages, context))
+
+    debug_with_context(logger,
+        "Starting comparison",
+        message_id=message_id,
+        sources=request.sources,
+        cancel=request.cancel
+    )
+
+    winner: Optional[_Source] = None
+    try:
+        for name, error in failed_to_start.items():
+            event = StreamEvent.meta(StreamEvent.SOURCE_DONE, message_id, {"status": "failed", "error": error})
+            event.source = name
+            yield event
+
+        while any(source.status == "running" for source in sources):
+            source, item = await queue.get()
+            if source.status != "running":
+                # Cancelled while this item was queued
+                continue
+
+            if isinstance(item, StreamEvent):
+                source.accumulator.add(item)
+                if item.kind == StreamEvent.USAGE:
+                    # Reported once per source, in its source_done event and the summary
+                    continue
+                if item.kind == StreamEvent.DELTA and source.first_token_at is None:
+                    source.first_token_at = time.monotonic()
+                if not item.is_done:
+                    yield _tagged(item, source)
+                    reason = "first_token" if item.kind == StreamEvent.DELTA else None
+                else:
+                    source.finish("completed")
+                    yield _source_done(message_id, source)
+                    reason = "first_complete"
+                if reason is not None and reason == request.cancel and winner is None:
+                    winner = source
+                    for other in sources:
+                        if other is not winner and other.status == "running":
+                            await other.cancel(reason)
+                            yield _source_done(message_id, other)
+                continue
+
+            if item is _END:
+                source.finish("failed", RuntimeError("stream ended without a done event"))
+            else:
+                logger.warning(f"Comparison source {source.name} failed: {str(item)}")
+                source.finish("failed", item)
+            yield _source_done(message_id, source)
+    finally:
+        for source in sources:
+            await source.cancel("comparison_closed")
+
+    summary = {name: {"status": "failed", "error": error} for name, error in failed_to_start.items()}
+    summary.update({source.name: source.metrics() for source in sources})
+    yield StreamEvent.meta(StreamEvent.SUMMARY, message_id, {
+        "cancel": request.cancel,
+        "winner": winner.name if winner is not None else None,
+        "sources": summary
+    })
+    yield StreamEvent.done(message_id)
@@ -0,0 +1,227 @@
+"""
+Flush-aware stream compression for chat responses and transparent
+decompression of compressed request bodies.
+"""
+import io
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncGenerator, AsyncIterator, Dict, Optional, Type, Union
+import zstandard
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from logging_config import logger, get_request_id
+
+class StreamCompressor:
+    """Base class for per-stream compressors that flush after every frame."""
+    encoding = ""
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a frame and flush it so the client can decode it immediately."""
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        """Terminate the compressed stream."""
+        raise NotImplementedError
+
+class ZstdStreamCompressor(StreamCompressor):
+    encoding = "zstd"
+
+    def __init__(self, level: int = 3):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+class GzipStreamCompressor(StreamCompressor):
+    encoding = "gzip"
+
+    def __init__(self, level: int = 6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+# Supported encodings, in server preference order
+STREAM_COMPRESSORS: Dict[str, Type[StreamCompressor]] = {
+    "zstd": ZstdStreamCompressor,
+    "gzip": GzipStreamCompressor,
+}
+
+def negotiate_stream_compressor(accept_encoding: Optional[str], levels: Optional[Dict[str, int]] = None) -> Optional[StreamCompressor]:
+    """
+    Pick a stream compressor from the Accept-Encoding header.
+
+    Args:
+        accept_encoding: The raw Accept-Encoding header value
+        levels: Optional compression level per encoding
+
+    Returns:
+        A compressor instance, or None to send the stream uncompressed
+    """
+    if not accept_encoding:
+        return None
+
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        fields = [f.strip() for f in part.split(";")]
+        coding = fields[0].lower()
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+
+    levels = levels or {}
+    candidates = [
+        coding for coding in STREAM_COMPRESSORS
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0
+    ]
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda c: accepted.get(c, accepted.get("*", 0.0)))
+    compressor_class = STREAM_COMPRESSORS[best]
+    return compressor_class(levels[best]) if best in levels else compressor_class()
+
+async def compress_stream(
+    chunks: AsyncIterator[Union[str, bytes]],
+    compressor: StreamCompressor
+) -> AsyncGenerator[bytes, None]:
+    """Compress each chunk of a stream, flushing per chunk."""
+    async for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    tail = compressor.finish()
+    if tail:
+        yield tail
+
+class DecompressionError(ValueError):
+    """Raised when a request body cannot be decompressed."""
+
+class BodyTooLargeError(ValueError):
+    """Raised when a decompressed request body exceeds the configured limit."""
+
+def decompress_body(body: bytes, encoding: str, max_size: int) -> bytes:
+    """
+    Decompress a request body without ever inflating more than max_size bytes.
+
+    Raises:
+        DecompressionError: If the body is not valid for the given encoding
+        BodyTooLargeError: If the decompressed body exceeds max_size
+    """
+    try:
+        if encoding == "gzip":
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = decompressor.decompress(body, max_size + 1)
+            if len(data) <= max_size and not decompressor.eof:
+                raise DecompressionError("Truncated gzip body")
+        elif encoding == "zstd":
+            # The reader caps what a decompression bomb can inflate to but accepts a
+            # truncated frame; once the output is known to fit, check the frame ended
+            reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body))
+            data = reader.read(max_size + 1)
+            if len(data) <= max_size:
+                decompressor = zstandard.ZstdDecompressor().decompressobj()
+                data = decompressor.decompress(body)
+                if not decompressor.eof:
+                    raise DecompressionError("Truncated zstd body")
+        else:
+            raise DecompressionError(f"Unsupported Content-Encoding: {encoding}")
+    except (zlib.error, zstandard.ZstdError) as e:
+        raise DecompressionError(f"Invalid {encoding} body: {str(e)}")
+
+    if len(data) > max_size:
+        raise BodyTooLargeError(f"Decompressed body exceeds {max_size} bytes")
+    return data
+
+class RequestDecompressionMiddleware:
+    """
+    ASGI middleware that transparently decompresses `Content-Encoding: gzip|zstd`
+    request bodies before they reach request validation; other encodings get a 415.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        encoding = headers.get(b"content-encoding", b"").decode("latin-1").strip().lower()
+        if encoding in ("", "identity"):
+            await self.app(scope, receive, send)
+            return
+        if encoding not in STREAM_COMPRESSORS:
+            await self._error(scope, receive, send, 415, f"Unsupported Content-Encoding: {encoding}")
+            return
+
+        # Read the full compressed body; it is bounded by the decompressed limit
+        chunks = []
+        received = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            received += len(chunk)
+            if received > self.max_size:
+                await self._error(scope, receive, send, 413, "Compressed request body too large")
+                return
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+
+        try:
+            body = decompress_body(b"".join(chunks), encoding, self.max_size)
+        except BodyTooLargeError as e:
+            await self._error(scope, receive, send, 413, str(e))
+            return
+        except DecompressionError as e:
+            logger.error(f"Request decompression failed: {str(e)}")
+            await self._error(scope, receive, send, 400, str(e))
+            return
+
+        new_headers = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        new_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        scope = dict(scope, headers=new_headers)
+
+        body_sent = False
+
+        async def receive_decompressed() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, receive_decompressed, send)
+
+    async def _error(self, scope: Scope, receive: Receive, send: Send, status_code: int, message: str) -> None:
+        response = JSONResponse(
+            status_code=status_code,
+            content={
+                "status": "error",
+                "code": status_code,
+                "message": message,
+                "request_id": get_request_id(),
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
+        await response(scope, receive, send)
@@ -40,6 +40,11 @@ GEMINI_MODEL_DEFAULT = os.getenv("GEMINI_MODEL_DEFAULT", "gemini-2.0-flash")
 GEMINI_MODEL_FALLBACK = os.getenv("GEMINI_MODEL_FALLBACK", "gemini-1.5-pro")
 GROQ_MODEL_DEFAULT = os.getenv("GROQ_MODEL_DEFAULT", "llama-3.3-70b-versatile")
 GROQ_MODEL_FALLBACK = os.getenv("GROQ_MODEL_FALLBACK", "mixtral-8x7b-32768")
+# Models used in degradation mode (default: the fallback model)
+OPENAI_MODEL_ECONOMY = os.getenv("OPENAI_MODEL_ECONOMY", OPENAI_MODEL_FALLBACK)
+ANTHROPIC_MODEL_ECONOMY = os.getenv("ANTHROPIC_MODEL_ECONOMY", ANTHROPIC_MODEL_FALLBACK)
+GEMINI_MODEL_ECONOMY = os.getenv("GEMINI_MODEL_ECONOMY", GEMINI_MODEL_FALLBACK)
+GROQ_MODEL_ECONOMY = os.getenv("GROQ_MODEL_ECONOMY", GROQ_MODEL_FALLBACK)
 
 # Temperature Settings
 OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", 0.3))
@@ -80,12 +85,277 @@ ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-# Response timeout
-RESPONSE_TIMEOUT = float(os.getenv("RESPONSE_TIMEOUT", 30.0))
+# Response timeout: total deadline budget of a chat request in seconds, across all failover attempts
+RESPONSE_TIMEOUT = float(os.getenv("RESPONSE_TIMEOUT", 120.0))
+# Deadline phases, each capped by what is left of the total budget
+DEADLINE_CONNECT_SECONDS = float(os.getenv("DEADLINE_CONNECT_SECONDS", 5.0))
+DEADLINE_TTFT_SECONDS = float(os.getenv("DEADLINE_TTFT_SECONDS", 20.0))
+DEADLINE_INTER_TOKEN_SECONDS = float(os.getenv("DEADLINE_INTER_TOKEN_SECONDS", 15.0))
+# Limits for the per-request X-Request-Timeout override
+DEADLINE_MIN_SECONDS = float(os.getenv("DEADLINE_MIN_SECONDS", 5.0))
+DEADLINE_MAX_SECONDS = float(os.getenv("DEADLINE_MAX_SECONDS", 300.0))
+
+# Context windows: trim history to fit the model's window minus max_tokens
+CONTEXT_TRIM_ENABLED = os.getenv("CONTEXT_TRIM_ENABLED", "true").lower() == "true"
+# "drop_oldest", or "keep_first_last" (first message and the last CONTEXT_KEEP_LAST_MESSAGES are dropped last)
+CONTEXT_TRIM_STRATEGY = os.getenv("CONTEXT_TRIM_STRATEGY", "drop_oldest")
+if CONTEXT_TRIM_STRATEGY not in ("drop_oldest", "keep_first_last"):
+    raise ValueError(f"Environment Error: Invalid CONTEXT_TRIM_STRATEGY '{CONTEXT_TRIM_STRATEGY}'")
+CONTEXT_KEEP_LAST_MESSAGES = int(os.getenv("CONTEXT_KEEP_LAST_MESSAGES", 6))
+# Tokens kept free on top of max_tokens, for counting error and formatting
+CONTEXT_SAFETY_MARGIN_TOKENS = int(os.getenv("CONTEXT_SAFETY_MARGIN_TOKENS", 256))
+# Context window per model in tokens, "model=tokens,..."; other models get CONTEXT_DEFAULT_WINDOW
+CONTEXT_WINDOWS = {
+    model.strip(): int(tokens)
+    for model, _, tokens in (
+        entry.partition("=") for entry in os.getenv(
+            "CONTEXT_WINDOWS",
+            "gpt-4o=128000,gpt-4o-mini=128000,claude-3-5-sonnet-latest=200000,claude-3-5-haiku-latest=200000,"
+            "gemini-2.0-flash=1048576,gemini-1.5-pro=2097152,llama-3.3-70b-versatile=131072,mixtral-8x7b-32768=32768"
+        ).split(",") if entry.strip()
+    )
+}
+CONTEXT_DEFAULT_WINDOW = int(os.getenv("CONTEXT_DEFAULT_WINDOW", 32768))
+# Token estimate for models without a local tokenizer (Claude, Gemini)
+CONTEXT_HEURISTIC_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_HEURISTIC_CHARS_PER_TOKEN", 3.5))
+# Cached token counts (by content hash) and the size above which counting runs in a worker thread
+CONTEXT_TOKEN_CACHE_SIZE = int(os.getenv("CONTEXT_TOKEN_CACHE_SIZE", 10000))
+CONTEXT_OFFLOAD_MIN_CHARS = int(os.getenv("CONTEXT_OFFLOAD_MIN_CHARS", 20000))
+
+# Provider HTTP transport (shared httpx pools injected into the SDK clients)
+TRANSPORT_MAX_CONNECTIONS = int(os.getenv("TRANSPORT_MAX_CONNECTIONS", 100))
+TRANSPORT_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("TRANSPORT_MAX_KEEPALIVE_CONNECTIONS", 20))
+TRANSPORT_KEEPALIVE_EXPIRY = float(os.getenv("TRANSPORT_KEEPALIVE_EXPIRY", 60))
+TRANSPORT_HTTP2 = os.getenv("TRANSPORT_HTTP2", "true").lower() == "true"
+TRANSPORT_DNS_CACHE_TTL = float(os.getenv("TRANSPORT_DNS_CACHE_TTL", 300))
+# Connections opened per provider host at startup (HTTP/1.1 only; HTTP/2 multiplexes one)
+TRANSPORT_WARM_CONNECTIONS = int(os.getenv("TRANSPORT_WARM_CONNECTIONS", 2))
+# Seconds between background keepalive pings (0 disables); keep below TRANSPORT_KEEPALIVE_EXPIRY
+TRANSPORT_KEEPALIVE_INTERVAL = float(os.getenv("TRANSPORT_KEEPALIVE_INTERVAL", 30))
+
+# Provider latency statistics: recent samples kept per provider and model
+PROVIDER_STATS_WINDOW = int(os.getenv("PROVIDER_STATS_WINDOW", 200))
+# Weight of the newest sample in the EWMA statistics (0..1)
+PROVIDER_STATS_EWMA_ALPHA = float(os.getenv("PROVIDER_STATS_EWMA_ALPHA", 0.2))
+
+# Auto routing (/chat/auto): pick the provider by live statistics
+# Policy: "ttft" (fastest first token), "throughput" (most tokens/s) or "cost" (cheapest within the TTFT SLO)
+ROUTER_POLICY = os.getenv("ROUTER_POLICY", "ttft")
+if ROUTER_POLICY not in ("ttft", "throughput", "cost"):
+    raise ValueError(f"Environment Error: Invalid ROUTER_POLICY '{ROUTER_POLICY}'")
+# Share of requests routed to a random healthy provider to keep statistics fresh
+ROUTER_EXPLORATION_RATE = float(os.getenv("ROUTER_EXPLORATION_RATE", 0.05))
+# Providers whose recent error rate is above this are avoided while others are healthy
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", 0.3))
+# p90 TTFT a provider must meet to be considered by the "cost" policy
+ROUTER_TTFT_SLO_MS = float(os.getenv("ROUTER_TTFT_SLO_MS", 2000))
+# Output price per million tokens, "model=price,..."; models without a price rank last under "cost"
+ROUTER_MODEL_COSTS = {
+    model.strip(): float(price)
+    for model, _, price in (
+        entry.partition("=") for entry in os.getenv("ROUTER_MODEL_COSTS", "").split(",") if entry.strip()
+    )
+}
+
+# Hedged requests: race the hedge target when the default model is slow to its first token
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+# Hedge once the default model is slower than this TTFT percentile (per-provider overrides below)
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 90))
+# TTFT samples needed before the percentile is trusted; HEDGE_DEFAULT_DELAY_MS is used until then
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv("HEDGE_DEFAULT_DELAY_MS", 2000))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", 250))
+
+# Circuit breakers per (provider, model): skip models that keep failing or stalling
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", 60))
+# Calls needed in the window before the rates are evaluated
+CIRCUIT_MIN_REQUESTS = int(os.getenv("CIRCUIT_MIN_REQUESTS", 10))
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", 0.5))
+# Calls slower than this to their first token count as slow (0 disables the latency check)
+CIRCUIT_SLOW_CALL_MS = float(os.getenv("CIRCUIT_SLOW_CALL_MS", 15000))
+CIRCUIT_SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", 0.8))
+# How long an open circuit skips the model before half-open probing
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", 1))
+
+# Failover chains, one per provider, tried in order: "provider[:model]>provider[:model];..."
+# e.g. "claude>claude:claude-3-5-haiku-latest>gpt:gpt-4o-mini" (no model: that provider's default model)
+# Providers without a chain use their default model, then their fallback model
+FAILOVER_CHAINS = os.getenv("FAILOVER_CHAINS", "")
+
+# Stream coalescing: merge small deltas into fewer SSE frames
+STREAM_COALESCE_ENABLED = os.getenv("STREAM_COALESCE_ENABLED", "true").lower() == "true"
+STREAM_COALESCE_WINDOW_MS = float(os.getenv("STREAM_COALESCE_WINDOW_MS", 16))
+STREAM_COALESCE_MAX_WINDOW_MS = float(os.getenv("STREAM_COALESCE_MAX_WINDOW_MS", 128))
+STREAM_COALESCE_MAX_BYTES = int(os.getenv("STREAM_COALESCE_MAX_BYTES", 512))
+
+# Resumable streams
+# Finished streams stay replayable (Last-Event-ID / Idempotency-Key) for this long
+STREAM_REPLAY_TTL_SECONDS = float(os.getenv("STREAM_REPLAY_TTL_SECONDS", 300))
+STREAM_REPLAY_MAX_STREAMS = int(os.getenv("STREAM_REPLAY_MAX_STREAMS", 1000))
+# Cancel the upstream generation once no client has been reading it for this long
+STREAM_DISCONNECT_GRACE_SECONDS = float(os.getenv("STREAM_DISCONNECT_GRACE_SECONDS", 10))
+# Minimum seconds between client disconnect checks while streaming
+STREAM_DISCONNECT_CHECK_INTERVAL = float(os.getenv("STREAM_DISCONNECT_CHECK_INTERVAL", 0.5))
+
+# Singleflight: identical concurrent requests share one upstream generation
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "false").lower() == "true"
+# Only providers configured at or below this temperature are eligible
+SINGLEFLIGHT_MAX_TEMPERATURE = float(os.getenv("SINGLEFLIGHT_MAX_TEMPERATURE", 0.0))
+
+# Provider prompt caching: mark the system prompt and history prefix as cacheable (Anthropic)
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true"
+# Gemini explicit context caches for long history prefixes (billed for storage while they live)
+GEMINI_CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE_ENABLED", "false").lower() == "true"
+# Estimated prefix tokens not yet cached before a new context cache is created (the API has a minimum)
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", 4096))
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", 3600))
+GEMINI_CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CONTEXT_CACHE_MAX_ENTRIES", 100))
+
+# Response cache: replay completed answers to identical deterministic requests
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+# Only providers configured at or below this temperature are cached
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", 0.0))
+# In-process LRU size and entry lifetime (also the Redis TTL)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 3600))
+# Longer answers are not cached
+RESPONSE_CACHE_MAX_ENTRY_CHARS = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_CHARS", 100000))
+# Optional shared tier, e.g. redis://localhost:6379/0 (empty: in-process only)
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL", "")
+# Redis calls slower than this count as a miss
+RESPONSE_CACHE_REDIS_TIMEOUT_SECONDS = float(os.getenv("RESPONSE_CACHE_REDIS_TIMEOUT_SECONDS", 0.1))
+
+# Near-duplicate cache: answer single-turn prompts that differ only in casing, spacing or punctuation
+NEAR_DUPLICATE_CACHE_ENABLED = os.getenv("NEAR_DUPLICATE_CACHE_ENABLED", "false").lower() == "true"
+# Providers whose requests are eligible (default: all supported providers)
+NEAR_DUPLICATE_PROVIDERS = [p.strip() for p in os.getenv("NEAR_DUPLICATE_PROVIDERS", ",".join(SUPPORTED_PROVIDERS)).split(",") if p.strip()]
+# Estimated Jaccard similarity a cached prompt needs to answer a new one (per-provider overrides below)
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", 0.9))
+NEAR_DUPLICATE_MAX_TEMPERATURE = float(os.getenv("NEAR_DUPLICATE_MAX_TEMPERATURE", 0.0))
+# Longer prompts are not eligible
+NEAR_DUPLICATE_MAX_PROMPT_CHARS = int(os.getenv("NEAR_DUPLICATE_MAX_PROMPT_CHARS", 2000))
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", 5000))
+NEAR_DUPLICATE_TTL_SECONDS = float(os.getenv("NEAR_DUPLICATE_TTL_SECONDS", 3600))
+# MinHash permutations, split into LSH bands of equal size; characters per shingle
+NEAR_DUPLICATE_NUM_PERM = int(os.getenv("NEAR_DUPLICATE_NUM_PERM", 128))
+NEAR_DUPLICATE_BANDS = int(os.getenv("NEAR_DUPLICATE_BANDS", 32))
+if NEAR_DUPLICATE_NUM_PERM % NEAR_DUPLICATE_BANDS:
+    raise ValueError("Environment Error: NEAR_DUPLICATE_NUM_PERM must be a multiple of NEAR_DUPLICATE_BANDS")
+NEAR_DUPLICATE_SHINGLE_SIZE = int(os.getenv("NEAR_DUPLICATE_SHINGLE_SIZE", 4))
+
+# Upstream concurrency limits (per provider and model)
+# AIMD limit on concurrent streams, driven by 429s, Retry-After, rate-limit headers and first-token latency
+UPSTREAM_LIMITER_ENABLED = os.getenv("UPSTREAM_LIMITER_ENABLED", "true").lower() == "true"
+UPSTREAM_INITIAL_CONCURRENCY = int(os.getenv("UPSTREAM_INITIAL_CONCURRENCY", 16))
+UPSTREAM_MIN_CONCURRENCY = int(os.getenv("UPSTREAM_MIN_CONCURRENCY", 1))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", 256))
+# Multiplicative decrease on a 429 (or Anthropic 529)
+UPSTREAM_DECREASE_FACTOR = float(os.getenv("UPSTREAM_DECREASE_FACTOR", 0.5))
+# A first token slower than this multiple of the model's baseline trims the limit (0 disables)
+UPSTREAM_LATENCY_TOLERANCE = float(os.getenv("UPSTREAM_LATENCY_TOLERANCE", 2.0))
+UPSTREAM_LATENCY_DECREASE_FACTOR = float(os.getenv("UPSTREAM_LATENCY_DECREASE_FACTOR", 0.9))
+# Requests waiting for a slot per model, and how long each may wait (bounded by its deadline)
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", 256))
+UPSTREAM_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("UPSTREAM_MAX_QUEUE_WAIT_SECONDS", 10))
+# Block after a 429 without Retry-After
+UPSTREAM_DEFAULT_RETRY_AFTER_SECONDS = float(os.getenv("UPSTREAM_DEFAULT_RETRY_AFTER_SECONDS", 1))
+
+# Batch jobs (/chat/batch)
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", 1000))
+# Requests of all batch jobs executed at once, and per provider
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", 16))
+BATCH_PROVIDER_CONCURRENCY = {
+    provider.strip(): int(limit)
+    for provider, _, limit in (
+        entry.partition("=") for entry in os.getenv(
+            "BATCH_PROVIDER_CONCURRENCY", "gpt=4,claude=4,gemini=4,groq=4"
+        ).split(",") if entry.strip()
+    )
+}
+# Default execution mode: local (worker pool) or native (provider batch APIs where available)
+BATCH_DEFAULT_MODE = os.getenv("BATCH_DEFAULT_MODE", "local")
+if BATCH_DEFAULT_MODE not in ("local", "native"):
+    raise ValueError("Environment Error: BATCH_DEFAULT_MODE must be local or native")
+# Native batches go to the providers (OpenAI Batch, Anthropic Message Batches), or to an in-process stand-in
+BATCH_NATIVE_BACKEND = os.getenv("BATCH_NATIVE_BACKEND", "provider")
+if BATCH_NATIVE_BACKEND not in ("provider", "local"):
+    raise ValueError("Environment Error: BATCH_NATIVE_BACKEND must be provider or local")
+BATCH_NATIVE_POLL_SECONDS = float(os.getenv("BATCH_NATIVE_POLL_SECONDS", 60))
+# How often job progress is written to storage, and how long finished jobs stay in memory
+BATCH_PERSIST_INTERVAL_SECONDS = float(os.getenv("BATCH_PERSIST_INTERVAL_SECONDS", 2))
+BATCH_JOB_RETENTION_SECONDS = float(os.getenv("BATCH_JOB_RETENTION_SECONDS", 3600))
+
+# Model comparison (/chat/compare)
+# Sources (provider or provider:model) one comparison may run at once
+COMPARE_MAX_SOURCES = int(os.getenv("COMPARE_MAX_SOURCES", 4))
+if COMPARE_MAX_SOURCES < 1:
+    raise ValueError("Environment Error: COMPARE_MAX_SOURCES must be at least 1")
+# Models a comparison may name besides each provider's default, fallback and economy models and
+# the models in FAILOVER_CHAINS, e.g. "gpt:gpt-4.1,claude:claude-3-opus-latest"
+COMPARE_ALLOWED_MODELS = [m.strip() for m in os.getenv("COMPARE_ALLOWED_MODELS", "").split(",") if m.strip()]
+
+# Compression
+# Opt-in zstd/gzip compression of chat streams (negotiated via Accept-Encoding)
+STREAM_COMPRESSION_ENABLED = os.getenv("STREAM_COMPRESSION_ENABLED", "false").lower() == "true"
+STREAM_COMPRESSION_ZSTD_LEVEL = int(os.getenv("STREAM_COMPRESSION_ZSTD_LEVEL", 3))
+STREAM_COMPRESSION_GZIP_LEVEL = int(os.getenv("STREAM_COMPRESSION_GZIP_LEVEL", 6))
+# Upper bound for Content-Encoding: zstd|gzip request bodies once decompressed
+REQUEST_MAX_DECOMPRESSED_BYTES = int(os.getenv("REQUEST_MAX_DECOMPRESSED_BYTES", 8 * 1024 * 1024))
 
 # Rate Limiting
+# Per-client token buckets on new chat requests (POST /chat/...)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
 RATE_LIMIT_MAX_REQUESTS = int(os.getenv("RATE_LIMIT_MAX_REQUESTS", 500))
 RATE_LIMIT_WINDOW_SECONDS = int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", 3600))
+if RATE_LIMIT_MAX_REQUESTS < 1 or RATE_LIMIT_WINDOW_SECONDS < 1:
+    raise ValueError("Environment Error: RATE_LIMIT_MAX_REQUESTS and RATE_LIMIT_WINDOW_SECONDS must be at least 1")
+# Estimated prompt tokens per client per window (0: count requests only)
+RATE_LIMIT_MAX_TOKENS = int(os.getenv("RATE_LIMIT_MAX_TOKENS", 0))
+# Headers that identify a client, first match wins; clients without one are keyed by IP.
+# Only list headers a trusted gateway sets or validates: a client choosing its own value gets a fresh bucket each time
+RATE_LIMIT_CLIENT_HEADERS = [h.strip().lower() for h in os.getenv("RATE_LIMIT_CLIENT_HEADERS", "").split(",") if h.strip()]
+# Only enable behind a proxy that sets X-Forwarded-For itself
+RATE_LIMIT_TRUST_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "false").lower() == "true"
+# Proxies in front that append to X-Forwarded-For; the client is that many entries from the right
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", 1))
+if RATE_LIMIT_TRUSTED_PROXIES < 1:
+    raise ValueError("Environment Error: RATE_LIMIT_TRUSTED_PROXIES must be at least 1")
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", 100000))
+# Optional shared buckets across workers, e.g. redis://localhost:6379/0 (empty: per process)
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+RATE_LIMIT_REDIS_TIMEOUT_SECONDS = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT_SECONDS", 0.1))
+
+# Admission Control
+# Shed new chat requests with 503 + Retry-After while any load signal is over its limit (0 disables a signal)
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_RUNNING_STREAMS = int(os.getenv("ADMISSION_MAX_RUNNING_STREAMS", 500))
+# Requests waiting behind the upstream concurrency limits, across all models
+ADMISSION_MAX_QUEUED_UPSTREAM = int(os.getenv("ADMISSION_MAX_QUEUED_UPSTREAM", 200))
+# Smoothed event-loop lag, sampled every ADMISSION_LOOP_LAG_INTERVAL_MS
+ADMISSION_MAX_LOOP_LAG_MS = float(os.getenv("ADMISSION_MAX_LOOP_LAG_MS", 200))
+ADMISSION_LOOP_LAG_INTERVAL_MS = float(os.getenv("ADMISSION_LOOP_LAG_INTERVAL_MS", 100))
+# Base Retry-After for shed requests; each response waits 1-2x this
+ADMISSION_RETRY_AFTER_SECONDS = float(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 2))
+
+# Degradation Mode
+# Under load, move new requests from a provider's default model to its economy model with capped max_tokens
+DEGRADATION_ENABLED = os.getenv("DEGRADATION_ENABLED", "false").lower() == "true"
+# Enter when any signal of the default model reaches its threshold (0 disables a signal)
+DEGRADE_QUEUE_DEPTH = int(os.getenv("DEGRADE_QUEUE_DEPTH", 16))
+DEGRADE_TOKEN_USAGE = float(os.getenv("DEGRADE_TOKEN_USAGE", 0.9))
+DEGRADE_TTFT_P95_MS = float(os.getenv("DEGRADE_TTFT_P95_MS", 5000))
+# p95 TTFT uses samples from the last DEGRADE_TTFT_WINDOW_SECONDS, and needs DEGRADE_MIN_SAMPLES of them
+DEGRADE_MIN_SAMPLES = int(os.getenv("DEGRADE_MIN_SAMPLES", 20))
+DEGRADE_TTFT_WINDOW_SECONDS = float(os.getenv("DEGRADE_TTFT_WINDOW_SECONDS", 60))
+# Leave after DEGRADE_MIN_SECONDS once every signal is below DEGRADE_EXIT_RATIO x its threshold
+DEGRADE_EXIT_RATIO = float(os.getenv("DEGRADE_EXIT_RATIO", 0.7))
+DEGRADE_MIN_SECONDS = float(os.getenv("DEGRADE_MIN_SECONDS", 30))
+# Output cap for degraded requests (0: keep the provider's max_tokens)
+DEGRADE_MAX_TOKENS = int(os.getenv("DEGRADE_MAX_TOKENS", 512))
+# Share of requests still sent to the default model while degraded, to keep its signals current
+DEGRADE_PROBE_FRACTION = float(os.getenv("DEGRADE_PROBE_FRACTION", 0.05))
 
 # Environment
 PYSERVER_ENV = os.getenv("PYSERVER_ENV", "development")
@@ -99,36 +369,60 @@ PROVIDER_SETTINGS = {
         'api_key': OPENAI_API_KEY,
         'default_model': OPENAI_MODEL_DEFAULT,
         'fallback_model': OPENAI_MODEL_FALLBACK,
+        'economy_model': OPENAI_MODEL_ECONOMY,
         'temperature': OPENAI_TEMPERATURE,
         'max_tokens': OPENAI_MAX_TOKENS,
-        'system_prompt': GPT_SYSTEM_PROMPT
+        'system_prompt': GPT_SYSTEM_PROMPT,
+        'hedge_percentile': float(os.getenv("OPENAI_HEDGE_PERCENTILE", HEDGE_PERCENTILE)),
+        'near_duplicate_threshold': float(os.getenv("OPENAI_NEAR_DUPLICATE_THRESHOLD", NEAR_DUPLICATE_THRESHOLD))
     },
     'claude': {
         'api_key': ANTHROPIC_API_KEY,
         'default_model': ANTHROPIC_MODEL_DEFAULT,
         'fallback_model': ANTHROPIC_MODEL_FALLBACK,
+        'economy_model': ANTHROPIC_MODEL_ECONOMY,
         'temperature': ANTHROPIC_TEMPERATURE,
         'max_tokens': ANTHROPIC_MAX_TOKENS,
-        'system_prompt': CLAUDE_SYSTEM_PROMPT
+        'system_prompt': CLAUDE_SYSTEM_PROMPT,
+        'hedge_percentile': float(os.getenv("ANTHROPIC_HEDGE_PERCENTILE", HEDGE_PERCENTILE)),
+        'near_duplicate_threshold': float(os.getenv("ANTHROPIC_NEAR_DUPLICATE_THRESHOLD", NEAR_DUPLICATE_THRESHOLD))
     },
     'gemini': {
         'api_key': GEMINI_API_KEY,
         'default_model': GEMINI_MODEL_DEFAULT,
         'fallback_model': GEMINI_MODEL_FALLBACK,
+        'economy_model': GEMINI_MODEL_ECONOMY,
         'temperature': GEMINI_TEMPERATURE,
         'max_tokens': GEMINI_MAX_TOKENS,
-        'system_prompt': GEMINI_SYSTEM_PROMPT
+        'system_prompt': GEMINI_SYSTEM_PROMPT,
+        'hedge_percentile': float(os.getenv("GEMINI_HEDGE_PERCENTILE", HEDGE_PERCENTILE)),
+        'near_duplicate_threshold': float(os.getenv("GEMINI_NEAR_DUPLICATE_THRESHOLD", NEAR_DUPLICATE_THRESHOLD))
     },
     'groq': {
         'api_key': GROQ_API_KEY,
         'default_model': GROQ_MODEL_DEFAULT,
         'fallback_model': GROQ_MODEL_FALLBACK,
+        'economy_model': GROQ_MODEL_ECONOMY,
         'temperature': GROQ_TEMPERATURE,
         'max_tokens': GROQ_MAX_TOKENS,
-        'system_prompt': GROQ_SYSTEM_PROMPT
+        'system_prompt': GROQ_SYSTEM_PROMPT,
+        'hedge_percentile': float(os.getenv("GROQ_HEDGE_PERCENTILE", HEDGE_PERCENTILE)),
+        'near_duplicate_threshold': float(os.getenv("GROQ_NEAR_DUPLICATE_THRESHOLD", NEAR_DUPLICATE_THRESHOLD))
     }
 }
 
+# Every "provider:model" a comparison source may name; other models are rejected so clients cannot
+# send arbitrary model names upstream or grow the per-model breaker, limit and latency tables
+COMPARE_MODELS = {
+    f"{provider}:{settings[key]}"
+    for provider, settings in PROVIDER_SETTINGS.items()
+    for key in ("default_model", "fallback_model", "economy_model")
+}
+for _step in FAILOVER_CHAINS.replace(";", ">").split(">") + COMPARE_ALLOWED_MODELS:
+    _provider, _, _model = _step.partition(":")
+    if _model.strip():
+        COMPARE_MODELS.add(f"{_provider.strip()}:{_model.strip()}")
+
 # Add after API key definitions
 def validate_api_keys():
     for provider, settings in PROVIDER_SETTINGS.items():
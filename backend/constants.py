@@ -6,6 +6,8 @@ Constants used throughout the application.
 class SSEFormat:
     """Constants for Server-Sent Events (SSE) format."""
     DATA_PREFIX = "data: "
+    ID_PREFIX = "id: "
+    EVENT_PREFIX = "event: "
     NEWLINE_SEPARATOR = "\n\n"
     DONE_MARKER = "[DONE]"
     
@@ -15,4 +17,14 @@ class SSEFormat:
     @staticmethod
     def format_data(data_json: str) -> str:
         """Format JSON data as an SSE message."""
-        return f"{SSEFormat.DATA_PREFIX}{data_json}{SSEFormat.NEWLINE_SEPARATOR}" 
\ No newline at end of file
+        return f"{SSEFormat.DATA_PREFIX}{data_json}{SSEFormat.NEWLINE_SEPARATOR}"
+    
+    @staticmethod
+    def format_id(event_id: int) -> str:
+        """Format an event ID line that precedes an SSE message."""
+        return f"{SSEFormat.ID_PREFIX}{event_id}\n"
+    
+    @staticmethod
+    def format_event(event_name: str) -> str:
+        """Format an event name line that precedes an SSE message."""
+        return f"{SSEFormat.EVENT_PREFIX}{event_name}\n"
@@ -0,0 +1,205 @@
+"""
+Token-budgeted context windows.
+
+Before a conversation is formatted for a model, its history is trimmed to fit
+the model's context window minus its max_tokens and
+CONTEXT_SAFETY_MARGIN_TOKENS. System messages and the newest message are never
+dropped. The trim strategy decides the order the rest go in:
+
+- drop_oldest: oldest messages first
+- keep_first_last: keep the first message and the last CONTEXT_KEEP_LAST_MESSAGES,
+  drop the middle first
+
+Tokens are counted with tiktoken for GPT (the model's encoding) and Groq
+(cl100k_base, close to Llama 3's tokenizer), and estimated from the character
+count for Claude and Gemini. Encodings are loaded once at startup, from
+TIKTOKEN_CACHE_DIR when the server has no internet access; without them every
+model falls back to the estimate. Counts are cached by content hash, and
+counting a large request runs in a worker thread.
+"""
+import asyncio
+import hashlib
+import math
+from typing import Any, Callable, Dict, List, Tuple
+import tiktoken
+from cachetools import LRUCache
+from models import ConversationMessage
+from logging_config import logger, debug_with_context
+from configuration import (
+    CONTEXT_TRIM_ENABLED,
+    CONTEXT_TRIM_STRATEGY,
+    CONTEXT_KEEP_LAST_MESSAGES,
+    CONTEXT_SAFETY_MARGIN_TOKENS,
+    CONTEXT_WINDOWS,
+    CONTEXT_DEFAULT_WINDOW,
+    CONTEXT_HEURISTIC_CHARS_PER_TOKEN,
+    CONTEXT_TOKEN_CACHE_SIZE,
+    CONTEXT_OFFLOAD_MIN_CHARS
+)
+
+# Role and separator tokens added per message by the chat formats
+MESSAGE_OVERHEAD_TOKENS = 4
+ENCODINGS = ("o200k_base", "cl100k_base")
+
+_encodings: Dict[str, tiktoken.Encoding] = {}
+
+class ContextWindowExceeded(Exception):
+    """The newest message alone does not fit the model's context window."""
+
+    def __init__(self, model: str, tokens: int, budget: int):
+        super().__init__(f"Conversation needs {tokens} tokens but {model} allows {budget} for input")
+        self.model = model
+        self.tokens = tokens
+        self.budget = budget
+
+def load_encodings() -> None:
+    """Load the tiktoken encodings; blocking, so call it from a worker thread."""
+    for name in ENCODINGS:
+        try:
+            _encodings[name] = tiktoken.get_encoding(name)
+        except Exception as e:
+            logger.warning(f"Tokenizer {name} unavailable, estimating token counts instead: {str(e)}")
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CONTEXT_HEURISTIC_CHARS_PER_TOKEN)
+
+def tokenizer_for(provider: str, model: str) -> Tuple[str, Callable[[str], int]]:
+    """(name, token counter) for a model; the name keys the count cache."""
+    name = None
+    if provider == "gpt":
+        try:
+            name = tiktoken.encoding_name_for_model(model)
+        except KeyError:
+            name = "o200k_base"
+    elif provider == "groq":
+        name = "cl100k_base"
+    encoding = _encodings.get(name)
+    if encoding is None:
+        return "estimate", estimate_tokens
+    return name, lambda text: len(encoding.encode_ordinary(text))
+
+def _drop_order(turns: int) -> List[int]:
+    """Indices of non-system messages in the order they are dropped; the newest is never dropped."""
+    last = turns - 1
+    if CONTEXT_TRIM_STRATEGY == "keep_first_last":
+        tail_start = max(1, turns - CONTEXT_KEEP_LAST_MESSAGES)
+        return list(range(1, tail_start)) + list(range(tail_start, last)) + ([0] if last > 0 else [])
+    return list(range(last))
+
+class ContextWindowManager:
+    """Trims conversations to a model's input budget, caching token counts by content hash."""
+
+    def __init__(self, cache_size: int):
+        self._counts: LRUCache = LRUCache(maxsize=cache_size)
+        self.requests = 0
+        self.uncounted = 0
+        self.trimmed = 0
+        self.dropped_messages = 0
+        self.count_hits = 0
+        self.count_misses = 0
+        self.offloaded = 0
+
+    def budget(self, model: str, max_tokens: int) -> int:
+        """Input tokens available to a model once its output and the safety margin are reserved."""
+        return CONTEXT_WINDOWS.get(model, CONTEXT_DEFAULT_WINDOW) - max_tokens - CONTEXT_SAFETY_MARGIN_TOKENS
+
+    async def count(self, provider: str, model: str, texts: List[str]) -> List[int]:
+        """Token counts of `texts`, from the cache where possible."""
+        name, counter = tokenizer_for(provider, model)
+        keys = [(name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()) for text in texts]
+        counts = [self._counts.get(key) for key in keys]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        self.count_hits += len(texts) - len(missing)
+        self.count_misses += len(missing)
+        if missing:
+            pending = [texts[i] for i in missing]
+            if sum(len(text) for text in pending) >= CONTEXT_OFFLOAD_MIN_CHARS:
+                # tiktoken releases the GIL, so large requests tokenize off the event loop
+                self.offloaded += 1
+                fresh = await asyncio.to_thread(lambda: [counter(text) for text in pending])
+            else:
+                fresh = [counter(text) for text in pending]
+            for i, count in zip(missing, fresh):
+                counts[i] = count
+                self._counts[keys[i]] = count
+        return counts
+
+    async def fit(self, provider: str, model: str, system_prompt: str, messages: List[ConversationMessage],
+                  max_tokens: int, reserved_text: str = "") -> List[ConversationMessage]:
+        """
+        Drop history until the conversation fits the model's input budget.
+
+        Args:
+            provider: Provider name, for the tokenizer
+            model: Model the conversation is sent to
+            system_prompt: System prompt sent with the conversation
+            messages: Conversation messages
+            max_tokens: Output tokens reserved for the answer
+            reserved_text: Further input sent with the conversation (a partial answer to continue)
+
+        Raises:
+            ContextWindowExceeded: If even the newest message does not fit
+        """
+        if not CONTEXT_TRIM_ENABLED:
+            return messages
+        self.requests += 1
+        budget = self.budget(model, max_tokens)
+        turns = [i for i, m in enumerate(messages) if m.role != "system"]
+        texts = [system_prompt, reserved_text] + [messages[i].content for i in turns]
+        # A token is at least one UTF-8 byte: skip counting when even the byte count fits
+        if sum(len(text.encode("utf-8")) for text in texts) + MESSAGE_OVERHEAD_TOKENS * len(texts) <= budget:
+            self.uncounted += 1
+            return messages
+
+        counts = await self.count(provider, model, texts)
+        tokens = [count + MESSAGE_OVERHEAD_TOKENS for count in counts]
+        available = budget - tokens[0] - tokens[1]
+        turn_tokens = tokens[2:]
+        total = sum(turn_tokens)
+        dropped = set()
+        for i in _drop_order(len(turns)):
+            if total <= available:
+                break
+            dropped.add(i)
+            total -= turn_tokens[i]
+        if total > available:
+            raise ContextWindowExceeded(model, total + tokens[0] + tokens[1], budget)
+        if not dropped:
+            return messages
+
+        # Conversations have to start with a user turn
+        kept = [i for i in range(len(turns)) if i not in dropped]
+        while len(kept) > 1 and messages[turns[kept[0]]].role != "user":
+            dropped.add(kept.pop(0))
+        dropped_indices = {turns[i] for i in dropped}
+        self.trimmed += 1
+        self.dropped_messages += len(dropped)
+        debug_with_context(logger,
+            "Trimmed conversation to the context window",
+            provider=provider,
+            model=model,
+            strategy=CONTEXT_TRIM_STRATEGY,
+            dropped=len(dropped),
+            kept=len(messages) - len(dropped),
+            budget=budget
+        )
+        return [m for i, m in enumerate(messages) if i not in dropped_indices]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.count_hits + self.count_misses
+        return {
+            "enabled": CONTEXT_TRIM_ENABLED,
+            "strategy": CONTEXT_TRIM_STRATEGY,
+            "tokenizers": sorted(_encodings) or ["estimate"],
+            "requests": self.requests,
+            # Small enough to fit without counting tokens
+            "uncounted": self.uncounted,
+            "trimmed": self.trimmed,
+            "dropped_messages": self.dropped_messages,
+            "count_cache_entries": len(self._counts),
+            "count_cache_hit_rate": round(self.count_hits / lookups, 4) if lookups else 0.0,
+            "offloaded": self.offloaded,
+        }
+
+# Process-wide context window manager
+context_windows = ContextWindowManager(CONTEXT_TOKEN_CACHE_SIZE)
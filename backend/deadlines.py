@@ -0,0 +1,110 @@
+"""
+Per-request deadline budgets.
+
+Every chat request gets a total budget (RESPONSE_TIMEOUT, or the
+`X-Request-Timeout` header clamped to DEADLINE_MIN_SECONDS..DEADLINE_MAX_SECONDS)
+split into phases:
+
+- connect: opening the provider connection (passed to the SDK's HTTP timeout)
+- ttft: time to the first token of each model attempt
+- inter_token: longest allowed stall between two events
+- total: the whole request, across every failover attempt
+
+A blown connect, TTFT or stall phase fails the current model attempt, so the
+failover chain moves on while budget remains. A blown total phase ends the
+stream with an error event.
+"""
+import asyncio
+import time
+from typing import AsyncGenerator, AsyncIterator, Optional
+import httpx
+from stream_events import StreamEvent
+from configuration import (
+    RESPONSE_TIMEOUT,
+    DEADLINE_CONNECT_SECONDS,
+    DEADLINE_TTFT_SECONDS,
+    DEADLINE_INTER_TOKEN_SECONDS,
+    DEADLINE_MIN_SECONDS,
+    DEADLINE_MAX_SECONDS
+)
+
+class DeadlineExceeded(Exception):
+    """A deadline phase ran out."""
+
+    def __init__(self, phase: str, limit: float):
+        super().__init__(f"Deadline exceeded: {phase} ({limit:.1f}s)")
+        self.phase = phase
+        self.limit = limit
+
+class Deadline:
+    """Time budget of one request, split into connect, TTFT, inter-token and total phases."""
+
+    def __init__(self, total: float, connect: float = DEADLINE_CONNECT_SECONDS,
+                 ttft: float = DEADLINE_TTFT_SECONDS, inter_token: float = DEADLINE_INTER_TOKEN_SECONDS):
+        self.total = total
+        self.connect = connect
+        self.ttft = ttft
+        self.inter_token = inter_token
+        self.expires_at = time.monotonic() + total
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        """Raise if the total budget is spent."""
+        if self.expired:
+            raise DeadlineExceeded("total", self.total)
+
+    def http_timeout(self) -> httpx.Timeout:
+        """HTTP timeout for one SDK call, capped by the remaining budget."""
+        remaining = self.remaining()
+        return httpx.Timeout(
+            remaining,
+            connect=min(self.connect, remaining),
+            read=min(max(self.ttft, self.inter_token), remaining)
+        )
+
+def deadline_for_request(header_value: Optional[str]) -> Deadline:
+    """
+    Build a request's deadline from the optional X-Request-Timeout header (seconds).
+
+    Invalid values fall back to RESPONSE_TIMEOUT; valid ones are clamped to the
+    configured limits.
+    """
+    total = RESPONSE_TIMEOUT
+    if header_value:
+        try:
+            total = float(header_value)
+        except ValueError:
+            total = RESPONSE_TIMEOUT
+    return Deadline(min(max(total, DEADLINE_MIN_SECONDS), DEADLINE_MAX_SECONDS))
+
+async def within_deadline(events: AsyncIterator[StreamEvent], deadline: Deadline) -> AsyncGenerator[StreamEvent, None]:
+    """
+    Re-yield a model's events, raising DeadlineExceeded when a phase runs out.
+
+    The first delta must arrive within the TTFT phase, every later event within
+    the inter-token phase, and all of them within the total budget. The timed
+    out stream is cancelled, which closes its SDK stream.
+    """
+    iterator = events.__aiter__()
+    first_token = True
+    while True:
+        phase, limit = ("ttft", deadline.ttft) if first_token else ("inter_token", deadline.inter_token)
+        remaining = deadline.remaining()
+        timeout = min(limit, remaining)
+        if remaining < limit:
+            phase, limit = "total", deadline.total
+        try:
+            event = await asyncio.wait_for(iterator.__anext__(), timeout)
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(phase, limit)
+        if event.kind == StreamEvent.DELTA:
+            first_token = False
+        yield event
@@ -0,0 +1,173 @@
+"""
+Degradation mode: trade answer quality for capacity under load.
+
+Each provider's default model is watched through three signals: requests
+queued behind its upstream concurrency limit, the share of its provider token
+budget used in the current rate-limit window, and its p95 time to first token
+over the last DEGRADE_TTFT_WINDOW_SECONDS. When any signal reaches its
+threshold the provider enters degradation mode and new requests start on its
+economy model (`PROVIDER_SETTINGS[...]["economy_model"]`) with `max_tokens`
+capped at DEGRADE_MAX_TOKENS. The rest of the failover chain,
+including the default model, stays behind it.
+
+Hysteresis keeps the mode from flapping: a provider leaves only after
+DEGRADE_MIN_SECONDS, once every signal is below DEGRADE_EXIT_RATIO times its
+threshold. While degraded, a small share of requests still goes to the default
+model so its signals reflect current conditions rather than the spike; with
+too few recent samples the TTFT signal counts as clear.
+"""
+import random
+import time
+from typing import Any, Dict, Optional
+from provider_stats import ttft_tracker
+from upstream_limits import upstream_limits
+from logging_config import logger
+from configuration import (
+    PROVIDER_SETTINGS,
+    DEGRADATION_ENABLED,
+    DEGRADE_QUEUE_DEPTH,
+    DEGRADE_TOKEN_USAGE,
+    DEGRADE_TTFT_P95_MS,
+    DEGRADE_MIN_SAMPLES,
+    DEGRADE_TTFT_WINDOW_SECONDS,
+    DEGRADE_EXIT_RATIO,
+    DEGRADE_MIN_SECONDS,
+    DEGRADE_MAX_TOKENS,
+    DEGRADE_PROBE_FRACTION
+)
+
+class Degradation:
+    """How one request is downshifted."""
+    __slots__ = ("model", "max_tokens", "reason")
+
+    def __init__(self, model: str, max_tokens: Optional[int], reason: str):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.reason = reason
+
+    def header(self) -> str:
+        """Value of the X-Degraded response header."""
+        parts = [f"model={self.model}"]
+        if self.max_tokens is not None:
+            parts.append(f"max_tokens={self.max_tokens}")
+        parts.append(f"reason={self.reason}")
+        return "; ".join(parts)
+
+class _ProviderState:
+    __slots__ = ("degraded", "reason", "since", "entered", "degraded_requests", "probes")
+
+    def __init__(self):
+        self.degraded = False
+        self.reason: Optional[str] = None
+        self.since = 0.0
+        self.entered = 0
+        self.degraded_requests = 0
+        self.probes = 0
+
+class DegradationController:
+    """Per-provider degradation mode with hysteresis."""
+
+    def __init__(self, thresholds: Dict[str, float], exit_ratio: float, min_seconds: float,
+                 max_tokens: int, probe_fraction: float):
+        # Signal name -> threshold; 0 disables the signal
+        self.thresholds = {name: value for name, value in thresholds.items() if value > 0}
+        self.exit_ratio = exit_ratio
+        self.min_seconds = min_seconds
+        self.max_tokens = max_tokens
+        self.probe_fraction = probe_fraction
+        self._states: Dict[str, _ProviderState] = {}
+
+    def signals(self, provider: str) -> Dict[str, Optional[float]]:
+        """Current load signals of a provider's default model (None: unknown)."""
+        model = PROVIDER_SETTINGS[provider]["default_model"]
+        limiter = upstream_limits.get(provider, model)
+        ttft = ttft_tracker.percentile(provider, model, 95, DEGRADE_MIN_SAMPLES, DEGRADE_TTFT_WINDOW_SECONDS)
+        return {
+            "queue_depth": float(limiter.queue_depth),
+            "token_usage": limiter.token_usage(),
+            "ttft_p95_ms": ttft * 1000 if ttft is not None else None,
+        }
+
+    def _over(self, signals: Dict[str, Optional[float]], scale: float) -> Optional[str]:
+        """The first signal at or above scale x its threshold."""
+        for name, threshold in self.thresholds.items():
+            value = signals.get(name)
+            if value is not None and value >= threshold * scale:
+                return name
+        return None
+
+    def _state(self, provider: str) -> _ProviderState:
+        state = self._states.get(provider)
+        if state is None:
+            state = self._states[provider] = _ProviderState()
+        return state
+
+    def update(self, provider: str) -> _ProviderState:
+        """Enter or leave degradation mode for a provider from its current signals."""
+        state = self._state(provider)
+        now = time.monotonic()
+        if not state.degraded:
+            reason = self._over(self.signals(provider), 1.0)
+            if reason is not None:
+                state.degraded, state.reason, state.since = True, reason, now
+                state.entered += 1
+                logger.warning(f"Provider {provider} entering degradation mode: {reason} over threshold")
+        elif now - state.since >= self.min_seconds and self._over(self.signals(provider), self.exit_ratio) is None:
+            state.degraded, state.reason = False, None
+            logger.info(f"Provider {provider} leaving degradation mode after {now - state.since:.0f}s")
+        return state
+
+    def decide(self, provider: str) -> Optional[Degradation]:
+        """
+        How a new request to a provider should be downshifted.
+
+        Returns:
+            None to serve it normally (not degraded, or picked as a probe)
+        """
+        if not DEGRADATION_ENABLED or not self.thresholds:
+            return None
+        state = self.update(provider)
+        if not state.degraded:
+            return None
+        if random.random() < self.probe_fraction:
+            state.probes += 1
+            return None
+        state.degraded_requests += 1
+        settings = PROVIDER_SETTINGS[provider]
+        max_tokens = min(settings["max_tokens"], self.max_tokens) if self.max_tokens > 0 else None
+        return Degradation(settings["economy_model"], max_tokens, state.reason)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        providers = {}
+        for provider, state in self._states.items():
+            providers[provider] = {
+                "degraded": state.degraded,
+                "reason": state.reason,
+                "degraded_for_seconds": round(now - state.since, 1) if state.degraded else 0.0,
+                "entered": state.entered,
+                "degraded_requests": state.degraded_requests,
+                "probes": state.probes,
+                "economy_model": PROVIDER_SETTINGS[provider]["economy_model"],
+                "signals": self.signals(provider),
+            }
+        return {
+            "enabled": DEGRADATION_ENABLED,
+            "thresholds": self.thresholds,
+            "exit_ratio": self.exit_ratio,
+            "max_tokens": self.max_tokens,
+            "providers": providers,
+        }
+
+# Process-wide degradation controller
+degradation_controller = DegradationController(
+    {
+        "queue_depth": DEGRADE_QUEUE_DEPTH,
+        "token_usage": DEGRADE_TOKEN_USAGE,
+        "ttft_p95_ms": DEGRADE_TTFT_P95_MS,
+    },
+    DEGRADE_EXIT_RATIO,
+    DEGRADE_MIN_SECONDS,
+    DEGRADE_MAX_TOKENS,
+    DEGRADE_PROBE_FRACTION
+)
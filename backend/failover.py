@@ -0,0 +1,164 @@
+"""
+Failover chains.
+
+A chain is an ordered list of (provider, model) steps that are tried until one
+streams a complete response. Steps whose circuit is open are skipped without
+calling the provider. Without configuration a provider's chain is its default
+model followed by its fallback model; FAILOVER_CHAINS extends chains across
+providers:
+
+    FAILOVER_CHAINS="claude>claude:claude-3-5-haiku-latest>gpt:gpt-4o-mini;groq>gpt"
+"""
+import math
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from models import ConversationMessage
+from circuit_breaker import circuit_breakers
+from stream_events import StreamEvent
+from deadlines import DeadlineExceeded
+from call_context import CallContext
+from context_window import ContextWindowExceeded
+from upstream_limits import UpstreamBusy
+from logging_config import logger
+from configuration import PROVIDER_SETTINGS, SUPPORTED_PROVIDERS, VALID_PROVIDERS, FAILOVER_CHAINS
+
+def parse_failover_chains(value: str) -> Dict[str, List[Tuple[str, str]]]:
+    """Parse FAILOVER_CHAINS into (provider, model) steps keyed by each chain's first provider."""
+    chains: Dict[str, List[Tuple[str, str]]] = {}
+    for chain in value.split(";"):
+        steps = []
+        for step in chain.split(">"):
+            provider, _, model = step.strip().partition(":")
+            provider = provider.strip()
+            if not provider:
+                continue
+            if provider not in VALID_PROVIDERS:
+                raise ValueError(f"Environment Error: Invalid provider '{provider}' in FAILOVER_CHAINS")
+            steps.append((provider, model.strip() or PROVIDER_SETTINGS[provider]["default_model"]))
+        if steps:
+            chains[steps[0][0]] = steps
+    return chains
+
+_CHAINS = parse_failover_chains(FAILOVER_CHAINS)
+
+def failover_steps(provider_name: str) -> List[Tuple[str, str]]:
+    """The (provider, model) chain for a provider, limited to supported providers."""
+    steps = _CHAINS.get(provider_name)
+    if steps is None:
+        settings = PROVIDER_SETTINGS[provider_name]
+        steps = [(provider_name, settings["default_model"]), (provider_name, settings["fallback_model"])]
+    return [step for step in steps if step[0] in SUPPORTED_PROVIDERS]
+
+def all_failover_steps() -> Dict[str, List[str]]:
+    """Every supported provider's chain as "provider:model" strings."""
+    return {
+        provider_name: [f"{p}:{m}" for p, m in failover_steps(provider_name)]
+        for provider_name in SUPPORTED_PROVIDERS
+    }
+
+def chain_unavailable(provider_name: str, skipped: List[str]) -> HTTPException:
+    """Error for a chain whose every step was skipped by an open circuit."""
+    return HTTPException(
+        status_code=503,
+        detail=f"All models for provider {provider_name} are temporarily unavailable (circuit open: {', '.join(skipped)})"
+    )
+
+def chain_failed(provider_name: str, error: BaseException) -> HTTPException:
+    """Error for a chain whose every attempted step failed."""
+    if isinstance(error, ContextWindowExceeded):
+        return HTTPException(
+            status_code=422,
+            detail=f"Conversation too long for provider {provider_name}: {str(error)}"
+        )
+    if isinstance(error, UpstreamBusy):
+        return HTTPException(
+            status_code=503,
+            detail=f"Provider {provider_name} is at its upstream rate limit: {str(error)}",
+            headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+        )
+    if isinstance(error, DeadlineExceeded):
+        return HTTPException(
+            status_code=504,
+            detail=f"Response deadline exceeded for provider {provider_name}: {error.phase} phase ({error.limit:.1f}s)"
+        )
+    return HTTPException(
+        status_code=500,
+        detail=f"All models failed for provider {provider_name}: {str(error)}"
+    )
+
+async def stream_with_failover(
+    messages: List[ConversationMessage],
+    context: CallContext,
+    provider_name: str,
+    partial_text: str = "",
+    previous_step: Optional[str] = None
+) -> AsyncGenerator[StreamEvent, None]:
+    """
+    Stream from the first step of the context's chain that completes.
+
+    When a step fails after streaming part of the answer, the next step is
+    asked to continue that partial answer (see `BaseProvider.format_continuation`)
+    and only the new suffix is streamed. Every switch is announced with a
+    `model_change` event.
+
+    Args:
+        messages: Conversation messages
+        context: The request's call context; a step that blows the connect,
+            TTFT or inter-token phase of its deadline fails over, a spent total
+            budget or a cancelled request stops the chain
+        provider_name: Requested provider, for error messages
+        partial_text: Answer text already streamed by an earlier attempt
+        previous_step: "provider:model" of that earlier attempt
+
+    Raises:
+        asyncio.CancelledError: If the context's request was cancelled
+        HTTPException: 503 if every step's circuit is open or at its upstream
+            limit, 504 if the deadline ran out, 500 if every attempted step failed
+    """
+    deadline = context.deadline
+    last_error = None
+    skipped = []
+    for provider, model in context.chain:
+        context.cancellation.check()
+        if deadline is not None and deadline.expired:
+            last_error = DeadlineExceeded("total", deadline.total)
+            break
+        step = f"{provider.provider_name}:{model}"
+        breaker = circuit_breakers.get(provider.provider_name, model)
+        if not breaker.allow_request():
+            skipped.append(step)
+            continue
+        try:
+            try:
+                if previous_step is not None:
+                    yield StreamEvent.meta(StreamEvent.MODEL_CHANGE, context.message_id, {
+                        "from": previous_step,
+                        "to": step,
+                        "continued": bool(partial_text),
+                        "offset": len(partial_text)
+                    }, model=model)
+                formatted_messages = await provider.prepare_messages(messages, model, context, partial_text)
+            except BaseException:
+                # stream_model frees the probe slot allow_request() may have reserved, but only once it runs
+                breaker.release()
+                raise
+            first_delta = True
+            async for event in provider.stream_model(formatted_messages, model, context):
+                if event.kind == StreamEvent.DELTA:
+                    if first_delta and partial_text[-1:].isspace():
+                        # Whitespace already sent (prefills are right-stripped)
+                        event.text = event.text.lstrip()
+                    first_delta = False
+                    partial_text += event.text
+                yield event
+            return
+        except Exception as e:
+            last_error = e
+            previous_step = step
+            if isinstance(e, DeadlineExceeded) and e.phase == "total":
+                break
+            logger.warning(f"Model {step} failed, trying next step in failover chain: {str(e)}")
+
+    if last_error is None and previous_step is None:
+        raise chain_unavailable(provider_name, skipped)
+    raise chain_failed(provider_name, last_error or RuntimeError(f"{previous_step} failed"))
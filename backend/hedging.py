@@ -0,0 +1,248 @@
+"""
+Hedged requests.
+
+If the first model of the failover chain has not produced a first token
+within its recent TTFT percentile, the next step of the chain (by default the
+provider's fallback model) is started in parallel. The first attempt to emit a
+token wins; the other is cancelled, which closes its SDK stream. Events an
+attempt sends before its first token (e.g. usage metadata) do not decide the
+race; they are held back and emitted if that attempt wins. Steps whose
+circuit is open are skipped, and failures fall through to the rest of the
+chain as in `failover.stream_with_failover`.
+"""
+import asyncio
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from fastapi import HTTPException
+from models import ConversationMessage
+from providers import BaseProvider
+from provider_stats import ttft_tracker
+from circuit_breaker import circuit_breakers
+from failover import stream_with_failover, chain_unavailable, chain_failed
+from deadlines import DeadlineExceeded
+from call_context import CallContext
+from stream_events import StreamEvent
+from logging_config import logger, debug_with_context
+from configuration import (
+    PROVIDER_SETTINGS,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_DEFAULT_DELAY_MS,
+    HEDGE_MIN_DELAY_MS
+)
+
+# Marks the end of an attempt's stream in the shared queue
+_END = object()
+
+class _Attempt:
+    """One model streaming into the queue shared by all attempts of a request."""
+
+    def __init__(self, queue: asyncio.Queue, provider: BaseProvider, model: str,
+                 messages: List[ConversationMessage], context: CallContext):
+        self.provider = provider
+        self.model = model
+        # Whether this attempt still owns the probe slot allow_request() may have reserved;
+        # stream_model takes it over once it runs
+        self._holds_probe = True
+        self.prompt_chars = sum(len(m.content) for m in messages)
+        self.events = 0
+        # Events received before the attempt's first token, emitted if it wins
+        self.buffered: List[StreamEvent] = []
+        self._queue = queue
+        self._task = asyncio.create_task(self._pump(messages, context))
+
+    async def _pump(self, messages: List[ConversationMessage], context: CallContext) -> None:
+        try:
+            formatted_messages = await self.provider.prepare_messages(messages, self.model, context)
+            self._holds_probe = False
+            async for event in self.provider.stream_model(formatted_messages, self.model, context):
+                self.events += 1
+                self._queue.put_nowait((self, event))
+        except Exception as e:
+            self._queue.put_nowait((self, e))
+        except asyncio.CancelledError as e:
+            if not context.cancellation.cancelled:
+                raise
+            # The request was cancelled through its token: wake the reader so it stops too
+            self._queue.put_nowait((self, e))
+        else:
+            self._queue.put_nowait((self, _END))
+        finally:
+            self._release_probe()
+
+    def _release_probe(self) -> None:
+        if self._holds_probe:
+            self._holds_probe = False
+            circuit_breakers.get(self.provider.provider_name, self.model).release()
+
+    async def cancel(self) -> None:
+        if not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # A task cancelled before it ever ran never reached _pump's finally
+        self._release_probe()
+
+class HedgeStats:
+    """Per-provider hedging counters for tuning the percentile."""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def for_provider(self, provider: str) -> Dict[str, int]:
+        if provider not in self._stats:
+            self._stats[provider] = {
+                "requests": 0,
+                "hedged": 0,
+                "hedge_wins": 0,
+                "primary_wins": 0,
+                # Stream events the cancelled attempt produced before it lost
+                "wasted_chunks": 0,
+                # Prompt characters sent to cancelled attempts (billed as input)
+                "wasted_prompt_chars": 0,
+            }
+        return self._stats[provider]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Counters plus hedge rate (hedged / requests) and win rate (hedge wins / hedged)."""
+        result = {}
+        for provider, stats in self._stats.items():
+            result[provider] = {
+                **stats,
+                "hedge_rate": round(stats["hedged"] / stats["requests"], 4) if stats["requests"] else 0.0,
+                "win_rate": round(stats["hedge_wins"] / stats["hedged"], 4) if stats["hedged"] else 0.0,
+            }
+        return result
+
+def hedge_delay(provider: BaseProvider, model: str) -> float:
+    """Seconds to wait for a model's first token before hedging."""
+    percentile = PROVIDER_SETTINGS[provider.provider_name]["hedge_percentile"]
+    delay = ttft_tracker.percentile(provider.provider_name, model, percentile, HEDGE_MIN_SAMPLES)
+    if delay is None:
+        delay = HEDGE_DEFAULT_DELAY_MS / 1000
+    return max(delay, HEDGE_MIN_DELAY_MS / 1000)
+
+async def hedged_stream(
+    messages: List[ConversationMessage],
+    context: CallContext,
+    provider_name: str
+) -> AsyncGenerator[StreamEvent, None]:
+    """
+    Stream from the context's failover chain, racing its next step if the first token is late.
+
+    Raises:
+        asyncio.CancelledError: If the context's request was cancelled
+        HTTPException: 503 if every step's circuit is open, 504 if the deadline
+            ran out, 500 if every attempted step failed
+    """
+    loop = asyncio.get_running_loop()
+    deadline, message_id = context.deadline, context.message_id
+    stats = hedge_stats.for_provider(provider_name)
+    stats["requests"] += 1
+    queue: asyncio.Queue = asyncio.Queue()
+    remaining = list(context.chain)
+    racing: List[_Attempt] = []
+    skipped: List[str] = []
+
+    def start_next() -> Optional[_Attempt]:
+        if deadline is not None and deadline.expired:
+            return None
+        while remaining:
+            provider, model = remaining.pop(0)
+            if circuit_breakers.get(provider.provider_name, model).allow_request():
+                attempt = _Attempt(queue, provider, model, messages, context)
+                racing.append(attempt)
+                return attempt
+            skipped.append(f"{provider.provider_name}:{model}")
+        return None
+
+    primary = start_next()
+    if primary is None:
+        raise chain_unavailable(provider_name, skipped)
+    hedge: Optional[_Attempt] = None
+    hedge_at = loop.time() + hedge_delay(primary.provider, primary.model)
+    error: Optional[BaseException] = None
+
+    try:
+        # Race until one attempt emits its first token
+        while True:
+            # Only the first attempt is hedged, and only once
+            can_hedge = hedge is None and racing == [primary] and bool(remaining)
+            timeout = max(0.0, hedge_at - loop.time()) if can_hedge else None
+            try:
+                attempt, item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                context.cancellation.check()
+                hedge = start_next()
+                if hedge is not None:
+                    stats["hedged"] += 1
+                    debug_with_context(logger,
+                        "Hedging slow first token",
+                        provider=primary.provider.provider_name,
+                        model=primary.model,
+                        hedge_provider=hedge.provider.provider_name,
+                        hedge_model=hedge.model,
+                        message_id=message_id
+                    )
+                continue
+
+            context.cancellation.check()
+            if isinstance(item, StreamEvent):
+                # A stalled attempt may still send metadata; only a token (or a completed,
+                # empty answer) ends the race
+                if item.kind == StreamEvent.DELTA or item.is_done:
+                    winner, first_event = attempt, item
+                    break
+                attempt.buffered.append(item)
+                continue
+
+            # Failed (or ended empty) before its first token: fall through the chain
+            racing.remove(attempt)
+            error = item if isinstance(item, Exception) else RuntimeError("stream ended without output")
+            if not racing and start_next() is None:
+                if deadline is not None and deadline.expired:
+                    error = DeadlineExceeded("total", deadline.total)
+                raise chain_failed(provider_name, error)
+
+        losers = [attempt for attempt in racing if attempt is not winner]
+        for attempt in losers:
+            await attempt.cancel()
+            stats["wasted_chunks"] += attempt.events
+            stats["wasted_prompt_chars"] += attempt.prompt_chars
+        if hedge is not None:
+            stats["hedge_wins" if winner is hedge else "primary_wins"] += 1
+        # Cancelled losers were never given a fair chance; keep them for failover
+        remaining[:0] = [(attempt.provider, attempt.model) for attempt in losers]
+
+        streamed = [first_event.text] if first_event.kind == StreamEvent.DELTA else []
+        for event in winner.buffered:
+            yield event
+        yield first_event
+        while True:
+            attempt, item = await queue.get()
+            context.cancellation.check()
+            if attempt is not winner:
+                continue
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                error = item
+                break
+            if item.kind == StreamEvent.DELTA:
+                streamed.append(item.text)
+            yield item
+    finally:
+        for attempt in racing:
+            await attempt.cancel()
+
+    # The winner failed mid-stream: continue its partial answer down the rest of the chain
+    winner_step = f"{winner.provider.provider_name}:{winner.model}"
+    logger.warning(f"Model {winner_step} failed mid-stream, trying next step in failover chain: {str(error)}")
+    if not remaining or (isinstance(error, DeadlineExceeded) and error.phase == "total"):
+        raise chain_failed(provider_name, error)
+    async for event in stream_with_failover(messages, context.with_chain(remaining), provider_name,
+                                            "".join(streamed), winner_step):
+        yield event
+
+# Process-wide hedging counters
+hedge_stats = HedgeStats()
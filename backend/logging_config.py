@@ -148,27 +148,6 @@ def generate_conversation_id() -> str:
     """Generate a unique conversation ID."""
     return str(uuid4())
 
-def parse_streaming_response(response_chunks: List[str]) -> str:
-    """
-    Parse streaming response chunks and extract the actual content.
-    
-    Args:
-        response_chunks: List of response chunks in streaming format
-    Returns:
-        Extracted content as a single string
-    """
-    content = []
-    for chunk in response_chunks:
-        if chunk.startswith('data: ') and not chunk.strip().endswith('[DONE]'):
-            try:
-                # Parse the JSON data after 'data: '
-                data = json.loads(chunk[6:].strip())
-                if 'delta' in data and 'content' in data['delta']:
-                    content.append(data['delta']['content'])
-            except json.JSONDecodeError:
-                continue
-    return ''.join(content)
-
 def log_conversation_entry(conversation_id: str, user_prompt: str, ai_response: str) -> None:
     """
     Log a conversation entry to conversations.log in JSON format if conversation logging is enabled.
@@ -176,21 +155,18 @@ def log_conversation_entry(conversation_id: str, user_prompt: str, ai_response:
     Args:
         conversation_id: Unique identifier for the conversation
         user_prompt: The user's input message
-        ai_response: The complete AI response
+        ai_response: The complete AI response text
     """
     if not LOG_SETTINGS['ENABLE_CONVERSATION_LOGGING']:
         return
         
     try:
-        # Parse the streaming response to extract clean content
-        clean_response = parse_streaming_response(ai_response.split('\n'))
-        
         entry = {
             'timestamp': datetime.now(timezone.utc).isoformat(),
             'conversation_id': conversation_id,
             'request_id': get_request_id(),
             'user_prompt': user_prompt,
-            'ai_response': clean_response
+            'ai_response': ai_response
         }
         conversation_logger.info(json.dumps(entry, ensure_ascii=False))
     except Exception as e:
@@ -3,10 +3,32 @@ from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, FileResponse, HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
+import asyncio
 import time
 import uvicorn
-from models import ChatRequest, HealthResponse
-from aiproviders import stream_response, health_check_provider
+from models import ChatRequest, BatchChatRequest, CompareChatRequest, HealthResponse
+from aiproviders import stream_response, health_check_provider, generate_message_id
+from chat_streams import ChatStream, IdempotencyKeyReused, stream_registry, parse_last_event_id
+from singleflight import singleflight_key, idempotency_fingerprint
+from response_cache import response_cache, response_cache_key, replay_cached_response, CachedResponse
+from near_duplicate_cache import near_duplicate_cache
+from batch_jobs import batch_jobs
+from compare import compare_stream
+from transport import transport_manager
+from hedging import hedge_stats
+from circuit_breaker import circuit_breakers
+from upstream_limits import upstream_limits
+from failover import all_failover_steps
+from deadlines import deadline_for_request
+from context_window import context_windows, load_encodings
+from router import router, AUTO_PROVIDER
+from provider_stats import ttft_tracker, model_stats, usage_stats
+from stream_coalescing import coalesce_events
+from wire_formats import negotiate_stream_encoder, NDJSONEncoder
+from compression import RequestDecompressionMiddleware, negotiate_stream_compressor, compress_stream
+from rate_limiting import RateLimitMiddleware, rate_limiter
+from admission import AdmissionMiddleware, admission_controller, loop_lag_monitor
+from degradation import degradation_controller
 from logging_config import logger, debug_with_context, get_request_id, set_request_id
 import traceback
 import sentry_sdk
@@ -14,15 +36,20 @@ from sentry_sdk.integrations.fastapi import FastApiIntegration
 from configuration import (
     PORT, SUPPORTED_PROVIDERS, PROVIDER_SETTINGS,
     SENTRY_DSN, SENTRY_TRACES_SAMPLE_RATE, SENTRY_PROFILES_SAMPLE_RATE,
-    SENTRY_ENVIRONMENT, SENTRY_ENABLE_TRACING, SENTRY_SEND_DEFAULT_PII
+    SENTRY_ENVIRONMENT, SENTRY_ENABLE_TRACING, SENTRY_SEND_DEFAULT_PII,
+    STREAM_COALESCE_ENABLED, STREAM_COALESCE_WINDOW_MS, STREAM_COALESCE_MAX_WINDOW_MS,
+    STREAM_COALESCE_MAX_BYTES, STREAM_COMPRESSION_ENABLED, STREAM_COMPRESSION_ZSTD_LEVEL,
+    STREAM_COMPRESSION_GZIP_LEVEL, REQUEST_MAX_DECOMPRESSED_BYTES, STREAM_DISCONNECT_CHECK_INTERVAL,
+    HEDGE_ENABLED, CIRCUIT_BREAKER_ENABLED, RATE_LIMIT_CLIENT_HEADERS, RATE_LIMIT_TRUST_FORWARDED_FOR,
+    RATE_LIMIT_TRUSTED_PROXIES
 )
 import os
 import uuid
+from typing import Optional
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.types import ASGIApp
 from datetime import datetime, timezone
 import supabase_client
-import json
 
 # Request ID middleware
 class RequestIDMiddleware(BaseHTTPMiddleware):
@@ -101,6 +128,20 @@ app = FastAPI(
 # Mount static files directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Per-client rate limits on new chat requests; innermost, so it sees decompressed
+# bodies and its 429s still get CORS headers
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    client_headers=RATE_LIMIT_CLIENT_HEADERS,
+    trust_forwarded_for=RATE_LIMIT_TRUST_FORWARDED_FOR,
+    trusted_proxies=RATE_LIMIT_TRUSTED_PROXIES,
+    max_body_size=REQUEST_MAX_DECOMPRESSED_BYTES
+)
+
+# Shed new chat requests while overloaded, before rate limiting charges them
+app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -110,6 +151,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Decompress Content-Encoding: zstd|gzip request bodies before validation
+app.add_middleware(RequestDecompressionMiddleware, max_size=REQUEST_MAX_DECOMPRESSED_BYTES)
+
 # Add request ID middleware
 app.add_middleware(RequestIDMiddleware)
 
@@ -246,10 +290,252 @@ async def startup_db_client():
         if SENTRY_DSN:
             sentry_sdk.capture_exception(e)
 
+def build_stream_response(chat_stream: ChatStream, client_request: Request, last_event_id: int = 0) -> StreamingResponse:
+    """
+    Build the HTTP response for one reader of a chat stream.
+    
+    Events after `last_event_id` are replayed from the stream's buffer, then
+    coalesced, encoded in the negotiated wire format and optionally compressed.
+    """
+    # Pick the wire format from the Accept header (SSE by default)
+    encoder = negotiate_stream_encoder(client_request.headers.get("accept"))
+
+    async def encoded_events():
+        loop = asyncio.get_running_loop()
+        last_check = loop.time()
+        events = chat_stream.read(after=last_event_id)
+        if STREAM_COALESCE_ENABLED:
+            events = coalesce_events(
+                events,
+                window=STREAM_COALESCE_WINDOW_MS / 1000,
+                max_bytes=STREAM_COALESCE_MAX_BYTES,
+                max_window=STREAM_COALESCE_MAX_WINDOW_MS / 1000
+            )
+        async for event in events:
+            # Stop reading once the client is gone; the stream cancels itself
+            # when no reader is left
+            now = loop.time()
+            if now - last_check >= STREAM_DISCONNECT_CHECK_INTERVAL:
+                last_check = now
+                if await client_request.is_disconnected():
+                    debug_with_context(logger,
+                        "Client disconnected from chat stream",
+                        message_id=chat_stream.message_id
+                    )
+                    return
+            # Serialize once, at the edge
+            yield encoder.encode(event)
+
+    headers = {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "X-Accel-Buffering": "no",
+        "Vary": "Accept, Accept-Encoding",
+        "X-Message-ID": chat_stream.message_id,
+        # The provider actually serving the stream (resolved for /chat/auto)
+        "X-Provider": chat_stream.provider,
+    }
+    body = encoded_events()
+
+    # Optional flush-aware compression, negotiated via Accept-Encoding
+    if STREAM_COMPRESSION_ENABLED:
+        compressor = negotiate_stream_compressor(
+            client_request.headers.get("accept-encoding"),
+            levels={"zstd": STREAM_COMPRESSION_ZSTD_LEVEL, "gzip": STREAM_COMPRESSION_GZIP_LEVEL}
+        )
+        if compressor:
+            body = compress_stream(body, compressor)
+            headers["Content-Encoding"] = compressor.encoding
+
+    return StreamingResponse(
+        body,
+        media_type=encoder.media_type,
+        headers=headers
+    )
+
+async def persist_chat_stream(chat_stream: ChatStream) -> None:
+    """Log the assistant message and conversation end once a generation finishes.
+    
+    The message records the model that served it, its output tokens and the
+    provider's full usage report. Cancelled or failed generations still
+    persist whatever was streamed. A generation shared by identical requests
+    is logged to every conversation.
+    """
+    response_content = chat_stream.accumulator.text()
+    if chat_stream.status != "completed":
+        debug_with_context(logger,
+            "Persisting partial chat response",
+            message_id=chat_stream.message_id,
+            status=chat_stream.status,
+            cancel_reason=chat_stream.cancel_reason,
+            partial_chunks=chat_stream.accumulator.chunks,
+            partial_length=len(response_content)
+        )
+    # The model that streamed the answer, which differs from the default after a failover
+    model = chat_stream.accumulator.model or PROVIDER_SETTINGS[chat_stream.provider].get("default_model", "unknown")
+    usage = chat_stream.accumulator.usage
+    for conversation_id in [chat_stream.conversation_id, *chat_stream.shared_conversation_ids]:
+        if response_content:
+            await supabase_client.log_message(
+                conversation_id=conversation_id,
+                role="assistant",
+                content=response_content,
+                model=model,
+                tokens=usage.get("output_tokens") if usage else None,
+                usage=usage
+            )
+        
+        # Log conversation end
+        await supabase_client.log_conversation_end(conversation_id)
+
+async def finish_chat_stream(chat_stream: ChatStream) -> None:
+    """Cache a completed, cacheable answer, then persist the generation."""
+    if chat_stream.status == "completed":
+        model = PROVIDER_SETTINGS[chat_stream.provider]["default_model"]
+        if chat_stream.cache_key:
+            await response_cache.store_stream(chat_stream.cache_key, chat_stream.events, model)
+        if chat_stream.near_duplicate_key:
+            near_duplicate_cache.store_stream(chat_stream.near_duplicate_key, chat_stream.events, model)
+    await persist_chat_stream(chat_stream)
+
+def serve_cached_response(cached: CachedResponse, provider: str, conversation_id: str,
+                          idempotency_key: Optional[str], request_hash: Optional[str],
+                          client_request: Request) -> StreamingResponse:
+    """Replay a cached answer as a new chat stream, persisted like a live one."""
+    chat_stream = ChatStream(
+        message_id=generate_message_id(provider),
+        provider=provider,
+        conversation_id=conversation_id,
+        idempotency_key=idempotency_key,
+        request_hash=request_hash
+    )
+    stream_registry.register(chat_stream)
+    chat_stream.start(replay_cached_response(cached, chat_stream.message_id), on_finish=persist_chat_stream)
+    debug_with_context(logger,
+        "Serving chat response from cache",
+        provider=provider,
+        model=cached.model,
+        message_id=chat_stream.message_id,
+        conversation_id=conversation_id
+    )
+    return build_stream_response(chat_stream, client_request)
+
+# Load tokenizers off the event loop (from TIKTOKEN_CACHE_DIR when offline)
+@app.on_event("startup")
+async def startup_tokenizers():
+    """Load the tiktoken encodings used for context window budgets."""
+    await asyncio.to_thread(load_encodings)
+
+# Pre-warm provider connections
+@app.on_event("startup")
+async def startup_transport():
+    """Open provider connections ahead of the first request and keep them warm."""
+    await transport_manager.warm_up()
+    transport_manager.start_keepalive()
+    logger.info("Provider connections pre-warmed")
+
+@app.on_event("shutdown")
+async def shutdown_transport():
+    """Close the shared provider HTTP clients."""
+    await transport_manager.close()
+
+@app.on_event("shutdown")
+async def shutdown_response_cache():
+    """Close the response cache's Redis connection, if any."""
+    await response_cache.close()
+
+@app.on_event("startup")
+async def startup_loop_lag_monitor():
+    """Start sampling event-loop lag for admission control."""
+    loop_lag_monitor.start()
+
+@app.on_event("shutdown")
+async def shutdown_loop_lag_monitor():
+    """Stop sampling event-loop lag."""
+    await loop_lag_monitor.stop()
+
+@app.on_event("shutdown")
+async def shutdown_rate_limiter():
+    """Close the rate limiter's Redis connection, if any."""
+    await rate_limiter.close()
+
+@app.on_event("startup")
+async def startup_batch_jobs():
+    """Start the batch workers and resume unfinished batch jobs."""
+    await batch_jobs.start()
+
+@app.on_event("shutdown")
+async def shutdown_batch_jobs():
+    """Stop the batch workers, saving job progress."""
+    await batch_jobs.stop()
+
+# Batch endpoints come before /chat/{provider}, which would otherwise match "batch"
+@app.post("/chat/batch", status_code=202)
+async def create_batch_job(request: BatchChatRequest):
+    """Queue many chat requests as one job; poll it or stream its results as NDJSON."""
+    job = await batch_jobs.submit(request)
+    return JSONResponse(
+        status_code=202,
+        content=job.summary(),
+        headers={"Location": f"/chat/batch/{job.id}"}
+    )
+
+@app.get("/chat/batch/{job_id}")
+async def get_batch_job(job_id: str, offset: int = 0, limit: int = 100):
+    """Get a batch job's progress and a page of its results, in completion order."""
+    job = await batch_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found")
+    return {**job.summary(), "results": job.results_page(max(offset, 0), min(max(limit, 0), 1000))}
+
+@app.get("/chat/batch/{job_id}/results")
+async def stream_batch_results(job_id: str):
+    """Stream a batch job's results as NDJSON as they complete, until the job finishes."""
+    job = await batch_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found")
+    encoder = NDJSONEncoder()
+
+    async def body():
+        async for result in batch_jobs.follow(job):
+            yield encoder.frame(result)
+
+    return StreamingResponse(body(), media_type=encoder.media_type)
+
+@app.delete("/chat/batch/{job_id}")
+async def cancel_batch_job(job_id: str):
+    """Cancel a batch job's outstanding requests; finished results are kept."""
+    job = await batch_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found")
+    cancelled = await batch_jobs.cancel(job)
+    logger.info(f"Cancel requested for batch job {job_id}: {'cancelled' if cancelled else job.status}")
+    return job.summary()
+
+# Like the batch endpoints, /chat/compare must come before /chat/{provider}
+@app.post("/chat/compare")
+async def compare_chat(request: CompareChatRequest, client_request: Request):
+    """Stream several providers/models answering the same conversation over one connection, tagged by source."""
+    deadline = deadline_for_request(client_request.headers.get("x-request-timeout"))
+    chat_stream = ChatStream(
+        message_id=generate_message_id("compare"),
+        provider="compare",
+        conversation_id=str(uuid.uuid4())
+    )
+    stream_registry.register(chat_stream)
+    chat_stream.start(compare_stream(request, chat_stream.message_id, deadline))
+    debug_with_context(logger,
+        "Comparison stream started",
+        message_id=chat_stream.message_id,
+        sources=request.sources,
+        cancel=request.cancel
+    )
+    return build_stream_response(chat_stream, client_request)
+
 # Chat endpoint
 @app.post("/chat/{provider}")
-async def chat(provider: str, request: ChatRequest, client_request: Request):
-    """Stream chat responses from an AI provider"""
+async def chat(provider: str, request: ChatRequest, client_request: Request, policy: Optional[str] = None):
+    """Stream chat responses from an AI provider, or from the best one right now for "auto"."""
     debug_with_context(logger,
         "Chat endpoint called",
         provider=provider,
@@ -258,6 +544,15 @@ async def chat(provider: str, request: ChatRequest, client_request: Request):
         request_id=get_request_id()
     )
     start_time = time.time()
+    # The time budget starts now; X-Request-Timeout may override it within limits
+    deadline = deadline_for_request(client_request.headers.get("x-request-timeout"))
+
+    # Idempotency keys are bound to the provider the client asked for, before "auto" resolves
+    requested_provider = provider
+
+    # The virtual "auto" provider resolves to a real one from live latency statistics
+    if provider == AUTO_PROVIDER:
+        provider = router.choose(policy or client_request.headers.get("x-route-policy"))
 
     # Validate provider first
     if provider not in SUPPORTED_PROVIDERS:
@@ -273,6 +568,28 @@ async def chat(provider: str, request: ChatRequest, client_request: Request):
             detail="No messages provided in request"
         )
 
+    # A retried POST with the same Idempotency-Key attaches to the existing generation;
+    # reusing the key for a different request is a client error
+    idempotency_key = client_request.headers.get("idempotency-key")
+    request_hash = idempotency_fingerprint(requested_provider, request) if idempotency_key else None
+    if idempotency_key:
+        try:
+            existing_stream = stream_registry.get_by_idempotency_key(idempotency_key, request_hash)
+        except IdempotencyKeyReused as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if existing_stream:
+            debug_with_context(logger,
+                "Attaching to existing chat stream",
+                provider=provider,
+                message_id=existing_stream.message_id,
+                idempotency_key=idempotency_key
+            )
+            return build_stream_response(
+                existing_stream,
+                client_request,
+                parse_last_event_id(client_request.headers.get("last-event-id"))
+            )
+
     try:
         debug_with_context(logger,
             f"Chat request received for provider: {provider}",
@@ -312,53 +629,79 @@ async def chat(provider: str, request: ChatRequest, client_request: Request):
                     model=None
                 )
 
-        # Create streaming response
-        async def wrapped_stream_response():
-            response_content = ""
-            async for chunk in stream_response(request, provider, conversation_id):
-                # Accumulate response content
-                if not chunk.startswith("data: [DONE]") and chunk.startswith("data: "):
-                    try:
-                        # Extract content from SSE format
-                        json_str = chunk[6:].strip()  # Remove "data: " prefix
-                        if json_str:
-                            data = json.loads(json_str)
-                            if "delta" in data and "content" in data["delta"]:
-                                response_content += data["delta"]["content"]
-                    except Exception as e:
-                        logger.error(f"Error parsing chunk: {str(e)}")
-                
-                # Forward chunk to client
-                yield chunk
-            
-            # Log assistant message at the end of the stream
-            if response_content:
-                await supabase_client.log_message(
-                    conversation_id=conversation_id,
-                    role="assistant",
-                    content=response_content,
-                    model=PROVIDER_SETTINGS[provider].get("default_model", "unknown")
-                )
-            
-            # Log conversation end
-            await supabase_client.log_conversation_end(conversation_id)
-
-        response = StreamingResponse(
-            wrapped_stream_response(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",
-            }
+        # Identical deterministic requests replay a cached answer; Cache-Control: no-cache
+        # skips the lookup and no-store also keeps the answer out of the cache
+        cache_control = client_request.headers.get("cache-control", "").lower()
+        cache_key = None if "no-store" in cache_control else response_cache_key(provider, request)
+        cached = await response_cache.get(cache_key) if cache_key and "no-cache" not in cache_control else None
+        if cached:
+            response = serve_cached_response(cached, provider, conversation_id, idempotency_key, request_hash,
+                                             client_request)
+            response.headers["X-Cache"] = "HIT"
+            return response
+
+        # Single-turn prompts differing only in casing, spacing or punctuation share an answer
+        near_key = None if "no-store" in cache_control else near_duplicate_cache.key_for(provider, request)
+        near_hit = near_duplicate_cache.lookup(near_key) if near_key and "no-cache" not in cache_control else None
+        if near_hit:
+            cached, similarity = near_hit
+            response = serve_cached_response(cached, provider, conversation_id, idempotency_key, request_hash,
+                                             client_request)
+            response.headers["X-Cache"] = "HIT-NEAR"
+            response.headers["X-Cache-Similarity"] = f"{similarity:.3f}"
+            return response
+
+        # Identical deterministic requests in flight share one upstream generation
+        flight_key = singleflight_key(provider, request)
+        shared_stream = stream_registry.join_inflight(
+            flight_key, conversation_id, idempotency_key, request_hash
+        ) if flight_key else None
+        if shared_stream:
+            debug_with_context(logger,
+                "Joined in-flight identical chat request",
+                provider=provider,
+                message_id=shared_stream.message_id,
+                conversation_id=conversation_id
+            )
+            response = build_stream_response(shared_stream, client_request)
+            response.headers["X-Singleflight"] = "shared"
+            return response
+
+        # Under load, new generations move to the provider's economy model with capped output;
+        # a degraded answer is neither shared with nor cached for full-quality requests
+        degradation = degradation_controller.decide(provider)
+
+        # Run the generation in the background so readers can detach and resume
+        chat_stream = ChatStream(
+            message_id=generate_message_id(provider),
+            provider=provider,
+            conversation_id=conversation_id,
+            idempotency_key=idempotency_key,
+            request_hash=request_hash,
+            singleflight_key=None if degradation else flight_key,
+            cache_key=None if degradation else cache_key,
+            near_duplicate_key=None if degradation else near_key
+        )
+        stream_registry.register(chat_stream)
+        chat_stream.start(
+            stream_response(request, provider, conversation_id, chat_stream.accumulator, chat_stream.message_id,
+                            deadline, degradation),
+            on_finish=finish_chat_stream
         )
 
+        response = build_stream_response(chat_stream, client_request)
+        if cache_key or near_key:
+            response.headers["X-Cache"] = "MISS"
+        if degradation:
+            response.headers["X-Degraded"] = degradation.header()
+
         init_duration = time.time() - start_time
         debug_with_context(logger,
             "Chat stream response initialized",
             init_duration=f"{init_duration:.3f}s",
             provider=provider,
-            conversation_id=conversation_id
+            conversation_id=conversation_id,
+            message_id=chat_stream.message_id
         )
         return response
 
@@ -374,6 +717,43 @@ async def chat(provider: str, request: ChatRequest, client_request: Request):
             sentry_sdk.capture_exception(e)
         raise HTTPException(status_code=500, detail=f"Chat error with {provider}: {str(e)}")
 
+@app.get("/chat/streams/{message_id}")
+async def resume_chat_stream(message_id: str, client_request: Request, last_event_id: Optional[int] = None):
+    """Resume or follow a chat stream from its replay buffer.
+    
+    The position is taken from the `Last-Event-ID` header (or the
+    `last_event_id` query parameter); without one the whole stream is replayed.
+    """
+    chat_stream = stream_registry.get(message_id)
+    if not chat_stream:
+        raise HTTPException(status_code=404, detail=f"Stream {message_id} not found or expired")
+
+    if last_event_id is None:
+        last_event_id = parse_last_event_id(client_request.headers.get("last-event-id"))
+
+    debug_with_context(logger,
+        "Resuming chat stream",
+        message_id=message_id,
+        last_event_id=last_event_id,
+        finished=chat_stream.finished
+    )
+    return build_stream_response(chat_stream, client_request, last_event_id)
+
+@app.delete("/chat/streams/{message_id}")
+async def cancel_chat_stream(message_id: str):
+    """Abort an in-flight generation; partial output is still persisted."""
+    chat_stream = stream_registry.get(message_id)
+    if not chat_stream:
+        raise HTTPException(status_code=404, detail=f"Stream {message_id} not found or expired")
+
+    cancelled = chat_stream.cancel("cancelled_by_client")
+    logger.info(f"Cancel requested for chat stream {message_id}: {'cancelled' if cancelled else chat_stream.status}")
+    return {
+        "message_id": message_id,
+        "status": "cancelled" if cancelled else chat_stream.status,
+        "partial_chunks": chat_stream.accumulator.chunks
+    }
+
 # Add conversation history endpoints
 @app.get("/conversations")
 async def get_conversations(limit: int = 10, offset: int = 0):
@@ -428,6 +808,85 @@ async def search_conversations(
             sentry_sdk.capture_exception(e)
         raise HTTPException(status_code=500, detail=f"Error searching conversations: {str(e)}")
 
+@app.get("/stats/transport")
+async def get_transport_stats():
+    """Get provider connection pool statistics"""
+    return transport_manager.stats()
+
+@app.get("/stats/circuits")
+async def get_circuit_stats():
+    """Get circuit breaker state per provider and model, and each provider's failover chain"""
+    return {
+        "enabled": CIRCUIT_BREAKER_ENABLED,
+        "circuits": circuit_breakers.snapshot(),
+        "failover_chains": all_failover_steps()
+    }
+
+@app.get("/stats/upstream")
+async def get_upstream_stats():
+    """Get upstream concurrency limits, queue depths and wait times per provider and model"""
+    return upstream_limits.snapshot()
+
+@app.get("/stats/admission")
+async def get_admission_stats():
+    """Get load signals, their limits and how many chat requests were admitted or shed"""
+    return admission_controller.stats()
+
+@app.get("/stats/degradation")
+async def get_degradation_stats():
+    """Get degradation mode state and load signals per provider"""
+    return degradation_controller.stats()
+
+@app.get("/stats/ratelimit")
+async def get_rate_limit_stats():
+    """Get inbound rate limit policy, tracked clients and rejections"""
+    return rate_limiter.stats()
+
+@app.get("/stats/router")
+async def get_router_stats():
+    """Get auto-routing decisions and the live statistics of every candidate"""
+    return {
+        **router.stats(),
+        "models": model_stats.snapshot()
+    }
+
+@app.get("/stats/hedging")
+async def get_hedging_stats():
+    """Get hedge rate, hedge win rate, wasted work and TTFT percentiles per provider"""
+    return {
+        "enabled": HEDGE_ENABLED,
+        "providers": hedge_stats.snapshot(),
+        "ttft": ttft_tracker.snapshot()
+    }
+
+@app.get("/stats/usage")
+async def get_usage_stats():
+    """Get provider-reported input and prompt cache token counts per provider and model"""
+    return usage_stats.snapshot()
+
+@app.get("/stats/context")
+async def get_context_stats():
+    """Get context window trimming and token count cache statistics"""
+    return context_windows.stats()
+
+@app.get("/stats/cache")
+async def get_cache_stats():
+    """Get exact-match and near-duplicate cache hits, misses, evictions and size"""
+    return {
+        **response_cache.stats(),
+        "near_duplicate": near_duplicate_cache.stats()
+    }
+
+@app.get("/stats/batch")
+async def get_batch_stats():
+    """Get batch worker, queue and job statistics"""
+    return batch_jobs.stats()
+
+@app.get("/stats/streams")
+async def get_stream_stats():
+    """Get counts of in-memory chat streams by status"""
+    return stream_registry.stats()
+
 @app.get("/stats")
 async def get_stats():
     """Get database statistics"""
@@ -3,7 +3,7 @@ from enum import Enum
 from typing import List, Optional, Dict
 from pydantic import BaseModel, Field, field_validator
 from typing_extensions import Literal
-from configuration import MAX_MESSAGE_LENGTH, MAX_MESSAGES_IN_CONTEXT, MIN_MESSAGE_LENGTH, SUPPORTED_PROVIDERS  # Import from configuration
+from configuration import MAX_MESSAGE_LENGTH, MAX_MESSAGES_IN_CONTEXT, MIN_MESSAGE_LENGTH, SUPPORTED_PROVIDERS, PROVIDER_SETTINGS, BATCH_MAX_REQUESTS, COMPARE_MAX_SOURCES, COMPARE_MODELS  # Import from configuration
 
 class MessageRole(str, Enum):
     USER = "user"
@@ -41,6 +41,67 @@ class ChatRequest(BaseModel):
             raise ValueError(f"Conversation exceeds maximum of {MAX_MESSAGES_IN_CONTEXT} messages")
         return v
 
+class BatchChatItem(ChatRequest):
+    provider: str
+    # Caller's identifier, echoed in the result (defaults to the position in the batch)
+    custom_id: Optional[str] = None
+
+    @field_validator('provider')
+    @classmethod
+    def validate_provider(cls, v):
+        if v not in SUPPORTED_PROVIDERS:
+            raise ValueError(f"Invalid provider. Supported providers are: {', '.join(SUPPORTED_PROVIDERS)}")
+        return v
+
+class BatchChatRequest(BaseModel):
+    requests: List[BatchChatItem] = Field(
+        ...,
+        min_length=1,
+        description="Chat requests to run. Cannot be empty."
+    )
+    # local (worker pool) or native (provider batch APIs where available); defaults to BATCH_DEFAULT_MODE
+    mode: Optional[Literal["local", "native"]] = None
+
+    @field_validator('requests')
+    @classmethod
+    def validate_requests(cls, v):
+        if len(v) > BATCH_MAX_REQUESTS:
+            raise ValueError(f"Batch exceeds maximum of {BATCH_MAX_REQUESTS} requests")
+        custom_ids = [item.custom_id for item in v if item.custom_id is not None]
+        if len(custom_ids) != len(set(custom_ids)):
+            raise ValueError("custom_id values must be unique within a batch")
+        return v
+
+class CompareChatRequest(ChatRequest):
+    sources: List[str] = Field(
+        ...,
+        min_length=1,
+        description="Sources to compare: a provider, or provider:model. Cannot be empty."
+    )
+    # Cancel the other sources once one sends its first token or completes; None runs all to the end
+    cancel: Optional[Literal["first_token", "first_complete"]] = None
+
+    @field_validator('sources')
+    @classmethod
+    def validate_sources(cls, v):
+        if len(v) > COMPARE_MAX_SOURCES:
+            raise ValueError(f"Comparison exceeds maximum of {COMPARE_MAX_SOURCES} sources")
+        sources = []
+        for source in v:
+            provider, _, model = source.strip().partition(":")
+            provider = provider.strip()
+            if provider not in SUPPORTED_PROVIDERS:
+                raise ValueError(f"Invalid provider in source '{source}'. Supported providers are: {', '.join(SUPPORTED_PROVIDERS)}")
+            # Normalized to provider:model, the provider's default model if none is given
+            source = f"{provider}:{model.strip() or PROVIDER_SETTINGS[provider]['default_model']}"
+            if source not in COMPARE_MODELS:
+                raise ValueError(f"Model in source '{source}' is not configured. Allowed sources are: "
+                                 f"{', '.join(sorted(m for m in COMPARE_MODELS if m.split(':')[0] == provider))}")
+            sources.append(source)
+        if len(sources) != len(set(sources)):
+            raise ValueError("sources must be unique within a comparison")
+        return sources
+
 class HealthResponse(BaseModel):
     status: Literal["OK", "ERROR"]
     message: Optional[str] = None
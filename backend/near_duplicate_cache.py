@@ -0,0 +1,264 @@
+"""
+Near-duplicate answer cache for single-turn prompts.
+
+Prompts that differ only in casing, whitespace or punctuation ("what is 2+2"
+vs "What is 2 + 2?") miss the exact-match response cache. This cache keys
+single-turn requests by a MinHash signature of the normalized user message,
+computed locally with NumPy, and finds earlier answers through an LSH index
+over signature bands, so a lookup only compares against a handful of
+candidates.
+
+Normalization keeps operators and other symbols as tokens; only whitespace
+and sentence punctuation (`?`, `.`, `!`, `,`, `;`, `:`) are dropped.
+
+MinHash only finds candidates: a small edit can flip a prompt's meaning while
+keeping its shingles ("increased" vs "decreased", "does" vs "does not"). A
+candidate is a hit only when both normalized prompts have the same tokens
+(words, numbers and symbols) in the same order, so "2+2" never answers "2*2"
+and "x > y" never answers "x < y"; its estimated Jaccard similarity must also
+reach the provider's NEAR_DUPLICATE_THRESHOLD. Provider, model, normalized
+system prompt, temperature and max tokens must match exactly.
+"""
+import hashlib
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from models import ChatRequest
+from prompt_engineering import get_system_prompt
+from response_cache import CachedResponse, cached_response_from_events
+from stream_events import StreamEvent
+from logging_config import logger, debug_with_context
+from configuration import (
+    PROVIDER_SETTINGS,
+    NEAR_DUPLICATE_CACHE_ENABLED,
+    NEAR_DUPLICATE_PROVIDERS,
+    NEAR_DUPLICATE_MAX_TEMPERATURE,
+    NEAR_DUPLICATE_MAX_PROMPT_CHARS,
+    NEAR_DUPLICATE_MAX_ENTRIES,
+    NEAR_DUPLICATE_TTL_SECONDS,
+    NEAR_DUPLICATE_NUM_PERM,
+    NEAR_DUPLICATE_BANDS,
+    NEAR_DUPLICATE_SHINGLE_SIZE
+)
+
+# Modulus of the universal hash family (a * x + b) % p
+_PRIME = np.uint64((1 << 31) - 1)
+# Numbers (with decimal or thousands separators), words, and single symbols
+_TOKEN = re.compile(r"\d+(?:[.,]\d+)*|\w+|[^\w\s]")
+# Dropped by normalization: they rarely change what is asked
+_SENTENCE_PUNCTUATION = frozenset("?.!,;:")
+
+def normalize_prompt(text: str) -> str:
+    """
+    Lowercase the tokens of a prompt and join them with single spaces.
+
+    Operators and other symbols stay as tokens ("2+2" -> "2 + 2"); only
+    sentence punctuation is dropped.
+    """
+    return " ".join(
+        token for token in _TOKEN.findall(text.lower())
+        if token not in _SENTENCE_PUNCTUATION
+    )
+
+class MinHasher:
+    """MinHash signatures over character shingles, one vectorized pass per text."""
+
+    def __init__(self, num_perm: int, shingle_size: int, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> Set[str]:
+        n = self.shingle_size
+        return {text[i:i + n] for i in range(max(1, len(text) - n + 1))}
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self.shingles(text)
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles)
+        ) % _PRIME
+        # (num_perm, shingles) matrix of permuted hashes, minimum per permutation
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _PRIME).min(axis=1)
+
+class NearDuplicateKey:
+    """What a single-turn request is looked up and stored by."""
+    __slots__ = ("provider", "namespace", "signature", "tokens", "threshold")
+
+    def __init__(self, provider: str, namespace: str, signature: np.ndarray, tokens: Tuple[str, ...],
+                 threshold: float):
+        self.provider = provider
+        # Hash of everything that must match exactly
+        self.namespace = namespace
+        self.signature = signature
+        # Tokens of the normalized prompt, in order; a hit must match them exactly
+        self.tokens = tokens
+        self.threshold = threshold
+
+class _Entry:
+    __slots__ = ("key", "response", "expires_at")
+
+    def __init__(self, key: NearDuplicateKey, response: CachedResponse, expires_at: float):
+        self.key = key
+        self.response = response
+        self.expires_at = expires_at
+
+class NearDuplicateCache:
+    """Bounded, TTL-evicted answers indexed by MinHash LSH bands."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, num_perm: int, bands: int, shingle_size: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, bytes], Set[int]] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.skipped = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lookup_seconds = 0.0
+
+    def key_for(self, provider: str, request: ChatRequest) -> Optional[NearDuplicateKey]:
+        """
+        Return the lookup key for a request, or None if it is not eligible.
+
+        Eligible requests have one user message and no assistant turns, go to a
+        provider in NEAR_DUPLICATE_PROVIDERS configured at or below
+        NEAR_DUPLICATE_MAX_TEMPERATURE, and are at most
+        NEAR_DUPLICATE_MAX_PROMPT_CHARS long.
+        """
+        if not NEAR_DUPLICATE_CACHE_ENABLED or provider not in NEAR_DUPLICATE_PROVIDERS:
+            return None
+        settings = PROVIDER_SETTINGS[provider]
+        if settings["temperature"] > NEAR_DUPLICATE_MAX_TEMPERATURE:
+            return None
+        turns = [m for m in request.messages if m.role != "system"]
+        if len(turns) != 1 or turns[0].role != "user" or len(turns[0].content) > NEAR_DUPLICATE_MAX_PROMPT_CHARS:
+            return None
+
+        prompt = normalize_prompt(turns[0].content)
+        if not prompt:
+            return None
+        namespace = hashlib.sha256("\x1f".join([
+            provider,
+            settings["default_model"],
+            normalize_prompt(get_system_prompt(request.messages, provider)),
+            str(settings["temperature"]),
+            str(settings["max_tokens"]),
+        ]).encode("utf-8")).hexdigest()
+        return NearDuplicateKey(
+            provider,
+            namespace,
+            self.hasher.signature(prompt),
+            tuple(prompt.split(" ")),
+            settings["near_duplicate_threshold"]
+        )
+
+    def _bands(self, key: NearDuplicateKey) -> List[Tuple[str, int, bytes]]:
+        return [
+            (key.namespace, band, key.signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def lookup(self, key: NearDuplicateKey) -> Optional[Tuple[CachedResponse, float]]:
+        """
+        Find the most similar cached answer at or above the key's threshold.
+
+        Returns:
+            (answer, estimated similarity), or None on a miss
+        """
+        started = time.perf_counter()
+        self._expire()
+        candidates: Set[int] = set()
+        for bucket in self._bands(key):
+            candidates |= self._buckets.get(bucket, set())
+
+        best_id, best_similarity = None, 0.0
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            if entry.key.tokens != key.tokens:
+                continue
+            similarity = float(np.count_nonzero(entry.key.signature == key.signature)) / len(key.signature)
+            if similarity > best_similarity:
+                best_id, best_similarity = entry_id, similarity
+        self.lookup_seconds += time.perf_counter() - started
+
+        if best_id is None or best_similarity < key.threshold:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(best_id)
+        self.hits += 1
+        return self._entries[best_id].response, best_similarity
+
+    def store_stream(self, key: NearDuplicateKey, events: List[StreamEvent], model: str) -> None:
+        """Index a finished generation if it completed on `model` without failing over."""
+        response = cached_response_from_events(events, model)
+        if response is None:
+            self.skipped += 1
+            return
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = _Entry(key, response, time.monotonic() + self.ttl_seconds)
+        for bucket in self._bands(key):
+            self._buckets.setdefault(bucket, set()).add(entry_id)
+        self.stores += 1
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        debug_with_context(logger, "Indexed chat response for near-duplicate lookup", model=model, entry_id=entry_id)
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for bucket in self._bands(entry.key):
+            ids = self._buckets.get(bucket)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._buckets[bucket]
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        expired = [entry_id for entry_id, entry in self._entries.items() if entry.expires_at <= now]
+        for entry_id in expired:
+            self._remove(entry_id)
+        self.expirations += len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        self._expire()
+        lookups = self.hits + self.misses
+        return {
+            "enabled": NEAR_DUPLICATE_CACHE_ENABLED,
+            "providers": {
+                provider: PROVIDER_SETTINGS[provider]["near_duplicate_threshold"]
+                for provider in NEAR_DUPLICATE_PROVIDERS if provider in PROVIDER_SETTINGS
+            },
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "buckets": len(self._buckets),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "skipped": self.skipped,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "mean_lookup_us": round(self.lookup_seconds / lookups * 1e6, 1) if lookups else 0.0,
+        }
+
+# Process-wide near-duplicate cache
+near_duplicate_cache = NearDuplicateCache(
+    NEAR_DUPLICATE_MAX_ENTRIES,
+    NEAR_DUPLICATE_TTL_SECONDS,
+    NEAR_DUPLICATE_NUM_PERM,
+    NEAR_DUPLICATE_BANDS,
+    NEAR_DUPLICATE_SHINGLE_SIZE
+)
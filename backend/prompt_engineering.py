@@ -10,6 +10,12 @@ from configuration import (
     GROQ_SYSTEM_PROMPT
 )
 
+# Sent after an interrupted assistant answer when a fallback model takes over
+CONTINUATION_PROMPT = (
+    "Your previous response was cut off. Continue it exactly where it stopped, "
+    "without repeating any of it and without acknowledging the interruption."
+)
+
 def get_system_prompt(messages: List[ConversationMessage], provider: str = None) -> str:
     """
     Get system prompt from messages or return provider-specific default.
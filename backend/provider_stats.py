@@ -0,0 +1,178 @@
+"""
+Rolling latency statistics per provider and model.
+
+Time to first token (TTFT) is recorded for every model attempt and kept in a
+bounded window of recent samples, so percentiles follow the provider's
+current behaviour rather than its all-time history. Exponentially weighted
+moving averages (EWMA) of TTFT, output throughput and error rate give the
+router a cheap, recency-biased view of each model.
+"""
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from configuration import PROVIDER_STATS_WINDOW, PROVIDER_STATS_EWMA_ALPHA
+
+# Rough characters per token, used to estimate throughput from streamed text
+CHARS_PER_TOKEN = 4
+
+class LatencyTracker:
+    """Bounded windows of latency samples keyed by (provider, model)."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        # Monotonic time of each sample, parallel to _samples
+        self._times: Dict[Tuple[str, str], Deque[float]] = {}
+
+    def record(self, provider: str, model: str, seconds: float) -> None:
+        key = (provider, model)
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+            self._times[key] = deque(maxlen=self.window)
+        samples.append(seconds)
+        self._times[key].append(time.monotonic())
+
+    def count(self, provider: str, model: str) -> int:
+        return len(self._samples.get((provider, model), ()))
+
+    def percentile(self, provider: str, model: str, pct: float, min_samples: int = 1,
+                   max_age: Optional[float] = None) -> Optional[float]:
+        """
+        Nearest-rank percentile of the recent samples.
+
+        Args:
+            max_age: Only use samples recorded within this many seconds
+
+        Returns:
+            The latency in seconds, or None with fewer than `min_samples` samples
+        """
+        samples = self._samples.get((provider, model))
+        if samples and max_age is not None:
+            cutoff = time.monotonic() - max_age
+            samples = [s for s, t in zip(samples, self._times[(provider, model)]) if t >= cutoff]
+        if not samples or len(samples) < max(1, min_samples):
+            return None
+        ordered = sorted(samples)
+        rank = max(1, math.ceil(pct / 100 * len(ordered)))
+        return ordered[min(rank, len(ordered)) - 1]
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Sample count and p50/p90/p99 in milliseconds per provider and model."""
+        result: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for (provider, model) in self._samples:
+            result.setdefault(provider, {})[model] = {
+                "samples": self.count(provider, model),
+                "p50_ms": round(self.percentile(provider, model, 50) * 1000, 1),
+                "p90_ms": round(self.percentile(provider, model, 90) * 1000, 1),
+                "p99_ms": round(self.percentile(provider, model, 99) * 1000, 1),
+            }
+        return result
+
+class EWMA:
+    """Exponentially weighted moving average; the first sample seeds it."""
+    __slots__ = ("alpha", "value")
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.value: Optional[float] = None
+
+    def update(self, sample: float) -> None:
+        self.value = sample if self.value is None else self.alpha * sample + (1 - self.alpha) * self.value
+
+class ModelStats:
+    """EWMA of TTFT (seconds), throughput (tokens/s) and error rate (0..1) for one model."""
+
+    def __init__(self, alpha: float):
+        self.ttft = EWMA(alpha)
+        self.throughput = EWMA(alpha)
+        self.error_rate = EWMA(alpha)
+        self.samples = 0
+        self.updated_at = time.monotonic()
+
+    def record_success(self, ttft: Optional[float], tokens_per_second: Optional[float]) -> None:
+        self.samples += 1
+        self.updated_at = time.monotonic()
+        self.error_rate.update(0.0)
+        if ttft is not None:
+            self.ttft.update(ttft)
+        if tokens_per_second is not None:
+            self.throughput.update(tokens_per_second)
+
+    def record_failure(self) -> None:
+        self.samples += 1
+        self.updated_at = time.monotonic()
+        self.error_rate.update(1.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "ttft_ms": round(self.ttft.value * 1000, 1) if self.ttft.value is not None else None,
+            "tokens_per_second": round(self.throughput.value, 1) if self.throughput.value is not None else None,
+            "error_rate": round(self.error_rate.value, 4) if self.error_rate.value is not None else None,
+            "age_seconds": round(time.monotonic() - self.updated_at, 1),
+        }
+
+class ModelStatsRegistry:
+    """ModelStats keyed by (provider, model), created on first use."""
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self._stats: Dict[Tuple[str, str], ModelStats] = {}
+
+    def get(self, provider: str, model: str) -> Optional[ModelStats]:
+        return self._stats.get((provider, model))
+
+    def _for(self, provider: str, model: str) -> ModelStats:
+        key = (provider, model)
+        if key not in self._stats:
+            self._stats[key] = ModelStats(self.alpha)
+        return self._stats[key]
+
+    def record_success(self, provider: str, model: str, ttft: Optional[float],
+                       output_chars: int, generation_seconds: float) -> None:
+        """Record a completed attempt; throughput is estimated from the streamed characters."""
+        tokens_per_second = None
+        if output_chars and generation_seconds > 0.05:
+            tokens_per_second = output_chars / CHARS_PER_TOKEN / generation_seconds
+        self._for(provider, model).record_success(ttft, tokens_per_second)
+
+    def record_failure(self, provider: str, model: str) -> None:
+        self._for(provider, model).record_failure()
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (provider, model), stats in self._stats.items():
+            result.setdefault(provider, {})[model] = stats.snapshot()
+        return result
+
+class UsageStats:
+    """Cumulative provider-reported token counts per (provider, model)."""
+
+    def __init__(self):
+        self._totals: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+    def record(self, provider: str, model: str, usage: Dict[str, int]) -> None:
+        totals = self._totals.setdefault((provider, model), {"requests": 0})
+        totals["requests"] += 1
+        for name, count in usage.items():
+            totals[name] = totals.get(name, 0) + count
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """Totals plus the share of input tokens served from the prompt cache."""
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (provider, model), totals in self._totals.items():
+            input_tokens = totals.get("input_tokens", 0)
+            result.setdefault(provider, {})[model] = {
+                **totals,
+                "cache_hit_ratio": round(totals.get("cache_read_tokens", 0) / input_tokens, 4) if input_tokens else 0.0,
+            }
+        return result
+
+# Process-wide time-to-first-token statistics
+ttft_tracker = LatencyTracker(PROVIDER_STATS_WINDOW)
+# Process-wide EWMA statistics used for routing
+model_stats = ModelStatsRegistry(PROVIDER_STATS_EWMA_ALPHA)
+# Process-wide provider-reported token usage
+usage_stats = UsageStats()
@@ -1,39 +1,86 @@
 # filepath: providers/anthropic_provider.py
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Optional
+import httpx
 from anthropic import AsyncAnthropic
 from .base import BaseProvider
+from stream_events import StreamEvent
+from call_context import CallContext
 from models import ConversationMessage
 from logging_config import logger
+from configuration import PROMPT_CACHE_ENABLED
+
+# Marks a content block as the end of a cacheable prompt prefix
+CACHE_CONTROL = {"type": "ephemeral"}
 
 class AnthropicProvider(BaseProvider):
     """Provider implementation for Anthropic (Claude) models."""
     
     def __init__(self, api_key: str, default_model: str, fallback_model: str, 
-                 temperature: float, max_tokens: int, system_prompt: str):
+                 temperature: float, max_tokens: int, system_prompt: str,
+                 http_client: Optional[httpx.AsyncClient] = None):
         super().__init__("claude", default_model, fallback_model, temperature, max_tokens, system_prompt)
-        self.client = AsyncAnthropic(api_key=api_key)
+        self.client = AsyncAnthropic(api_key=api_key, http_client=http_client)
     
-    def format_messages(self, messages: List[ConversationMessage]) -> List[Dict[str, Any]]:
-        """Format messages for Anthropic API."""
-        return [
+    def format_messages(self, messages: List[ConversationMessage], system_prompt: str) -> List[Dict[str, Any]]:
+        """
+        Format messages for Anthropic API.
+        
+        With prompt caching, the newest user turn and the one before it are
+        cache breakpoints: the request reads the history prefix the previous
+        turn wrote and writes the extended prefix for the next one.
+        """
+        formatted = [
             {"role": m.role, "content": m.content}
             for m in messages if m.role != "system"
         ]
+        if PROMPT_CACHE_ENABLED:
+            for i in [i for i, m in enumerate(formatted) if m["role"] == "user"][-2:]:
+                formatted[i] = {
+                    "role": formatted[i]["role"],
+                    "content": [{"type": "text", "text": formatted[i]["content"], "cache_control": CACHE_CONTROL}]
+                }
+        return formatted
+    
+    def format_system(self, system_prompt: str) -> Any:
+        """The system prompt, marked as a cache breakpoint when prompt caching is enabled."""
+        if not PROMPT_CACHE_ENABLED:
+            return system_prompt
+        return [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+    
+    def format_continuation(self, messages: List[Dict[str, Any]], partial_text: str) -> List[Dict[str, Any]]:
+        """Prefill the partial answer as the final assistant turn; Claude continues it directly."""
+        # The API rejects a final assistant turn that ends with whitespace
+        prefill = partial_text.rstrip()
+        if not prefill:
+            return messages
+        return messages + [{"role": "assistant", "content": prefill}]
     
-    async def stream_response(self, messages: List[Dict[str, Any]], model: str, message_id: str) -> AsyncGenerator[str, None]:
+    async def stream_response(self, messages: List[Dict[str, Any]], model: str,
+                              context: CallContext) -> AsyncGenerator[StreamEvent, None]:
         """Stream a response from Anthropic."""
+        message_id, deadline = context.message_id, context.deadline
         try:
+            # Bound connect and read waits by the request deadline
+            timeout_kwargs = {'timeout': deadline.http_timeout()} if deadline else {}
             async with self.client.messages.stream(
                 model=model,
                 messages=messages,
-                system=self.system_prompt,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature,
+                system=self.format_system(context.system_prompt_for(self)),
+                max_tokens=context.max_tokens_for(self),
+                temperature=context.temperature_for(self),
+                **timeout_kwargs
             ) as stream:
+                self.observe_rate_limits(model, stream.response.headers)
                 async for text in stream.text_stream:
                     yield self.format_stream_chunk(message_id, text, model)
+                usage = (await stream.get_final_message()).usage
             
-            yield self.format_done_message()
+            # input_tokens excludes the tokens read from or written to the cache
+            cache_read = usage.cache_read_input_tokens or 0
+            cache_write = usage.cache_creation_input_tokens or 0
+            yield self.format_usage(message_id, model, usage.input_tokens + cache_read + cache_write,
+                                    usage.output_tokens, cache_read, cache_write)
+            yield self.format_done_message(message_id, model)
             
         except Exception as e:
             logger.error(f"Error in Claude stream: {str(e)}", exc_info=True)
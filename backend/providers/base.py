@@ -1,14 +1,26 @@
 # filepath: providers/base.py
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Tuple, AsyncGenerator
-import json
+from typing import List, Dict, Any, AsyncGenerator
 import time
-from fastapi import HTTPException
 from models import ConversationMessage
-from constants import SSEFormat
+from prompt_engineering import CONTINUATION_PROMPT
+from stream_events import StreamEvent
+from provider_stats import ttft_tracker, model_stats, usage_stats
+from circuit_breaker import circuit_breakers
+from failover import stream_with_failover
+from deadlines import DeadlineExceeded, within_deadline
+from call_context import CallContext
+from context_window import context_windows, estimate_tokens
+from upstream_limits import upstream_limits, UpstreamBusy
 
 class BaseProvider(ABC):
-    """Base class for all AI providers."""
+    """
+    Base class for all AI providers.
+    
+    Instances are shared by every request; their attributes are the configured
+    defaults and are never changed per request. Request-specific values
+    (system prompt, generation parameters, deadline) come from a CallContext.
+    """
     
     def __init__(self, provider_name: str, default_model: str, fallback_model: str, 
                  temperature: float, max_tokens: int, system_prompt: str):
@@ -20,8 +32,12 @@ class BaseProvider(ABC):
         self.system_prompt = system_prompt
     
     @abstractmethod
-    async def stream_response(self, messages: List[Dict[str, Any]], model: str, message_id: str) -> AsyncGenerator[str, None]:
-        """Stream a response from the AI provider."""
+    async def stream_response(self, messages: List[Dict[str, Any]], model: str,
+                              context: CallContext) -> AsyncGenerator[StreamEvent, None]:
+        """
+        Stream a response from the AI provider with the context's system prompt
+        and generation parameters, bounding its HTTP calls by the context's deadline.
+        """
         pass
     
     @abstractmethod
@@ -29,41 +45,143 @@ class BaseProvider(ABC):
         """Check if the provider is responding correctly."""
         pass
     
-    def format_messages(self, messages: List[ConversationMessage]) -> List[Dict[str, Any]]:
-        """Format messages for the provider API. Override in subclasses if needed."""
+    def format_messages(self, messages: List[ConversationMessage], system_prompt: str) -> List[Dict[str, Any]]:
+        """
+        Format messages for the provider API. Override in subclasses if needed.
+        
+        `system_prompt` is the request's system prompt, for APIs that take it
+        as a message.
+        """
         return [{"role": m.role, "content": m.content} for m in messages]
     
-    def format_stream_chunk(self, message_id: str, content: str, model: str) -> str:
-        """Format a chunk of streamed content."""
-        data = {
-            "id": message_id,
-            "delta": {
-                "content": content,
-                "model": model
-            }
-        }
-        return SSEFormat.format_data(json.dumps(data))
+    def format_continuation(self, formatted_messages: List[Dict[str, Any]], partial_text: str) -> List[Dict[str, Any]]:
+        """
+        Extend formatted messages so the model continues an interrupted answer.
+        
+        The default replays the partial answer as an assistant turn followed by
+        a continuation instruction. Override where the API supports prefill.
+        """
+        return formatted_messages + [
+            {"role": "assistant", "content": partial_text},
+            {"role": "user", "content": CONTINUATION_PROMPT}
+        ]
+    
+    async def prepare_messages(self, messages: List[ConversationMessage], model: str, context: CallContext,
+                               partial_text: str = "") -> List[Dict[str, Any]]:
+        """
+        Fit the conversation into the model's context window, then format it.
+        
+        With `partial_text`, the formatted messages ask the model to continue
+        that interrupted answer. The context's output cap is reserved in the window.
+        
+        Raises:
+            ContextWindowExceeded: If the newest message alone does not fit
+        """
+        system_prompt = context.system_prompt_for(self)
+        messages = await context_windows.fit(self.provider_name, model, system_prompt, messages,
+                                             context.max_tokens_for(self), partial_text)
+        formatted_messages = self.format_messages(messages, system_prompt)
+        if partial_text:
+            formatted_messages = self.format_continuation(formatted_messages, partial_text)
+        return formatted_messages
+    
+    def format_stream_chunk(self, message_id: str, content: str, model: str) -> StreamEvent:
+        """Wrap a chunk of streamed content in a delta event."""
+        return StreamEvent.delta(message_id, content, model)
     
-    def format_done_message(self) -> str:
-        """Format the done message for SSE."""
-        return SSEFormat.DONE_MESSAGE
+    def format_done_message(self, message_id: str, model: str) -> StreamEvent:
+        """Create the end-of-stream event."""
+        return StreamEvent.done(message_id, model)
     
-    async def try_with_models(self, messages: List[ConversationMessage], message_id: str) -> AsyncGenerator[str, None]:
-        """Try to get a response using default model, then fallback if needed."""
+    def observe_rate_limits(self, model: str, headers: Any) -> None:
+        """Pass a provider response's rate-limit headers to the model's upstream limiter."""
+        upstream_limits.get(self.provider_name, model).observe(headers)
+    
+    def format_usage(self, message_id: str, model: str, input_tokens: int, output_tokens: int,
+                     cache_read_tokens: int = 0, cache_write_tokens: int = 0) -> StreamEvent:
+        """
+        Create a usage event from the provider's reported token counts.
+        
+        `input_tokens` is the whole prompt, including tokens read from or
+        written to the provider's prompt cache.
+        """
+        return StreamEvent.meta(StreamEvent.USAGE, message_id, {
+            "input_tokens": input_tokens or 0,
+            "output_tokens": output_tokens or 0,
+            "cache_read_tokens": cache_read_tokens or 0,
+            "cache_write_tokens": cache_write_tokens or 0
+        }, model=model)
+    
+    async def stream_model(self, formatted_messages: List[Dict[str, Any]], model: str,
+                           context: CallContext) -> AsyncGenerator[StreamEvent, None]:
+        """
+        Stream a response from one model, recording its latency statistics and circuit outcome.
+        
+        The stream waits for a slot under the model's upstream concurrency
+        limit first, and reports its outcome back to it. The context's
+        cancellation token is checked between events.
+        
+        Raises:
+            asyncio.CancelledError: If the context's request was cancelled
+            DeadlineExceeded: If the model blows a phase of the deadline
+            UpstreamBusy: If no upstream slot frees up in time
+        """
+        deadline = context.deadline
+        breaker = circuit_breakers.get(self.provider_name, model)
+        limiter = upstream_limits.get(self.provider_name, model)
+        started_at = None
+        ttft = None
+        output_chars = 0
+        recorded = False
+        error = None
         try:
-            # Try with default model
-            formatted_messages = self.format_messages(messages)
-            async for chunk in self.stream_response(formatted_messages, self.default_model, message_id):
-                yield chunk
+            # Queue behind the model's upstream limit; only an active token budget needs an estimate
+            tokens = estimate_tokens(repr(formatted_messages)) if limiter.tracks_tokens else 0
+            started_at = await limiter.acquire(tokens, deadline.remaining() if deadline is not None else None)
+            start = time.monotonic()
+            events = self.stream_response(formatted_messages, model, context)
+            if deadline is not None:
+                events = within_deadline(events, deadline)
+            async for event in events:
+                context.cancellation.check()
+                if event.kind == StreamEvent.DELTA:
+                    output_chars += len(event.text)
+                    if ttft is None:
+                        ttft = time.monotonic() - start
+                        ttft_tracker.record(self.provider_name, model, ttft)
+                elif event.kind == StreamEvent.USAGE:
+                    usage_stats.record(self.provider_name, model, event.data)
+                # Record on the done event: callers may stop iterating right after it
+                if event.is_done and not recorded:
+                    recorded = True
+                    elapsed = time.monotonic() - start
+                    breaker.record_success(ttft if ttft is not None else elapsed)
+                    model_stats.record_success(self.provider_name, model, ttft, output_chars,
+                                               elapsed - (ttft or 0.0))
+                yield event
         except Exception as e:
-            # If default model fails, try fallback
-            try:
-                formatted_messages = self.format_messages(messages)
-                async for chunk in self.stream_response(formatted_messages, self.fallback_model, message_id):
-                    yield chunk
-            except Exception as inner_e:
-                # If both models fail, raise an exception
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Both default and fallback models failed for provider {self.provider_name}: {str(inner_e)}"
-                ) 
\ No newline at end of file
+            error = e
+            # Running out of the request's total budget, or never getting an upstream slot, is not the model's fault
+            not_the_model = isinstance(e, UpstreamBusy) or (isinstance(e, DeadlineExceeded) and e.phase == "total")
+            if not recorded and not not_the_model:
+                recorded = True
+                breaker.record_failure()
+                model_stats.record_failure(self.provider_name, model)
+            raise
+        finally:
+            if not recorded:
+                # Cancelled or closed early: no outcome, but free a half-open probe slot
+                breaker.release()
+            if started_at is not None:
+                limiter.release(started_at, ttft if recorded and error is None else None, error)
+    
+    async def try_with_models(self, messages: List[ConversationMessage],
+                              context: CallContext) -> AsyncGenerator[StreamEvent, None]:
+        """
+        Stream a response from the first model in the context's failover chain that succeeds.
+        
+        A model that blows a phase of the context's deadline fails over to the
+        next step while budget remains.
+        """
+        async for event in stream_with_failover(messages, context, self.provider_name):
+            yield event
@@ -4,6 +4,7 @@ from fastapi import HTTPException
 from logging_config import logger
 from providers.base import BaseProvider
 from configuration import PROVIDER_SETTINGS, SUPPORTED_PROVIDERS
+from transport import transport_manager
 
 # Import all provider implementations
 from providers.openai_provider import OpenAIProvider
@@ -71,13 +72,17 @@ class ProviderFactory:
             
         try:
             provider_class = cls._provider_classes[provider_name]
+            # Inject the shared, pre-warmed HTTP client where the SDK supports it
+            http_client = transport_manager.client_for(provider_name)
+            extra_kwargs = {'http_client': http_client} if http_client else {}
             cls._instances[provider_name] = provider_class(
                 api_key=settings['api_key'],
                 default_model=settings['default_model'],
                 fallback_model=settings['fallback_model'],
                 temperature=settings['temperature'],
                 max_tokens=settings['max_tokens'],
-                system_prompt=settings['system_prompt']
+                system_prompt=settings['system_prompt'],
+                **extra_kwargs
             )
             logger.info(f"Provider {provider_name} initialized successfully")
         except Exception as e:
@@ -1,10 +1,22 @@
 # filepath: providers/gemini_provider.py
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Optional, Tuple
+import hashlib
+from cachetools import TTLCache
 from google import genai
 from google.genai import types
 from .base import BaseProvider
+from stream_events import StreamEvent
+from call_context import CallContext
 from models import ConversationMessage
-from logging_config import logger
+from prompt_engineering import CONTINUATION_PROMPT
+from provider_stats import CHARS_PER_TOKEN
+from logging_config import logger, debug_with_context
+from configuration import (
+    GEMINI_CONTEXT_CACHE_ENABLED,
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS,
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS,
+    GEMINI_CONTEXT_CACHE_MAX_ENTRIES
+)
 
 class GeminiProvider(BaseProvider):
     """Provider implementation for Google Gemini models."""
@@ -13,32 +25,123 @@ class GeminiProvider(BaseProvider):
                  temperature: float, max_tokens: int, system_prompt: str):
         super().__init__("gemini", default_model, fallback_model, temperature, max_tokens, system_prompt)
         self.client = genai.Client(api_key=api_key)
+        # Context cache names by prefix hash; forgotten before the server-side TTL runs out
+        self._context_caches: TTLCache = TTLCache(
+            maxsize=GEMINI_CONTEXT_CACHE_MAX_ENTRIES, ttl=GEMINI_CONTEXT_CACHE_TTL_SECONDS * 0.9
+        )
     
-    def format_messages(self, messages: List[ConversationMessage]) -> List[str]:
-        """Format messages for Gemini API."""
+    def format_messages(self, messages: List[ConversationMessage], system_prompt: str) -> List[str]:
+        """Format messages for Gemini API; the system prompt is sent as the system instruction."""
         # Gemini uses a different format - just the content strings
         return [msg.content for msg in messages if msg.role != "system"]
     
-    async def stream_response(self, messages: List[str], model: str, message_id: str) -> AsyncGenerator[str, None]:
-        """Stream a response from Gemini."""
+    def format_continuation(self, messages: List[str], partial_text: str) -> List[Any]:
+        """Replay the partial answer as a model turn, then ask Gemini to continue it."""
+        return messages + [
+            types.Content(role="model", parts=[types.Part(text=partial_text)]),
+            CONTINUATION_PROMPT
+        ]
+    
+    def _prefix_keys(self, model: str, system_prompt: str, history: List[str]) -> List[str]:
+        """Hash of the model, system prompt and each leading prefix of the history, shortest first."""
+        digest = hashlib.sha256(f"{model}\x1f{system_prompt}".encode("utf-8"))
+        keys = []
+        for content in history:
+            digest.update(b"\x1e" + content.encode("utf-8"))
+            keys.append(digest.copy().hexdigest())
+        return keys
+    
+    async def _context_cache(self, model: str, system_prompt: str, messages: List[Any],
+                             http_options: Optional[types.HttpOptions]) -> Tuple[Optional[str], List[Any], int]:
+        """
+        Serve the longest possible history prefix from a context cache.
+        
+        A new cache is created once the history not yet covered by one is at
+        least GEMINI_CONTEXT_CACHE_MIN_TOKENS long; otherwise the longest cached
+        prefix, if any, is reused.
+        
+        Returns:
+            (cache name or None, contents still to send, tokens written to a new cache)
+        """
+        # Plain-text history before the newest user message; continuation turns are never cached
+        end = next((i for i, m in enumerate(messages) if not isinstance(m, str)), len(messages))
+        history = messages[:max(0, end - 1)]
+        if not GEMINI_CONTEXT_CACHE_ENABLED or not history:
+            return None, messages, 0
+        
+        keys = self._prefix_keys(model, system_prompt, history)
+        covered = next((i for i in range(len(keys), 0, -1) if keys[i - 1] in self._context_caches), 0)
+        uncached_chars = sum(len(m) for m in history[covered:]) + (0 if covered else len(system_prompt))
+        if uncached_chars / CHARS_PER_TOKEN >= GEMINI_CONTEXT_CACHE_MIN_TOKENS:
+            try:
+                cache = await self.client.aio.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        contents=history,
+                        system_instruction=system_prompt,
+                        ttl=f"{GEMINI_CONTEXT_CACHE_TTL_SECONDS}s",
+                        http_options=http_options
+                    )
+                )
+                self._context_caches[keys[-1]] = cache.name
+                written = cache.usage_metadata.total_token_count if cache.usage_metadata else 0
+                debug_with_context(logger,
+                    "Created Gemini context cache",
+                    model=model,
+                    cache=cache.name,
+                    messages=len(history),
+                    tokens=written
+                )
+                return cache.name, messages[len(history):], written or 0
+            except Exception as e:
+                # Not fatal: send the prefix (or the part not already cached) uncached
+                logger.warning(f"Could not create Gemini context cache: {str(e)}")
+        
+        if not covered:
+            return None, messages, 0
+        return self._context_caches[keys[covered - 1]], messages[covered:], 0
+    
+    async def stream_response(self, messages: List[str], model: str,
+                              context: CallContext) -> AsyncGenerator[StreamEvent, None]:
+        """Stream a response from Gemini, reading long history prefixes from a context cache."""
+        message_id, deadline = context.message_id, context.deadline
+        system_prompt = context.system_prompt_for(self)
         try:
+            # Bound socket waits by the request deadline (milliseconds)
+            http_options = types.HttpOptions(timeout=int(deadline.http_timeout().read * 1000)) if deadline else None
+            cache_name, contents, cache_written = await self._context_cache(model, system_prompt, messages, http_options)
             config = types.GenerateContentConfig(
-                temperature=self.temperature,
-                max_output_tokens=self.max_tokens,
-                system_instruction=self.system_prompt
+                temperature=context.temperature_for(self),
+                max_output_tokens=context.max_tokens_for(self),
+                # A context cache already holds the system instruction
+                system_instruction=None if cache_name else system_prompt,
+                cached_content=cache_name
             )
+            if http_options:
+                config.http_options = http_options
             
             stream = await self.client.aio.models.generate_content_stream(
                 model=model,
-                contents=messages,
+                contents=contents,
                 config=config
             )
             
-            async for chunk in stream:
-                if chunk.text:
-                    yield self.format_stream_chunk(message_id, chunk.text, model)
+            usage = None
+            try:
+                async for chunk in stream:
+                    if chunk.usage_metadata is not None:
+                        usage = chunk.usage_metadata
+                    if chunk.text:
+                        yield self.format_stream_chunk(message_id, chunk.text, model)
+            finally:
+                # Close the HTTP stream promptly, including on cancellation
+                await stream.aclose()
             
-            yield self.format_done_message()
+            if usage is not None:
+                yield self.format_usage(message_id, model, usage.prompt_token_count,
+                                        usage.candidates_token_count, usage.cached_content_token_count,
+                                        cache_written)
+            yield self.format_done_message(message_id, model)
             
         except Exception as e:
             logger.error(f"Error in Gemini stream: {str(e)}", exc_info=True)
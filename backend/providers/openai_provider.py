@@ -1,8 +1,11 @@
 # filepath: providers/openai_provider.py
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Optional
+import httpx
 import json
 from openai import AsyncOpenAI
 from .base import BaseProvider
+from stream_events import StreamEvent
+from call_context import CallContext
 from models import ConversationMessage
 from logging_config import logger, debug_with_context
 import sentry_sdk
@@ -11,14 +14,22 @@ class OpenAIProvider(BaseProvider):
     """Provider implementation for OpenAI (GPT) models."""
     
     def __init__(self, api_key: str, default_model: str, fallback_model: str, 
-                 temperature: float, max_tokens: int, system_prompt: str):
+                 temperature: float, max_tokens: int, system_prompt: str,
+                 http_client: Optional[httpx.AsyncClient] = None):
         super().__init__("gpt", default_model, fallback_model, temperature, max_tokens, system_prompt)
-        self.client = AsyncOpenAI(api_key=api_key)
+        self.client = AsyncOpenAI(api_key=api_key, http_client=http_client)
     
-    def format_messages(self, messages: List[ConversationMessage]) -> List[Dict[str, Any]]:
-        """Format messages for OpenAI API with system prompt."""
+    def format_messages(self, messages: List[ConversationMessage], system_prompt: str) -> List[Dict[str, Any]]:
+        """
+        Format messages for OpenAI API with system prompt.
+        
+        The output must stay byte-stable for an unchanged history (system
+        prompt first, turns in order, nothing per-request) so the provider's
+        automatic prefix caching can reuse it across turns.
+        """
         system_messages = [msg for msg in messages if msg.role == "system"]
-        system_prompt = " ".join([msg.content for msg in system_messages]) if system_messages else self.system_prompt
+        if system_messages:
+            system_prompt = " ".join([msg.content for msg in system_messages])
         
         formatted_messages = [{"role": "system", "content": system_prompt}]
         formatted_messages.extend([
@@ -28,29 +39,51 @@ class OpenAIProvider(BaseProvider):
         
         return formatted_messages
     
-    async def stream_response(self, messages: List[Dict[str, Any]], model: str, message_id: str) -> AsyncGenerator[str, None]:
+    async def stream_response(self, messages: List[Dict[str, Any]], model: str,
+                              context: CallContext) -> AsyncGenerator[StreamEvent, None]:
         """Stream a response from OpenAI."""
+        message_id, deadline = context.message_id, context.deadline
+        temperature, max_tokens = context.temperature_for(self), context.max_tokens_for(self)
         debug_with_context(logger,
             "Creating OpenAI stream",
             model=model,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens
+            temperature=temperature,
+            max_tokens=max_tokens
         )
         
         try:
-            stream = await self.client.chat.completions.create(
+            # Bound connect and read waits by the request deadline
+            timeout_kwargs = {'timeout': deadline.http_timeout()} if deadline else {}
+            # The raw response carries the rate-limit headers for the upstream limiter
+            response = await self.client.chat.completions.with_raw_response.create(
                 model=model,
                 messages=messages,
                 stream=True,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream_options={"include_usage": True},
+                **timeout_kwargs
             )
+            self.observe_rate_limits(model, response.headers)
+            stream = response.parse()
             
-            async for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    yield self.format_stream_chunk(message_id, chunk.choices[0].delta.content, model)
+            usage = None
+            try:
+                async for chunk in stream:
+                    # The usage chunk comes last and has no choices
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        yield self.format_stream_chunk(message_id, chunk.choices[0].delta.content, model)
+            finally:
+                # Close the HTTP stream promptly, including on cancellation
+                await stream.close()
             
-            yield self.format_done_message()
+            if usage is not None:
+                details = usage.prompt_tokens_details
+                yield self.format_usage(message_id, model, usage.prompt_tokens, usage.completion_tokens,
+                                        cache_read_tokens=details.cached_tokens if details else 0)
+            yield self.format_done_message(message_id, model)
             
         except Exception as e:
             logger.error(f"Error in GPT stream: {str(e)}", exc_info=True)
@@ -58,8 +91,8 @@ class OpenAIProvider(BaseProvider):
                 sentry_sdk.set_context("provider_details", {
                     "provider": "gpt",
                     "model": model,
-                    "temperature": self.temperature,
-                    "max_tokens": self.max_tokens
+                    "temperature": temperature,
+                    "max_tokens": max_tokens
                 })
                 sentry_sdk.capture_exception(e)
             raise
@@ -0,0 +1,412 @@
+"""
+Inbound per-client rate limiting for the chat endpoints.
+
+Each client gets a token bucket of RATE_LIMIT_MAX_REQUESTS requests that
+refills evenly over RATE_LIMIT_WINDOW_SECONDS, and optionally a second bucket
+of RATE_LIMIT_MAX_TOKENS estimated prompt tokens over the same window. A
+request is admitted only if both buckets can pay for it; checking and charging
+is O(1) per request. Buckets live in a bounded in-process table, or in Redis
+when RATE_LIMIT_REDIS_URL is set, so several workers share one quota (a Redis
+error falls back to the local table for that request).
+
+Clients are identified by their IP address, or by the first configured header
+present (hashed) when RATE_LIMIT_CLIENT_HEADERS lists headers that a trusted
+gateway sets or validates; none are trusted by default. Responses carry the IETF
+draft `RateLimit-Limit`, `RateLimit-Remaining`, `RateLimit-Reset` and
+`RateLimit-Policy` headers; rejected requests get a 429 with `Retry-After`.
+"""
+import hashlib
+import json
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from cachetools import TTLCache
+import redis.asyncio as redis
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from context_window import estimate_tokens
+from logging_config import logger, debug_with_context, get_request_id
+from configuration import (
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_MAX_REQUESTS,
+    RATE_LIMIT_MAX_TOKENS,
+    RATE_LIMIT_WINDOW_SECONDS,
+    RATE_LIMIT_MAX_CLIENTS,
+    RATE_LIMIT_REDIS_URL,
+    RATE_LIMIT_REDIS_TIMEOUT_SECONDS,
+    REQUEST_MAX_DECOMPRESSED_BYTES
+)
+
+REDIS_KEY_PREFIX = "rate-limit:"
+
+# Checks and charges both buckets atomically: KEYS = request and token bucket,
+# ARGV = capacity and refill rate per second for each, then the two costs.
+# Returns [allowed, requests left, tokens left, seconds until the cost fits].
+REDIS_TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local levels = {}
+local wait = 0
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+    local cost = tonumber(ARGV[4 + i])
+    local level = capacity
+    if capacity > 0 then
+        local state = redis.call('HMGET', KEYS[i], 'level', 'at')
+        if state[1] then
+            level = math.min(capacity, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * rate)
+        end
+        if level < cost then
+            wait = math.max(wait, (cost - level) / rate)
+        end
+    end
+    levels[i] = level
+end
+local allowed = 0
+if wait == 0 then
+    allowed = 1
+    for i = 1, 2 do
+        local capacity = tonumber(ARGV[i * 2 - 1])
+        local rate = tonumber(ARGV[i * 2])
+        if capacity > 0 then
+            levels[i] = levels[i] - tonumber(ARGV[4 + i])
+            redis.call('HSET', KEYS[i], 'level', levels[i], 'at', now)
+            redis.call('PEXPIRE', KEYS[i], math.ceil((capacity - levels[i]) / rate * 1000) + 1000)
+        end
+    end
+end
+return {allowed, tostring(levels[1]), tostring(levels[2]), tostring(wait)}
+"""
+
+class Bucket:
+    """A token bucket's capacity and refill rate."""
+    __slots__ = ("capacity", "rate")
+
+    def __init__(self, capacity: int, window_seconds: float):
+        self.capacity = max(0, capacity)
+        self.rate = self.capacity / max(window_seconds, 1e-9)
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def refill(self, level: float, elapsed: float) -> float:
+        return min(self.capacity, level + max(0.0, elapsed) * self.rate)
+
+    def wait(self, level: float, cost: float) -> float:
+        """Seconds until the bucket holds cost, from the given level."""
+        return 0.0 if level >= cost else (cost - level) / self.rate
+
+    def reset(self, level: float) -> int:
+        """Whole seconds until the bucket is full again."""
+        return math.ceil((self.capacity - level) / self.rate) if self.enabled else 0
+
+class RateLimitDecision:
+    """Outcome of a rate limit check, with the values for the RateLimit-* headers."""
+    __slots__ = ("allowed", "limit", "remaining", "reset", "retry_after", "policy")
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset: int, retry_after: int, policy: str):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+        self.policy = policy
+
+    def headers(self) -> List[Tuple[bytes, bytes]]:
+        headers = [
+            (b"ratelimit-limit", str(self.limit).encode("latin-1")),
+            (b"ratelimit-remaining", str(self.remaining).encode("latin-1")),
+            (b"ratelimit-reset", str(self.reset).encode("latin-1")),
+            (b"ratelimit-policy", self.policy.encode("latin-1")),
+        ]
+        if not self.allowed:
+            headers.append((b"retry-after", str(self.retry_after).encode("latin-1")))
+        return headers
+
+def client_identity(scope: Scope, client_headers: List[str], trust_forwarded_for: bool,
+                    trusted_proxies: int = 1) -> str:
+    """
+    Identify the client of a request.
+
+    The first configured header that is present wins; its value is hashed so API
+    keys are never kept in memory or Redis. Otherwise the client IP is used,
+    taken from X-Forwarded-For only when the proxies in front are trusted. Each
+    proxy appends the address it received the request from, so the client is
+    the entry added by the outermost trusted proxy, `trusted_proxies` from the
+    right; entries to its left were sent by the client and are ignored.
+    """
+    headers = dict(scope["headers"])
+    for name in client_headers:
+        value = headers.get(name.encode("latin-1"))
+        if value:
+            digest = hashlib.sha256(value).hexdigest()[:32]
+            return f"{name}:{digest}"
+    if trust_forwarded_for:
+        # Repeated headers are one list, in the order they were sent
+        forwarded = [
+            address.strip()
+            for name, value in scope["headers"] if name == b"x-forwarded-for"
+            for address in value.decode("latin-1").split(",")
+        ]
+        if len(forwarded) >= trusted_proxies and forwarded[-trusted_proxies]:
+            return f"ip:{forwarded[-trusted_proxies]}"
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+def estimate_request_tokens(body: bytes) -> int:
+    """
+    Estimated prompt tokens of a chat, batch or compare request body; 0 if it is not valid JSON.
+
+    A comparison sends its prompt to every source, so it counts once per source.
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return 0
+    if not isinstance(payload, dict):
+        return 0
+    requests = payload.get("requests")
+    if not isinstance(requests, list):
+        requests = [payload]
+    tokens = 0
+    for request in requests:
+        messages = request.get("messages") if isinstance(request, dict) else None
+        if not isinstance(messages, list):
+            continue
+        for message in messages:
+            if isinstance(message, dict) and isinstance(message.get("content"), str):
+                tokens += estimate_tokens(message["content"])
+    sources = payload.get("sources")
+    return tokens * len(sources) if isinstance(sources, list) and sources else tokens
+
+class RateLimiter:
+    """Per-client request and prompt-token buckets, in process or shared through Redis."""
+
+    def __init__(self, max_requests: int, max_tokens: int, window_seconds: float,
+                 max_clients: int, redis_url: str = "", redis_timeout: float = 0.1):
+        self.window_seconds = window_seconds
+        self.requests = Bucket(max_requests, window_seconds)
+        self.tokens = Bucket(max_tokens, window_seconds)
+        # An idle bucket is full again after one window, so it can be forgotten then
+        self._buckets: Dict[str, List[float]] = TTLCache(maxsize=max_clients, ttl=window_seconds)
+        self._redis = redis.from_url(
+            redis_url,
+            socket_timeout=redis_timeout,
+            socket_connect_timeout=redis_timeout,
+            decode_responses=True
+        ) if redis_url else None
+        self._script = self._redis.register_script(REDIS_TOKEN_BUCKET_SCRIPT) if self._redis is not None else None
+        self.allowed = 0
+        self.rejected = 0
+        self.rejected_by_tokens = 0
+        self.redis_errors = 0
+
+    @property
+    def tracks_tokens(self) -> bool:
+        return self.tokens.enabled
+
+    def policy(self) -> str:
+        window = int(self.window_seconds)
+        policy = f"{self.requests.capacity};w={window}"
+        if self.tokens.enabled:
+            policy += f", {self.tokens.capacity};w={window};comment=\"prompt tokens\""
+        return policy
+
+    async def check(self, client: str, tokens: int = 0) -> RateLimitDecision:
+        """
+        Charge one request and its estimated prompt tokens to a client, if both fit.
+
+        A request larger than the whole token bucket is charged the full bucket, so
+        it can still run once the bucket is full.
+        """
+        token_cost = min(tokens, self.tokens.capacity) if self.tokens.enabled else 0
+        result = None
+        if self._script is not None:
+            try:
+                result = await self._check_redis(client, token_cost)
+            except (redis.RedisError, OSError) as e:
+                self.redis_errors += 1
+                logger.warning(f"Rate limit Redis check failed, using the local limiter: {str(e)}")
+        if result is None:
+            result = self._check_local(client, token_cost, time.monotonic())
+        allowed, request_level, token_level, wait = result
+
+        if allowed:
+            self.allowed += 1
+        else:
+            self.rejected += 1
+            if request_level >= 1:
+                self.rejected_by_tokens += 1
+
+        # Report whichever quota is closer to running out
+        bucket, level = self.requests, request_level
+        if self.tokens.enabled and token_level / self.tokens.capacity < request_level / self.requests.capacity:
+            bucket, level = self.tokens, token_level
+        return RateLimitDecision(
+            allowed=allowed,
+            limit=bucket.capacity,
+            remaining=max(0, int(level)),
+            reset=bucket.reset(level),
+            retry_after=max(1, math.ceil(wait)),
+            policy=self.policy()
+        )
+
+    def _check_local(self, client: str, token_cost: int, now: float) -> Tuple[bool, float, float, float]:
+        state = self._buckets.get(client)
+        if state is None:
+            request_level, token_level = float(self.requests.capacity), float(self.tokens.capacity)
+        else:
+            elapsed = now - state[2]
+            request_level = self.requests.refill(state[0], elapsed)
+            token_level = self.tokens.refill(state[1], elapsed)
+
+        wait = self.requests.wait(request_level, 1)
+        if self.tokens.enabled:
+            wait = max(wait, self.tokens.wait(token_level, token_cost))
+        if wait == 0:
+            request_level -= 1
+            token_level -= token_cost
+        # Re-assigning renews the entry's TTL
+        self._buckets[client] = [request_level, token_level, now]
+        return wait == 0, request_level, token_level, wait
+
+    async def _check_redis(self, client: str, token_cost: int) -> Tuple[bool, float, float, float]:
+        keys = [f"{REDIS_KEY_PREFIX}{client}:requests", f"{REDIS_KEY_PREFIX}{client}:tokens"]
+        allowed, request_level, token_level, wait = await self._script(keys=keys, args=[
+            self.requests.capacity, self.requests.rate,
+            self.tokens.capacity, self.tokens.rate,
+            1, token_cost
+        ])
+        return bool(allowed), float(request_level), float(token_level), float(wait)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "redis": self._redis is not None,
+            "policy": self.policy(),
+            "tracked_clients": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "rejected_by_tokens": self.rejected_by_tokens,
+            "redis_errors": self.redis_errors,
+        }
+
+def is_new_chat_request(method: str, path: str) -> bool:
+    """New chat generations are limited; resuming or cancelling a stream and reading results are not."""
+    return method == "POST" and path.startswith("/chat/") and not path.startswith("/chat/streams/")
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware that enforces the per-client rate limit on new chat requests
+    and adds the RateLimit-* headers to their responses.
+    """
+
+    def __init__(self, app: ASGIApp, limiter: "RateLimiter", client_headers: List[str],
+                 trust_forwarded_for: bool = False, trusted_proxies: int = 1,
+                 max_body_size: int = REQUEST_MAX_DECOMPRESSED_BYTES):
+        self.app = app
+        self.limiter = limiter
+        self.client_headers = client_headers
+        self.trust_forwarded_for = trust_forwarded_for
+        self.trusted_proxies = trusted_proxies
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED or not is_new_chat_request(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        client = client_identity(scope, self.client_headers, self.trust_forwarded_for, self.trusted_proxies)
+        tokens = 0
+        if self.limiter.tracks_tokens:
+            # The token quota needs the prompt, so read the body and replay it downstream
+            body = await self._read_body(receive)
+            if body is None:
+                return
+            if len(body) > self.max_body_size:
+                await self._error(scope, receive, send, 413, f"Request body exceeds {self.max_body_size} bytes")
+                return
+            tokens = estimate_request_tokens(body)
+            receive = self._replay(body, receive)
+
+        decision = await self.limiter.check(client, tokens)
+        if not decision.allowed:
+            debug_with_context(logger,
+                "Request rate limited",
+                client=client,
+                path=scope["path"],
+                estimated_tokens=tokens,
+                retry_after=decision.retry_after
+            )
+            await self._error(scope, receive, send, 429,
+                              f"Rate limit exceeded, retry in {decision.retry_after} seconds",
+                              decision.headers())
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + decision.headers())
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    async def _read_body(self, receive: Receive) -> Optional[bytes]:
+        """The request body, cut off just past max_body_size; None if the client went away."""
+        chunks = []
+        received = 0
+        more_body = True
+        while more_body and received <= self.max_body_size:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunk = message.get("body", b"")
+            received += len(chunk)
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+        return b"".join(chunks)
+
+    async def _error(self, scope: Scope, receive: Receive, send: Send, status_code: int, message: str,
+                     headers: Optional[List[Tuple[bytes, bytes]]] = None) -> None:
+        response = JSONResponse(
+            status_code=status_code,
+            content={
+                "status": "error",
+                "code": status_code,
+                "message": message,
+                "request_id": get_request_id(),
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
+        if headers:
+            response.raw_headers.extend(headers)
+        await response(scope, receive, send)
+
+    @staticmethod
+    def _replay(body: bytes, receive: Receive) -> Receive:
+        body_sent = False
+
+        async def receive_body() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return receive_body
+
+# Process-wide inbound rate limiter
+rate_limiter = RateLimiter(
+    RATE_LIMIT_MAX_REQUESTS,
+    RATE_LIMIT_MAX_TOKENS,
+    RATE_LIMIT_WINDOW_SECONDS,
+    RATE_LIMIT_MAX_CLIENTS,
+    RATE_LIMIT_REDIS_URL,
+    RATE_LIMIT_REDIS_TIMEOUT_SECONDS
+)
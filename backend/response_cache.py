@@ -0,0 +1,226 @@
+"""
+Exact-match response cache for deterministic chat requests.
+
+Completed answers are stored under the same canonical request fingerprint as
+singleflight (provider, model, system prompt, temperature, max tokens and
+messages). The first tier is a bounded in-process LRU with a TTL; with
+RESPONSE_CACHE_REDIS_URL set, answers are also shared through Redis and
+promoted into the local tier on a Redis hit.
+
+A hit is replayed as the original sequence of deltas through the normal chat
+stream, so clients see the same chunking and framing as a live answer. Only
+answers that completed on the requested model are stored: partial, failed or
+failed-over generations are not.
+"""
+import json
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from cachetools import TTLCache
+import redis.asyncio as redis
+from models import ChatRequest
+from prompt_engineering import get_system_prompt
+from singleflight import request_fingerprint
+from stream_events import StreamEvent
+from logging_config import logger, debug_with_context
+from configuration import (
+    PROVIDER_SETTINGS,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_TEMPERATURE,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_MAX_ENTRY_CHARS,
+    RESPONSE_CACHE_REDIS_URL,
+    RESPONSE_CACHE_REDIS_TIMEOUT_SECONDS
+)
+
+REDIS_KEY_PREFIX = "chat-response:"
+
+class CachedResponse:
+    """A completed answer as the deltas it was streamed in."""
+    __slots__ = ("model", "chunks", "created_at")
+
+    def __init__(self, model: str, chunks: List[str], created_at: Optional[float] = None):
+        self.model = model
+        self.chunks = chunks
+        self.created_at = created_at if created_at is not None else time.time()
+
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def to_json(self) -> str:
+        return json.dumps({"model": self.model, "chunks": self.chunks, "created_at": self.created_at})
+
+    @classmethod
+    def from_json(cls, raw: str) -> "CachedResponse":
+        data = json.loads(raw)
+        return cls(data["model"], data["chunks"], data["created_at"])
+
+class _LRUCache(TTLCache):
+    """TTLCache that counts least-recently-used evictions."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.evictions = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+def cached_response_from_events(events: List[StreamEvent], model: str) -> Optional[CachedResponse]:
+    """
+    Build a cache entry from a finished stream's events.
+
+    Returns:
+        None unless every delta came from `model` and the stream carried no
+        other events than usage and done (no model change, error or cancellation)
+    """
+    chunks = []
+    for event in events:
+        if event.kind == StreamEvent.DELTA:
+            if event.model != model:
+                return None
+            chunks.append(event.text)
+        elif event.kind not in (StreamEvent.DONE, StreamEvent.USAGE):
+            return None
+    return CachedResponse(model, chunks) if chunks else None
+
+def response_cache_key(provider: str, request: ChatRequest) -> Optional[str]:
+    """
+    Return the cache key for a request, or None if it is not eligible.
+
+    Like singleflight, only providers configured at or below
+    RESPONSE_CACHE_MAX_TEMPERATURE (0 by default) are cached.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+
+    settings = PROVIDER_SETTINGS[provider]
+    if settings["temperature"] > RESPONSE_CACHE_MAX_TEMPERATURE:
+        return None
+
+    return request_fingerprint(
+        provider,
+        settings["default_model"],
+        get_system_prompt(request.messages, provider),
+        settings["temperature"],
+        settings["max_tokens"],
+        request,
+    )
+
+class ResponseCache:
+    """In-process LRU/TTL tier in front of an optional shared Redis tier."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, max_entry_chars: int,
+                 redis_url: str = "", redis_timeout: float = 0.1):
+        self.ttl_seconds = ttl_seconds
+        self.max_entry_chars = max_entry_chars
+        self._memory = _LRUCache(maxsize=max_entries, ttl=ttl_seconds)
+        self._redis = redis.from_url(
+            redis_url,
+            socket_timeout=redis_timeout,
+            socket_connect_timeout=redis_timeout,
+            decode_responses=True
+        ) if redis_url else None
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.skipped = 0
+        self.expirations = 0
+        self.redis_errors = 0
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        """Look a response up locally, then in Redis; Redis errors count as a miss."""
+        self.expirations += len(self._memory.expire())
+        cached = self._memory.get(key)
+        if cached is not None:
+            self.memory_hits += 1
+            return cached
+
+        if self._redis is not None:
+            try:
+                raw = await self._redis.get(REDIS_KEY_PREFIX + key)
+            except (redis.RedisError, OSError) as e:
+                self.redis_errors += 1
+                logger.warning(f"Response cache Redis lookup failed: {str(e)}")
+                raw = None
+            if raw is not None:
+                cached = CachedResponse.from_json(raw)
+                self._memory[key] = cached
+                self.redis_hits += 1
+                return cached
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, response: CachedResponse) -> None:
+        """Store a response in both tiers; oversized answers are skipped."""
+        if len(response.text()) > self.max_entry_chars:
+            self.skipped += 1
+            return
+        self._memory[key] = response
+        self.stores += 1
+        if self._redis is not None:
+            try:
+                await self._redis.set(REDIS_KEY_PREFIX + key, response.to_json(), ex=max(1, int(self.ttl_seconds)))
+            except (redis.RedisError, OSError) as e:
+                self.redis_errors += 1
+                logger.warning(f"Response cache Redis store failed: {str(e)}")
+
+    async def store_stream(self, key: str, events: List[StreamEvent], model: str) -> None:
+        """
+        Cache a finished generation if it completed on `model` without failing over.
+
+        Args:
+            key: The request's cache key
+            events: The stream's replay buffer
+            model: The model the key was computed for
+        """
+        response = cached_response_from_events(events, model)
+        if response is None:
+            self.skipped += 1
+            return
+        await self.put(key, response)
+        debug_with_context(logger, "Stored chat response in cache", model=model, chunks=len(response.chunks))
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        self.expirations += len(self._memory.expire())
+        hits = self.memory_hits + self.redis_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "redis": self._redis is not None,
+            "entries": len(self._memory),
+            "max_entries": int(self._memory.maxsize),
+            "ttl_seconds": self.ttl_seconds,
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "skipped": self.skipped,
+            "evictions": self._memory.evictions,
+            "expirations": self.expirations,
+            "redis_errors": self.redis_errors,
+        }
+
+async def replay_cached_response(cached: CachedResponse, message_id: str) -> AsyncGenerator[StreamEvent, None]:
+    """Stream a cached answer as its original deltas followed by the done event."""
+    for chunk in cached.chunks:
+        yield StreamEvent.delta(message_id, chunk, cached.model)
+    yield StreamEvent.done(message_id, cached.model)
+
+# Process-wide response cache
+response_cache = ResponseCache(
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_MAX_ENTRY_CHARS,
+    RESPONSE_CACHE_REDIS_URL,
+    RESPONSE_CACHE_REDIS_TIMEOUT_SECONDS
+)
@@ -0,0 +1,131 @@
+"""
+Latency-aware routing for the virtual "auto" provider.
+
+`/chat/auto` resolves to a real provider per request, using the live EWMA
+statistics of each provider's default model:
+
+- ttft: lowest time to first token
+- throughput: highest output tokens per second
+- cost: cheapest model whose p90 TTFT meets ROUTER_TTFT_SLO_MS (fastest if none does)
+
+Providers with an open circuit are skipped, and providers above
+ROUTER_MAX_ERROR_RATE are avoided while a healthier one exists. Models with no
+statistics yet are tried first, and ROUTER_EXPLORATION_RATE of requests go to a
+random healthy provider so the statistics of the others stay fresh.
+"""
+import random
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from providers import ProviderFactory
+from provider_stats import model_stats, ttft_tracker
+from circuit_breaker import circuit_breakers
+from logging_config import logger, debug_with_context
+from configuration import (
+    PROVIDER_SETTINGS,
+    SUPPORTED_PROVIDERS,
+    ROUTER_POLICY,
+    ROUTER_EXPLORATION_RATE,
+    ROUTER_MAX_ERROR_RATE,
+    ROUTER_TTFT_SLO_MS,
+    ROUTER_MODEL_COSTS
+)
+
+AUTO_PROVIDER = "auto"
+ROUTE_POLICIES = ("ttft", "throughput", "cost")
+
+class Router:
+    """Chooses a provider for each auto-routed request and counts its decisions."""
+
+    def __init__(self, policy: str = ROUTER_POLICY, exploration_rate: float = ROUTER_EXPLORATION_RATE):
+        self.policy = policy
+        self.exploration_rate = exploration_rate
+        self.decisions: Counter = Counter()
+        self.reasons: Counter = Counter()
+
+    def candidates(self) -> List[Tuple[str, str]]:
+        """(provider, default model) of every initialized, supported provider."""
+        instances = ProviderFactory.get_all_providers()
+        return [
+            (provider, PROVIDER_SETTINGS[provider]["default_model"])
+            for provider in SUPPORTED_PROVIDERS if provider in instances
+        ]
+
+    def choose(self, policy: Optional[str] = None) -> str:
+        """
+        Pick a provider for one request.
+
+        Raises:
+            HTTPException: 400 for an unknown policy, 503 if no provider is initialized
+        """
+        policy = policy or self.policy
+        if policy not in ROUTE_POLICIES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid routing policy. Supported policies are: {', '.join(ROUTE_POLICIES)}"
+            )
+
+        candidates = self.candidates()
+        if not candidates:
+            raise HTTPException(status_code=503, detail="No providers available for auto routing")
+        # With every circuit open, let the failover chain report it
+        available = [c for c in candidates if not circuit_breakers.get(*c).is_open] or candidates
+
+        unexplored = [c for c in available if model_stats.get(*c) is None]
+        if unexplored:
+            choice, reason = random.choice(unexplored), "unexplored"
+        elif random.random() < self.exploration_rate:
+            choice, reason = random.choice(available), "explore"
+        else:
+            choice, reason = self._best(available, policy), policy
+
+        self.decisions[choice[0]] += 1
+        self.reasons[reason] += 1
+        debug_with_context(logger,
+            "Auto-routed chat request",
+            provider=choice[0],
+            model=choice[1],
+            policy=policy,
+            reason=reason
+        )
+        return choice[0]
+
+    def _best(self, candidates: List[Tuple[str, str]], policy: str) -> Tuple[str, str]:
+        healthy = [
+            c for c in candidates
+            if (model_stats.get(*c).error_rate.value or 0.0) <= ROUTER_MAX_ERROR_RATE
+        ] or candidates
+
+        def ttft(candidate: Tuple[str, str]) -> float:
+            value = model_stats.get(*candidate).ttft.value
+            return value if value is not None else float("inf")
+
+        if policy == "throughput":
+            return max(healthy, key=lambda c: model_stats.get(*c).throughput.value or 0.0)
+        if policy == "cost":
+            within_slo = [
+                c for c in healthy
+                if (ttft_tracker.percentile(*c, 90) or ttft(c)) * 1000 <= ROUTER_TTFT_SLO_MS
+            ]
+            if within_slo:
+                return min(within_slo, key=lambda c: (ROUTER_MODEL_COSTS.get(c[1], float("inf")), ttft(c)))
+        return min(healthy, key=ttft)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "exploration_rate": self.exploration_rate,
+            "decisions": dict(self.decisions),
+            "reasons": dict(self.reasons),
+            "candidates": {
+                f"{provider}:{model}": {
+                    **(model_stats.get(provider, model).snapshot() if model_stats.get(provider, model) else {"samples": 0}),
+                    "circuit_open": circuit_breakers.get(provider, model).is_open,
+                    "cost_per_million_tokens": ROUTER_MODEL_COSTS.get(model),
+                }
+                for provider, model in self.candidates()
+            },
+        }
+
+# Process-wide router
+router = Router()
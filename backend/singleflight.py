@@ -0,0 +1,66 @@
+"""
+Singleflight keys for coalescing identical in-flight chat requests.
+
+Concurrent requests that produce the same key share one upstream generation:
+the first request starts a ChatStream, later ones attach to it as additional
+readers. Each reader consumes the shared replay buffer at its own pace, so a
+slow subscriber never holds back the others.
+"""
+import hashlib
+import json
+from typing import Optional
+from models import ChatRequest
+from prompt_engineering import get_system_prompt
+from configuration import PROVIDER_SETTINGS, SINGLEFLIGHT_ENABLED, SINGLEFLIGHT_MAX_TEMPERATURE
+
+def request_fingerprint(provider: str, model: str, system_prompt: str, temperature: float,
+                        max_tokens: int, request: ChatRequest) -> str:
+    """Canonical SHA-256 over everything that determines a generation."""
+    canonical = json.dumps(
+        {
+            "provider": provider,
+            "model": model,
+            "system": system_prompt,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "messages": [[m.role.value, m.content] for m in request.messages],
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+        sort_keys=True,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def idempotency_fingerprint(provider: str, request: ChatRequest) -> str:
+    """SHA-256 over the provider a client asked for and its messages, to tell a retry from a reused key."""
+    canonical = json.dumps(
+        {"provider": provider, "messages": [[m.role.value, m.content] for m in request.messages]},
+        ensure_ascii=False,
+        separators=(",", ":"),
+        sort_keys=True,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def singleflight_key(provider: str, request: ChatRequest) -> Optional[str]:
+    """
+    Return the singleflight key for a request, or None if it is not eligible.
+
+    Only deterministic settings (temperature at or below
+    SINGLEFLIGHT_MAX_TEMPERATURE, 0 by default) are shared, since sampling at
+    higher temperatures is expected to give each caller a different answer.
+    """
+    if not SINGLEFLIGHT_ENABLED:
+        return None
+
+    settings = PROVIDER_SETTINGS[provider]
+    if settings["temperature"] > SINGLEFLIGHT_MAX_TEMPERATURE:
+        return None
+
+    return request_fingerprint(
+        provider,
+        settings["default_model"],
+        get_system_prompt(request.messages, provider),
+        settings["temperature"],
+        settings["max_tokens"],
+        request,
+    )
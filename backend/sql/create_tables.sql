@@ -18,18 +18,38 @@ CREATE TABLE IF NOT EXISTS messages (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     model TEXT,
     tokens INTEGER,
+    usage JSONB,
     CONSTRAINT valid_role CHECK (role IN ('user', 'assistant', 'system'))
 );
 
+-- Token usage reported by the provider (added after the initial schema)
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS usage JSONB;
+
+-- Create batch jobs table (/chat/batch)
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    requests JSONB NOT NULL,
+    results JSONB,
+    native_batches JSONB,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE,
+    completed_at TIMESTAMP WITH TIME ZONE,
+    CONSTRAINT valid_batch_status CHECK (status IN ('queued', 'running', 'completed', 'cancelled'))
+);
+
 -- Create indexes for better query performance
 CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);
 CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at);
 CREATE INDEX IF NOT EXISTS idx_conversations_created_at ON conversations(created_at);
 CREATE INDEX IF NOT EXISTS idx_conversations_provider ON conversations(provider);
+CREATE INDEX IF NOT EXISTS idx_batch_jobs_status ON batch_jobs(status);
 
 -- Enable Row Level Security (RLS)
 ALTER TABLE conversations ENABLE ROW LEVEL SECURITY;
 ALTER TABLE messages ENABLE ROW LEVEL SECURITY;
+ALTER TABLE batch_jobs ENABLE ROW LEVEL SECURITY;
 
 -- Create policies for authenticated users
 CREATE POLICY "Allow full access to authenticated users" 
@@ -40,6 +60,10 @@ CREATE POLICY "Allow full access to authenticated users"
 ON messages FOR ALL TO authenticated 
 USING (true);
 
+CREATE POLICY "Allow full access to authenticated users" 
+ON batch_jobs FOR ALL TO authenticated 
+USING (true);
+
 -- Create policies for anonymous users (if needed)
 -- Allow anonymous users to read, insert, and update conversations
 CREATE POLICY "Allow read access to anonymous users" 
@@ -63,6 +87,19 @@ CREATE POLICY "Allow insert access to anonymous users"
 ON messages FOR INSERT TO anon 
 WITH CHECK (true);
 
+-- Allow anonymous users to read, insert, and update batch jobs (upserts need both)
+CREATE POLICY "Allow read access to anonymous users" 
+ON batch_jobs FOR SELECT TO anon 
+USING (true);
+
+CREATE POLICY "Allow insert access to anonymous users" 
+ON batch_jobs FOR INSERT TO anon 
+WITH CHECK (true);
+
+CREATE POLICY "Allow update access to anonymous users" 
+ON batch_jobs FOR UPDATE TO anon 
+USING (true);
+
 -- Create a function to search conversations by content
 CREATE OR REPLACE FUNCTION search_conversations(search_query TEXT)
 RETURNS TABLE (conversation_id UUID) AS $$
@@ -0,0 +1,121 @@
+"""
+Adaptive coalescing of stream delta events into fewer wire frames.
+"""
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, List, Optional
+from stream_events import StreamEvent
+
+# Marks the end of the upstream iterator in the hand-off queue
+_END = object()
+
+class _UpstreamError:
+    """Carries an upstream exception across the hand-off queue."""
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+async def _pump(events: AsyncIterator[StreamEvent], queue: asyncio.Queue) -> None:
+    """Move upstream events into the queue so they are never blocked by a slow client."""
+    try:
+        async for event in events:
+            queue.put_nowait(event)
+    except Exception as e:
+        queue.put_nowait(_UpstreamError(e))
+    else:
+        queue.put_nowait(_END)
+
+def _merge(pending: List[StreamEvent]) -> StreamEvent:
+    """Merge consecutive delta events into a single delta."""
+    if len(pending) == 1:
+        return pending[0]
+    head, tail = pending[0], pending[-1]
+    merged = StreamEvent.delta(head.message_id, "".join(e.text for e in pending), tail.model)
+    merged.seq = tail.seq
+    merged.source = head.source
+    return merged
+
+async def coalesce_events(
+    events: AsyncIterator[StreamEvent],
+    window: float = 0.016,
+    max_bytes: int = 512,
+    max_window: float = 0.128
+) -> AsyncGenerator[StreamEvent, None]:
+    """
+    Merge delta events until a size or time threshold is hit.
+
+    The first delta (of each source, in a multi-source stream) is always
+    forwarded immediately so time to first token is unaffected. After that,
+    deltas for the same model and source are merged for up to
+    `window` seconds or `max_bytes` characters. When sending a frame takes
+    longer than the current window (the client socket is applying
+    backpressure), the window doubles up to `max_window`; it shrinks back to
+    `window` once the client keeps up again. Non-delta events flush any
+    pending text and are forwarded unchanged.
+
+    Args:
+        events: Upstream event iterator
+        window: Base flush window in seconds
+        max_bytes: Flush once this many characters are pending
+        max_window: Upper bound for the adaptive window in seconds
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    pump = asyncio.create_task(_pump(events, queue))
+    current_window = window
+    # Sources whose first delta has been forwarded
+    first_sent = set()
+    carry: Optional[object] = None
+
+    try:
+        while True:
+            item = carry if carry is not None else await queue.get()
+            carry = None
+
+            if item is _END:
+                return
+            if isinstance(item, _UpstreamError):
+                raise item.error
+            if item.kind != StreamEvent.DELTA or item.source not in first_sent:
+                if item.kind == StreamEvent.DELTA:
+                    first_sent.add(item.source)
+                yield item
+                continue
+
+            pending = [item]
+            size = len(item.text)
+            deadline = loop.time() + current_window
+            while size < max_bytes:
+                if queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        nxt = await asyncio.wait_for(queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    nxt = queue.get_nowait()
+                if (not isinstance(nxt, StreamEvent) or nxt.kind != StreamEvent.DELTA
+                        or nxt.model != item.model or nxt.source != item.source):
+                    carry = nxt
+                    break
+                pending.append(nxt)
+                size += len(nxt.text)
+
+            send_start = loop.time()
+            yield _merge(pending)
+            send_duration = loop.time() - send_start
+
+            # Adapt the window to how fast the client drains frames
+            if send_duration > current_window:
+                current_window = min(current_window * 2, max_window)
+            elif current_window > window:
+                current_window = max(current_window / 2, window)
+    finally:
+        if not pump.done():
+            pump.cancel()
+            try:
+                await pump
+            except asyncio.CancelledError:
+                pass
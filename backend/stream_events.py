@@ -0,0 +1,113 @@
+"""
+Internal stream event types shared by providers, the chat pipeline and the wire encoders.
+"""
+import json
+from typing import Any, Dict, List, Optional
+from constants import SSEFormat
+
+class StreamEvent:
+    """A single event produced by a provider stream.
+
+    Providers yield these instead of pre-serialized SSE frames so the text is
+    accumulated once and the wire frame is built once at the HTTP edge.
+    """
+    __slots__ = ("kind", "message_id", "model", "text", "data", "seq", "source")
+
+    DELTA = "delta"
+    DONE = "done"
+    CANCELLED = "cancelled"
+    # The stream switched models mid-answer (failover)
+    MODEL_CHANGE = "model_change"
+    # The generation failed; ends the stream in place of the done event
+    ERROR = "error"
+    # Token counts reported by the provider; the client gets one total just before the done event
+    USAGE = "usage"
+    # One source of a comparison stream finished (completed, failed or cancelled)
+    SOURCE_DONE = "source_done"
+    # Per-source timings of a comparison stream, just before the done event
+    SUMMARY = "summary"
+
+    def __init__(self, kind: str, message_id: str, model: Optional[str] = None, text: str = "",
+                 data: Optional[Dict[str, Any]] = None):
+        self.kind = kind
+        self.message_id = message_id
+        self.model = model
+        self.text = text
+        # Payload of metadata events (anything other than delta/done)
+        self.data = data
+        # Position in the stream's replay buffer (0 when not buffered)
+        self.seq = 0
+        # "provider:model" that produced the event in a multi-source stream (None otherwise)
+        self.source: Optional[str] = None
+
+    @classmethod
+    def delta(cls, message_id: str, text: str, model: str) -> "StreamEvent":
+        """Create a content delta event."""
+        return cls(cls.DELTA, message_id, model, text)
+
+    @classmethod
+    def done(cls, message_id: str, model: Optional[str] = None) -> "StreamEvent":
+        """Create the end-of-stream event."""
+        return cls(cls.DONE, message_id, model)
+
+    @classmethod
+    def meta(cls, kind: str, message_id: str, data: Dict[str, Any], model: Optional[str] = None) -> "StreamEvent":
+        """Create a metadata event (sent as a named SSE event)."""
+        return cls(kind, message_id, model, data=data)
+
+    @property
+    def is_done(self) -> bool:
+        return self.kind == self.DONE
+
+    def __repr__(self) -> str:
+        return f"StreamEvent(kind={self.kind!r}, message_id={self.message_id!r}, model={self.model!r}, text={self.text!r})"
+
+class StreamAccumulator:
+    """List-backed buffer collecting the assistant text and token usage of one stream."""
+    __slots__ = ("_parts", "model", "chunks", "usage")
+
+    def __init__(self):
+        self._parts: List[str] = []
+        # Model that streamed the latest delta, i.e. the one that served the answer
+        self.model: Optional[str] = None
+        self.chunks = 0
+        # Token counts summed over the usage events of every attempt (None if none reported)
+        self.usage: Optional[Dict[str, int]] = None
+
+    def add(self, event: StreamEvent) -> None:
+        """Record a delta or usage event; other event kinds are ignored."""
+        if event.kind == StreamEvent.DELTA:
+            self._parts.append(event.text)
+            self.model = event.model
+            self.chunks += 1
+        elif event.kind == StreamEvent.USAGE:
+            if self.usage is None:
+                self.usage = {}
+            for key, value in event.data.items():
+                self.usage[key] = self.usage.get(key, 0) + value
+
+    def text(self) -> str:
+        """Return the accumulated text."""
+        return "".join(self._parts)
+
+def encode_sse(event: StreamEvent) -> str:
+    """Serialize an event to the SSE wire format clients expect."""
+    prefix = SSEFormat.format_id(event.seq) if event.seq else ""
+    if event.kind == StreamEvent.DONE:
+        return prefix + SSEFormat.DONE_MESSAGE
+    if event.kind != StreamEvent.DELTA:
+        # Named events are ignored by clients that only listen for "message"
+        payload = {"id": event.message_id, **(event.data or {})}
+        if event.source is not None:
+            payload["source"] = event.source
+        return prefix + SSEFormat.format_event(event.kind) + SSEFormat.format_data(json.dumps(payload))
+    data = {
+        "id": event.message_id,
+        "delta": {
+            "content": event.text,
+            "model": event.model
+        }
+    }
+    if event.source is not None:
+        data["source"] = event.source
+    return prefix + SSEFormat.format_data(json.dumps(data))
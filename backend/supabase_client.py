@@ -38,7 +38,7 @@ async def init_db():
         logger.error("""
         Required tables:
         1. conversations: id (uuid), provider (text), created_at (timestamp), ended_at (timestamp), client_info (jsonb), request_id (text), metadata (jsonb)
-        2. messages: id (uuid), conversation_id (uuid), role (text), content (text), created_at (timestamp), model (text), tokens (integer)
+        2. messages: id (uuid), conversation_id (uuid), role (text), content (text), created_at (timestamp), model (text), tokens (integer), usage (jsonb)
         """)
         return False
 
@@ -104,7 +104,8 @@ async def log_message(
     role: str,
     content: str,
     model: Optional[str] = None,
-    tokens: Optional[int] = None
+    tokens: Optional[int] = None,
+    usage: Optional[Dict[str, int]] = None
 ) -> str:
     """
     Log a message in a conversation.
@@ -114,7 +115,8 @@ async def log_message(
         role: Message role ('user', 'assistant', or 'system')
         content: The message content
         model: Optional model name (for assistant messages)
-        tokens: Optional token count
+        tokens: Optional token count (output tokens for assistant messages)
+        usage: Optional provider token usage (input, output and cached tokens)
         
     Returns:
         The message_id
@@ -130,6 +132,9 @@ async def log_message(
             "model": model,
             "tokens": tokens
         }
+        if usage is not None:
+            # Only sent when set, so databases without the usage column keep logging user messages
+            data["usage"] = usage
         
         supabase.table(TABLES["MESSAGES"]).insert(data).execute()
         
@@ -140,6 +145,55 @@ async def log_message(
         # Continue execution even if logging fails
         return str(uuid.uuid4())
 
+async def save_batch_job(job: Dict[str, Any]) -> bool:
+    """
+    Insert or update a batch job.
+    
+    Args:
+        job: The job row (id, status, mode, requests, results, native batches, timestamps)
+        
+    Returns:
+        True if the job was written
+    """
+    try:
+        supabase.table(TABLES["BATCH_JOBS"]).upsert(job).execute()
+        logger.debug(f"Batch job saved: {job['id']} ({job['status']})")
+        return True
+    except Exception as e:
+        logger.error(f"Error saving batch job: {str(e)}")
+        return False
+
+async def get_batch_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Retrieve a batch job.
+    
+    Args:
+        job_id: The job ID to retrieve
+        
+    Returns:
+        The job row, or None if not found
+    """
+    try:
+        response = supabase.table(TABLES["BATCH_JOBS"]).select("*").eq("id", job_id).execute()
+        return response.data[0] if response.data else None
+    except Exception as e:
+        logger.error(f"Error retrieving batch job: {str(e)}")
+        return None
+
+async def get_unfinished_batch_jobs() -> List[Dict[str, Any]]:
+    """
+    Get the batch jobs that were still queued or running, to resume them after a restart.
+    
+    Returns:
+        List of job rows, oldest first
+    """
+    try:
+        response = supabase.table(TABLES["BATCH_JOBS"]).select("*").in_("status", ["queued", "running"]).order("created_at").execute()
+        return response.data
+    except Exception as e:
+        logger.error(f"Error retrieving unfinished batch jobs: {str(e)}")
+        return []
+
 async def get_conversation(conversation_id: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
     """
     Retrieve a complete conversation with all its messages.
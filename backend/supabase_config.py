@@ -19,6 +19,7 @@ CONVERSATION_SETTINGS: Dict[str, Any] = {
 TABLES = {
     "CONVERSATIONS": "conversations",
     "MESSAGES": "messages",
+    "BATCH_JOBS": "batch_jobs",
 }
 
 # Default values
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Test script for batch chat jobs.
+
+Runs BatchJobManager with BATCH_NATIVE_BACKEND=local and scripted providers:
+job completion and summary counts, cancelling in-flight requests, resuming a
+saved job, and native batches whose unanswered requests fall back to the
+local workers. Job rows are kept in memory instead of the batch_jobs table,
+so it runs without provider credentials, Supabase or a network connection.
+"""
+import sys
+import os
+import asyncio
+import json
+
+# Add the current directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Configuration requires API keys for the supported providers; none are called here
+for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GEMINI_API_KEY", "GROQ_API_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ["BATCH_NATIVE_BACKEND"] = "local"
+os.environ["BATCH_NATIVE_POLL_SECONDS"] = "0.01"
+os.environ["BATCH_PERSIST_INTERVAL_SECONDS"] = "3600"
+
+import supabase_client
+from batch_jobs import BatchJob, BatchJobManager, LocalBatchAPI, NativeBatchAPI
+from models import BatchChatRequest
+from providers import BaseProvider, ProviderFactory
+
+# Saved job rows by ID, standing in for the batch_jobs table
+STORE = {}
+
+async def save_batch_job(job):
+    STORE[job["id"]] = json.loads(json.dumps(job))
+    return True
+
+async def get_batch_job(job_id):
+    return STORE.get(job_id)
+
+async def get_unfinished_batch_jobs():
+    return [row for row in STORE.values() if row["status"] in ("queued", "running")]
+
+supabase_client.save_batch_job = save_batch_job
+supabase_client.get_batch_job = get_batch_job
+supabase_client.get_unfinished_batch_jobs = get_unfinished_batch_jobs
+
+class ScriptedProvider(BaseProvider):
+    """Answers "answer: <prompt>"; prompts starting with "fail" fail, with "slow" wait for the gate."""
+
+    def __init__(self, name):
+        super().__init__(name, "default", "fallback", 0.0, 100, "You are a test.")
+        self.prompts = []
+        self.gate = None
+
+    async def stream_response(self, messages, model, context):
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        if prompt.startswith("slow"):
+            await self.gate.wait()
+        if prompt.startswith("fail"):
+            raise RuntimeError("upstream error")
+        yield self.format_stream_chunk(context.message_id, f"answer: {prompt}", model)
+        yield self.format_done_message(context.message_id, model)
+
+    async def health_check(self, model, test_message):
+        return "ok"
+
+PROVIDERS = {name: ScriptedProvider(name) for name in ("gpt", "claude")}
+ProviderFactory._instances.update(PROVIDERS)
+
+def batch(prompts, mode="local"):
+    return BatchChatRequest(requests=[
+        {"provider": provider, "messages": [{"role": "user", "content": prompt}]}
+        for provider, prompt in prompts
+    ], mode=mode)
+
+async def new_manager() -> BatchJobManager:
+    for provider in PROVIDERS.values():
+        provider.prompts.clear()
+        provider.gate = asyncio.Event()
+    manager = BatchJobManager(workers=4, provider_concurrency={"gpt": 2, "claude": 1})
+    await manager.start()
+    return manager
+
+async def wait_finished(manager: BatchJobManager, job: BatchJob) -> None:
+    async def drain():
+        async for _ in manager.follow(job):
+            pass
+    await asyncio.wait_for(drain(), 5)
+
+def test_job_completes():
+    """Every request gets a result and the summary counts them by outcome."""
+    async def run():
+        STORE.clear()
+        manager = await new_manager()
+        try:
+            job = await manager.submit(batch([
+                ("gpt", "q0"), ("gpt", "q1"), ("gpt", "fail q2"), ("claude", "q3"), ("claude", "q4")
+            ]))
+            await wait_finished(manager, job)
+            summary = job.summary()
+            assert summary["status"] == "completed", summary
+            assert (summary["total"], summary["completed"], summary["succeeded"], summary["failed"],
+                    summary["cancelled"]) == (5, 5, 4, 1, 0), summary
+            results = {result["custom_id"]: result for result in job.results_page(0, 10)}
+            assert results["0"]["content"] == "answer: q0" and results["0"]["via"] == "local"
+            assert results["2"]["status"] == "failed"
+            assert (manager.requests_completed, manager.requests_failed) == (4, 1)
+        finally:
+            await manager.stop()
+        # Stopping saves the finished job
+        assert STORE[job.id]["status"] == "completed"
+    asyncio.run(run())
+
+def test_cancel_in_flight():
+    """Cancelling marks every unanswered request cancelled; answers arriving later are dropped."""
+    async def run():
+        STORE.clear()
+        manager = await new_manager()
+        try:
+            job = await manager.submit(batch([("gpt", f"slow q{i}") for i in range(4)]))
+            while manager.in_flight < 2:
+                await asyncio.sleep(0.01)
+            assert await manager.cancel(job)
+            assert not await manager.cancel(job)
+            summary = job.summary()
+            assert summary["status"] == "cancelled", summary
+            assert (summary["completed"], summary["succeeded"], summary["cancelled"]) == (4, 0, 4), summary
+
+            PROVIDERS["gpt"].gate.set()
+            while manager.in_flight:
+                await asyncio.sleep(0.01)
+            assert job.summary()["cancelled"] == 4
+            assert manager.requests_completed == 0
+            # Queued requests of the cancelled job never started
+            assert len(PROVIDERS["gpt"].prompts) == 2, PROVIDERS["gpt"].prompts
+            assert STORE[job.id]["status"] == "cancelled"
+        finally:
+            await manager.stop()
+    asyncio.run(run())
+
+def test_resume_requeues_unanswered():
+    """A saved running job resumes with only the requests that have no result."""
+    async def run():
+        STORE.clear()
+        job = BatchJob("batch-resumed", [
+            {"custom_id": str(i), "provider": "gpt", "messages": [{"role": "user", "content": f"q{i}"}]}
+            for i in range(3)
+        ], "local")
+        job.start()
+        job.record(0, {"status": "succeeded", "model": "default", "content": "saved", "usage": None}, "local")
+        await save_batch_job(job.to_row())
+
+        manager = await new_manager()
+        try:
+            assert manager.jobs_resumed == 1
+            resumed = await manager.get("batch-resumed")
+            await wait_finished(manager, resumed)
+            assert sorted(PROVIDERS["gpt"].prompts) == ["q1", "q2"], PROVIDERS["gpt"].prompts
+            assert resumed.results[0]["content"] == "saved"
+            assert resumed.summary()["succeeded"] == 3
+        finally:
+            await manager.stop()
+    asyncio.run(run())
+
+class ExpiringBatchAPI(LocalBatchAPI):
+    """A native batch that leaves request-1 unanswered, as if it expired."""
+
+    async def poll(self, batch_id):
+        outcomes = await super().poll(batch_id)
+        if outcomes:
+            outcomes.pop("request-1", None)
+        return outcomes
+
+def test_native_leftovers_fall_back():
+    """Requests a native batch does not answer run on the local workers."""
+    async def run():
+        STORE.clear()
+        manager = await new_manager()
+        try:
+            manager._native_apis["gpt"] = ExpiringBatchAPI(PROVIDERS["gpt"])
+            job = await manager.submit(batch([("gpt", "q0"), ("gpt", "q1"), ("gpt", "q2")], mode="native"))
+            await wait_finished(manager, job)
+            via = {result["custom_id"]: result["via"] for result in job.results_page(0, 10)}
+            assert via == {"0": "native", "1": "local", "2": "native"}, via
+            assert job.summary()["succeeded"] == 3
+            assert job.summary()["native_batches"]["gpt"].startswith("local-batch-")
+            assert (manager.native_batches, manager.native_fallbacks) == (1, 1)
+            # The leftover ran a second time, on a local worker
+            assert sorted(PROVIDERS["gpt"].prompts) == ["q0", "q1", "q1", "q2"], PROVIDERS["gpt"].prompts
+        finally:
+            await manager.stop()
+    asyncio.run(run())
+
+def test_native_api_is_abstract():
+    """A batch API must implement every operation."""
+    class Incomplete(NativeBatchAPI):
+        async def submit(self, entries):
+            return "batch"
+    try:
+        Incomplete(PROVIDERS["gpt"])
+        raise AssertionError("an incomplete NativeBatchAPI was instantiated")
+    except TypeError:
+        pass
+
+def run_tests() -> bool:
+    tests = [
+        test_job_completes,
+        test_cancel_in_flight,
+        test_resume_requeues_unanswered,
+        test_native_leftovers_fall_back,
+        test_native_api_is_abstract,
+    ]
+    passed = True
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\nOverall result: {'✅ All tests passed' if passed else '❌ Some tests failed'}")
+    return passed
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests() else 1)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Test script for idempotency keys in the chat stream registry.
+
+A retry carrying the Idempotency-Key of a request that joined an in-flight
+generation must attach to that generation, and a key reused with a different
+request must be rejected. Runs without provider credentials or a network
+connection.
+"""
+import sys
+import os
+import asyncio
+
+# Add the current directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Configuration requires API keys for the supported providers; none are called here
+for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GEMINI_API_KEY", "GROQ_API_KEY"):
+    os.environ.setdefault(key, "test")
+
+from chat_streams import ChatStream, IdempotencyKeyReused, StreamRegistry
+from models import ChatRequest
+from singleflight import idempotency_fingerprint
+from stream_events import StreamEvent
+
+FLIGHT_KEY = "flight"
+
+def request_for(prompt: str) -> ChatRequest:
+    return ChatRequest(messages=[{"role": "user", "content": prompt}])
+
+async def answer(message_id: str, release: asyncio.Event):
+    await release.wait()
+    yield StreamEvent.delta(message_id, "4", "model")
+    yield StreamEvent.done(message_id, "model")
+
+def start_generation(registry: StreamRegistry, release: asyncio.Event, **keys) -> ChatStream:
+    stream = ChatStream(message_id=f"m{len(registry._streams)}", provider="gpt", conversation_id="c", **keys)
+    registry.register(stream)
+    stream.start(answer(stream.message_id, release))
+    return stream
+
+def test_fingerprint():
+    """The fingerprint changes with the provider asked for and with the messages."""
+    fingerprint = idempotency_fingerprint("gpt", request_for("What is 2+2?"))
+    assert fingerprint == idempotency_fingerprint("gpt", request_for("What is 2+2?"))
+    assert fingerprint != idempotency_fingerprint("claude", request_for("What is 2+2?"))
+    assert fingerprint != idempotency_fingerprint("gpt", request_for("What is 2*2?"))
+
+def test_retry_after_join():
+    """A request that joined through singleflight binds its key, so its retry attaches instead of starting over."""
+    async def run():
+        registry = StreamRegistry(max_streams=10, ttl_seconds=60)
+        release = asyncio.Event()
+        request_hash = idempotency_fingerprint("gpt", request_for("What is 2+2?"))
+        creator = start_generation(registry, release, singleflight_key=FLIGHT_KEY)
+
+        shared = registry.join_inflight(FLIGHT_KEY, "c2", "retry-key", request_hash)
+        assert shared is creator
+        assert registry.get_by_idempotency_key("retry-key", request_hash) is creator
+
+        release.set()
+        await creator._task
+        # Finished streams stay replayable, and so does the joined request's key
+        assert registry.get_by_idempotency_key("retry-key", request_hash) is creator
+    asyncio.run(run())
+
+def test_reused_key_rejected():
+    """A key sent again with a different request raises, for the creator's key and a joined one."""
+    async def run():
+        registry = StreamRegistry(max_streams=10, ttl_seconds=60)
+        release = asyncio.Event()
+        first = idempotency_fingerprint("gpt", request_for("What is 2+2?"))
+        other = idempotency_fingerprint("gpt", request_for("What is 2*2?"))
+        creator = start_generation(registry, release, singleflight_key=FLIGHT_KEY,
+                                   idempotency_key="creator-key", request_hash=first)
+        registry.join_inflight(FLIGHT_KEY, "c2", "joined-key", first)
+
+        for key in ("creator-key", "joined-key"):
+            assert registry.get_by_idempotency_key(key, first) is creator
+            try:
+                registry.get_by_idempotency_key(key, other)
+                raise AssertionError(f"{key} reused with a different request was accepted")
+            except IdempotencyKeyReused:
+                pass
+        assert registry.get_by_idempotency_key("unknown-key", other) is None
+
+        release.set()
+        await creator._task
+    asyncio.run(run())
+
+def test_evicted_keys_released():
+    """Evicting a stream forgets every key bound to it, including joined ones."""
+    async def run():
+        registry = StreamRegistry(max_streams=10, ttl_seconds=0)
+        release = asyncio.Event()
+        request_hash = idempotency_fingerprint("gpt", request_for("What is 2+2?"))
+        creator = start_generation(registry, release, singleflight_key=FLIGHT_KEY,
+                                   idempotency_key="creator-key", request_hash=request_hash)
+        registry.join_inflight(FLIGHT_KEY, "c2", "joined-key", request_hash)
+        release.set()
+        await creator._task
+
+        other = idempotency_fingerprint("gpt", request_for("What is 2*2?"))
+        for key in ("creator-key", "joined-key"):
+            assert registry.get_by_idempotency_key(key, other) is None
+        assert not registry._idempotency
+    asyncio.run(run())
+
+def run_tests() -> bool:
+    tests = [test_fingerprint, test_retry_after_join, test_reused_key_rejected, test_evicted_keys_released]
+    passed = True
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\nOverall result: {'✅ All tests passed' if passed else '❌ Some tests failed'}")
+    return passed
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests() else 1)
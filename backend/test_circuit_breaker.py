@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Test script for half-open circuit probes.
+
+A half-open breaker admits CIRCUIT_HALF_OPEN_PROBES calls at a time. A probe
+that ends before the model is actually called (preparing the messages fails,
+the request is cancelled, or the client goes away at a model_change event)
+must free its slot, or the breaker rejects the model for good. Runs without
+provider credentials or a network connection.
+"""
+import sys
+import os
+import asyncio
+
+# Add the current directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Configuration requires API keys for the supported providers; none are called here
+for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GEMINI_API_KEY", "GROQ_API_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ["CIRCUIT_BREAKER_ENABLED"] = "true"
+os.environ["CIRCUIT_HALF_OPEN_PROBES"] = "1"
+
+from fastapi import HTTPException
+from call_context import CallContext
+from circuit_breaker import CircuitBreaker, circuit_breakers
+from configuration import CIRCUIT_HALF_OPEN_PROBES, CIRCUIT_OPEN_SECONDS
+from context_window import ContextWindowExceeded
+from failover import stream_with_failover
+from hedging import _Attempt, hedged_stream
+from models import ConversationMessage
+from providers import BaseProvider
+from stream_events import StreamEvent
+
+PROVIDER = "gpt"
+MESSAGES = [ConversationMessage(role="user", content="What is 2+2?")]
+
+class ProbeProvider(BaseProvider):
+    """Answers "4", or fails in prepare_messages (too_long, slow) or in the stream (broken)."""
+
+    def __init__(self, too_long=False, slow=False, broken=False):
+        super().__init__(PROVIDER, "default", "fallback", 0.0, 100, "You are a test.")
+        self.too_long = too_long
+        self.slow = slow
+        self.broken = broken
+
+    async def prepare_messages(self, messages, model, context, partial_text=""):
+        if self.slow:
+            await asyncio.sleep(10)
+        if self.too_long:
+            raise ContextWindowExceeded(model, 10000, 100)
+        return await super().prepare_messages(messages, model, context, partial_text)
+
+    async def stream_response(self, messages, model, context):
+        if self.broken:
+            raise RuntimeError("upstream error")
+        yield self.format_stream_chunk(context.message_id, "4", model)
+        yield self.format_done_message(context.message_id, model)
+
+    async def health_check(self, model, test_message):
+        return "4"
+
+def half_open(model: str) -> CircuitBreaker:
+    """A breaker whose open period has passed, so its next call is a probe."""
+    breaker = circuit_breakers.get(PROVIDER, model)
+    breaker._trip("test")
+    breaker.opened_at -= CIRCUIT_OPEN_SECONDS + 1
+    return breaker
+
+def admits_probe(breaker: CircuitBreaker) -> bool:
+    """Whether the breaker admits a probe now; frees the slot it reserved to check."""
+    allowed = breaker.allow_request()
+    if allowed:
+        breaker.release()
+    return allowed
+
+async def collect(events):
+    return [event async for event in events]
+
+def test_failover_prepare_fails():
+    """A probe whose messages do not fit frees its slot; every retry still reaches the model."""
+    breaker = half_open("too-long")
+    chain = [(ProbeProvider(too_long=True), "too-long")]
+    for _ in range(CIRCUIT_HALF_OPEN_PROBES + 2):
+        try:
+            asyncio.run(collect(stream_with_failover(MESSAGES, CallContext("m", chain), PROVIDER)))
+            raise AssertionError("a conversation that does not fit was answered")
+        except HTTPException as e:
+            # 503 would mean the breaker skipped the model
+            assert e.status_code == 422, e.status_code
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert admits_probe(breaker)
+
+def test_failover_cancelled_while_preparing():
+    """A request cancelled before the model is called frees its probe slot."""
+    breaker = half_open("slow-prepare")
+    chain = [(ProbeProvider(slow=True), "slow-prepare")]
+
+    async def run():
+        task = asyncio.create_task(collect(stream_with_failover(MESSAGES, CallContext("m", chain), PROVIDER)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    asyncio.run(run())
+    assert admits_probe(breaker)
+
+def test_failover_closed_at_model_change():
+    """A client that goes away at the model_change event frees the next step's probe slot."""
+    breaker = half_open("next-step")
+    chain = [(ProbeProvider(broken=True), "broken"), (ProbeProvider(), "next-step")]
+
+    async def run():
+        events = stream_with_failover(MESSAGES, CallContext("m", chain), PROVIDER)
+        event = await events.__anext__()
+        assert event.kind == StreamEvent.MODEL_CHANGE, event
+        await events.aclose()
+    asyncio.run(run())
+    assert admits_probe(breaker)
+
+def test_hedged_prepare_fails():
+    """A hedged request's probe whose messages do not fit frees its slot and falls through the chain."""
+    breaker = half_open("hedged-too-long")
+    chain = [(ProbeProvider(too_long=True), "hedged-too-long"), (ProbeProvider(), "hedged-fallback")]
+    for _ in range(CIRCUIT_HALF_OPEN_PROBES + 2):
+        events = asyncio.run(collect(hedged_stream(MESSAGES, CallContext("m", chain), PROVIDER)))
+        assert events[0].text == "4" and events[0].model == "hedged-fallback", events
+    assert admits_probe(breaker)
+
+def test_hedge_cancelled_before_running():
+    """An attempt cancelled before its task ever ran frees its probe slot."""
+    breaker = half_open("cancelled-attempt")
+
+    async def run():
+        assert breaker.allow_request()
+        attempt = _Attempt(asyncio.Queue(), ProbeProvider(), "cancelled-attempt", MESSAGES,
+                           CallContext("m", [(ProbeProvider(), "cancelled-attempt")]))
+        await attempt.cancel()
+    asyncio.run(run())
+    assert admits_probe(breaker)
+
+def run_tests() -> bool:
+    tests = [
+        test_failover_prepare_fails,
+        test_failover_cancelled_while_preparing,
+        test_failover_closed_at_model_change,
+        test_hedged_prepare_fails,
+        test_hedge_cancelled_before_running,
+    ]
+    passed = True
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\nOverall result: {'✅ All tests passed' if passed else '❌ Some tests failed'}")
+    return passed
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests() else 1)
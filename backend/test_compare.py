@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Test script for model comparison sources.
+
+A comparison source may only name a model the server is configured with (a
+provider's default, fallback or economy model, a FAILOVER_CHAINS step, or a
+COMPARE_ALLOWED_MODELS entry); anything else is a 422 before any provider is
+called. Runs without provider credentials or a network connection.
+"""
+import sys
+import os
+
+# Add the current directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Configuration requires API keys for the supported providers; none are called here
+for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GEMINI_API_KEY", "GROQ_API_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ["FAILOVER_CHAINS"] = "gpt>gpt:gpt-chain-model>claude"
+os.environ["COMPARE_ALLOWED_MODELS"] = "gpt:gpt-allowed-model, claude:claude-allowed-model"
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+from configuration import PROVIDER_SETTINGS
+from models import CompareChatRequest
+
+MESSAGES = [{"role": "user", "content": "What is 2+2?"}]
+
+def compare(sources) -> CompareChatRequest:
+    return CompareChatRequest(messages=MESSAGES, sources=sources)
+
+def rejected(sources) -> bool:
+    try:
+        compare(sources)
+    except ValidationError:
+        return True
+    return False
+
+def test_configured_models_accepted():
+    """Default, fallback and economy models, chain steps and allowlisted models are accepted."""
+    gpt = PROVIDER_SETTINGS["gpt"]
+    claude = PROVIDER_SETTINGS["claude"]
+    request = compare(["gpt", f"claude:{claude['fallback_model']}", f"gpt:{gpt['economy_model']}"])
+    assert request.sources == [
+        f"gpt:{gpt['default_model']}", f"claude:{claude['fallback_model']}", f"gpt:{gpt['economy_model']}"
+    ], request.sources
+    # An empty model is the provider's default
+    assert compare(["gpt:"]).sources == [f"gpt:{gpt['default_model']}"]
+    assert compare(["gpt:gpt-chain-model", "gpt:gpt-allowed-model", " claude : claude-allowed-model"]).sources == [
+        "gpt:gpt-chain-model", "gpt:gpt-allowed-model", "claude:claude-allowed-model"
+    ]
+
+def test_unknown_models_rejected():
+    """Models the server is not configured with are rejected, including another provider's models."""
+    assert rejected(["gpt:gpt-made-up"])
+    assert rejected(["gpt", "claude:claude-made-up"])
+    assert rejected([f"claude:{PROVIDER_SETTINGS['gpt']['default_model']}"])
+    assert rejected(["claude:gpt-allowed-model"])
+
+def test_endpoint_returns_422():
+    """The validation error reaches the client as a 422 naming the source."""
+    app = FastAPI()
+
+    @app.post("/chat/compare")
+    async def compare_endpoint(request: CompareChatRequest):
+        return {"sources": request.sources}
+
+    client = TestClient(app)
+    response = client.post("/chat/compare", json={"messages": MESSAGES, "sources": ["gpt", "gpt:gpt-made-up"]})
+    assert response.status_code == 422, response.status_code
+    assert "gpt:gpt-made-up" in response.text
+    response = client.post("/chat/compare", json={"messages": MESSAGES, "sources": ["gpt", "gpt:gpt-allowed-model"]})
+    assert response.status_code == 200, response.text
+
+def run_tests() -> bool:
+    tests = [test_configured_models_accepted, test_unknown_models_rejected, test_endpoint_returns_422]
+    passed = True
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\nOverall result: {'✅ All tests passed' if passed else '❌ Some tests failed'}")
+    return passed
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests() else 1)
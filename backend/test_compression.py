@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Test script for request body decompression.
+
+Covers decompress_body and RequestDecompressionMiddleware: gzip and zstd
+round-trips, truncated frames (400), decompression bombs (413) and unknown
+encodings (415). Runs without provider credentials or a network connection.
+"""
+import sys
+import os
+import gzip
+
+# Add the current directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Configuration requires API keys for the supported providers; none are called here
+for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GEMINI_API_KEY", "GROQ_API_KEY"):
+    os.environ.setdefault(key, "test")
+
+import zstandard
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+from compression import BodyTooLargeError, DecompressionError, RequestDecompressionMiddleware, decompress_body
+
+MAX_SIZE = 64 * 1024
+BODY = b'{"messages": [{"role": "user", "content": "' + b"hello world " * 2000 + b'"}]}'
+
+def zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor().compress(data)
+
+def zstd_compress_streaming(data: bytes) -> bytes:
+    """A zstd frame without a content size, as streaming clients send it."""
+    compressor = zstandard.ZstdCompressor().compressobj()
+    return compressor.compress(data) + compressor.flush()
+
+COMPRESSORS = {"gzip": gzip.compress, "zstd": zstd_compress}
+
+async def echo(request: Request) -> Response:
+    return Response(await request.body(), headers={"x-content-encoding": request.headers.get("content-encoding", "")})
+
+def new_client() -> TestClient:
+    app = Starlette(routes=[Route("/echo", echo, methods=["POST"])])
+    app.add_middleware(RequestDecompressionMiddleware, max_size=MAX_SIZE)
+    return TestClient(app)
+
+def test_round_trip():
+    """Both encodings decompress to the original body, with or without a stored content size."""
+    for encoding, compress in COMPRESSORS.items():
+        assert decompress_body(compress(BODY), encoding, MAX_SIZE) == BODY, encoding
+    assert decompress_body(zstd_compress_streaming(BODY), "zstd", MAX_SIZE) == BODY
+
+    client = new_client()
+    for encoding, compress in COMPRESSORS.items():
+        response = client.post("/echo", content=compress(BODY), headers={"Content-Encoding": encoding})
+        assert response.status_code == 200, encoding
+        assert response.content == BODY, encoding
+        # The app sees a plain body
+        assert response.headers["x-content-encoding"] == "", encoding
+
+    response = client.post("/echo", content=BODY)
+    assert response.status_code == 200 and response.content == BODY
+    response = client.post("/echo", content=BODY, headers={"Content-Encoding": "identity"})
+    assert response.status_code == 200 and response.content == BODY
+
+def test_truncated_frame():
+    """A body cut off anywhere is rejected, never passed on partially decoded."""
+    compressors = dict(COMPRESSORS, zstd_streaming=zstd_compress_streaming)
+    for name, compress in compressors.items():
+        encoding = name.split("_")[0]
+        compressed = compress(BODY)
+        for cut in range(1, len(compressed), max(1, len(compressed) // 20)):
+            try:
+                decompress_body(compressed[:cut], encoding, MAX_SIZE)
+            except DecompressionError:
+                continue
+            raise AssertionError(f"{name} body truncated at {cut} of {len(compressed)} bytes was accepted")
+
+    client = new_client()
+    for encoding, compress in COMPRESSORS.items():
+        response = client.post("/echo", content=compress(BODY)[:-8], headers={"Content-Encoding": encoding})
+        assert response.status_code == 400, (encoding, response.status_code)
+        assert "Truncated" in response.json()["message"], encoding
+
+def test_decompression_bomb():
+    """A small body that inflates past the limit gets a 413 without being fully inflated."""
+    client = new_client()
+    for encoding, compress in COMPRESSORS.items():
+        bomb = compress(b"\0" * (50 * 1024 * 1024))
+        assert len(bomb) < MAX_SIZE, encoding
+        try:
+            decompress_body(bomb, encoding, MAX_SIZE)
+            raise AssertionError(f"{encoding} bomb was accepted")
+        except BodyTooLargeError:
+            pass
+        response = client.post("/echo", content=bomb, headers={"Content-Encoding": encoding})
+        assert response.status_code == 413, (encoding, response.status_code)
+
+    # A compressed body already over the limit is rejected before decompressing
+    response = client.post("/echo", content=os.urandom(MAX_SIZE + 1), headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 413
+
+def test_unknown_encoding():
+    """Encodings the server cannot decode get a 415 instead of reaching validation still encoded."""
+    client = new_client()
+    for encoding in ("br", "deflate", "gzip, zstd"):
+        response = client.post("/echo", content=BODY, headers={"Content-Encoding": encoding})
+        assert response.status_code == 415, (encoding, response.status_code)
+        assert response.json()["message"] == f"Unsupported Content-Encoding: {encoding}"
+
+def run_tests() -> bool:
+    tests = [test_round_trip, test_truncated_frame, test_decompression_bomb, test_unknown_encoding]
+    passed = True
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\nOverall result: {'✅ All tests passed' if passed else '❌ Some tests failed'}")
+    return passed
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests() else 1)
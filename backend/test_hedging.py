@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Test script for hedged requests.
+
+Only a token decides the race between a slow first attempt and its hedge:
+metadata from a stalled attempt must not win, and events an attempt sends
+before its first token are emitted once it wins. Runs without provider
+credentials or a network connection.
+"""
+import sys
+import os
+import asyncio
+
+# Add the current directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Configuration requires API keys for the supported providers; none are called here
+for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GEMINI_API_KEY", "GROQ_API_KEY"):
+    os.environ.setdefault(key, "test")
+# Hedge after 50ms instead of waiting for real TTFT samples
+os.environ["HEDGE_DEFAULT_DELAY_MS"] = "50"
+os.environ["HEDGE_MIN_DELAY_MS"] = "10"
+
+from call_context import CallContext
+from hedging import hedge_stats, hedged_stream
+from models import ConversationMessage
+from providers import BaseProvider
+from stream_events import StreamEvent
+
+PROVIDER = "gpt"
+MESSAGES = [ConversationMessage(role="user", content="What is 2+2?")]
+
+class ScriptedProvider(BaseProvider):
+    """Streams (delay in seconds, event kind, text) steps; metadata events carry a usage payload."""
+
+    def __init__(self, steps):
+        super().__init__(PROVIDER, "primary", "hedge", 0.0, 100, "You are a test.")
+        self.steps = steps
+
+    async def stream_response(self, messages, model, context):
+        for delay, kind, text in self.steps:
+            await asyncio.sleep(delay)
+            if kind == StreamEvent.DELTA:
+                yield self.format_stream_chunk(context.message_id, text, model)
+            elif kind == StreamEvent.DONE:
+                yield self.format_done_message(context.message_id, model)
+            else:
+                yield StreamEvent.meta(kind, context.message_id, {"input_tokens": 7, "output_tokens": 0}, model=model)
+
+    async def health_check(self, model, test_message):
+        return "4"
+
+def run_race(primary_steps, hedge_steps):
+    """Race a primary and a hedge; return the events streamed to the client."""
+    async def run():
+        chain = [(ScriptedProvider(primary_steps), "primary"), (ScriptedProvider(hedge_steps), "hedge")]
+        context = CallContext(message_id="m", chain=chain)
+        return [event async for event in hedged_stream(MESSAGES, context, PROVIDER)]
+    return asyncio.run(run())
+
+def test_metadata_does_not_win():
+    """A stalled primary that sends metadata right away still loses to a hedge that streams tokens."""
+    wins_before = hedge_stats.for_provider(PROVIDER)["hedge_wins"]
+    events = run_race(
+        primary_steps=[(0, StreamEvent.USAGE, ""), (10, StreamEvent.DELTA, "late")],
+        hedge_steps=[(0.01, StreamEvent.DELTA, "4"), (0, StreamEvent.DONE, "")],
+    )
+    assert [e.kind for e in events] == [StreamEvent.DELTA, StreamEvent.DONE], events
+    assert events[0].text == "4" and events[0].model == "hedge"
+    assert hedge_stats.for_provider(PROVIDER)["hedge_wins"] == wins_before + 1
+
+def test_winner_emits_buffered_events():
+    """Events the winner sent before its first token come first; the loser's are dropped."""
+    events = run_race(
+        primary_steps=[(0, StreamEvent.USAGE, ""), (0.2, StreamEvent.USAGE, ""),
+                       (10, StreamEvent.DELTA, "late")],
+        hedge_steps=[(0, StreamEvent.USAGE, ""), (0.01, StreamEvent.DELTA, "4"), (0, StreamEvent.DONE, "")],
+    )
+    assert [(e.kind, e.model) for e in events] == [
+        (StreamEvent.USAGE, "hedge"), (StreamEvent.DELTA, "hedge"), (StreamEvent.DONE, "hedge")
+    ], events
+
+def test_fast_primary_wins():
+    """A primary that streams before the hedge delay is never hedged."""
+    hedged_before = hedge_stats.for_provider(PROVIDER)["hedged"]
+    events = run_race(
+        primary_steps=[(0, StreamEvent.USAGE, ""), (0, StreamEvent.DELTA, "4"), (0, StreamEvent.DONE, "")],
+        hedge_steps=[(0, StreamEvent.DELTA, "never")],
+    )
+    assert [(e.kind, e.model) for e in events] == [
+        (StreamEvent.USAGE, "primary"), (StreamEvent.DELTA, "primary"), (StreamEvent.DONE, "primary")
+    ], events
+    assert hedge_stats.for_provider(PROVIDER)["hedged"] == hedged_before
+
+def run_tests() -> bool:
+    tests = [test_metadata_does_not_win, test_winner_emits_buffered_events, test_fast_primary_wins]
+    passed = True
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\nOverall result: {'✅ All tests passed' if passed else '❌ Some tests failed'}")
+    return passed
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests() else 1)
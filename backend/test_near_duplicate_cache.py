@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Test script for near-duplicate cache keys.
+
+Prompts that differ in an operator, a comparison, a word or a negation must
+never share an entry, however similar their shingles are.
+Runs without provider credentials or a network connection.
+"""
+import sys
+import os
+
+# Add the current directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Configuration requires API keys for the supported providers; none are called here
+for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GEMINI_API_KEY", "GROQ_API_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ["NEAR_DUPLICATE_CACHE_ENABLED"] = "true"
+# Only requests at or below NEAR_DUPLICATE_MAX_TEMPERATURE are eligible
+os.environ["OPENAI_TEMPERATURE"] = "0"
+
+from models import ChatRequest
+from near_duplicate_cache import NearDuplicateCache, normalize_prompt
+from stream_events import StreamEvent
+from configuration import PROVIDER_SETTINGS
+
+PROVIDER = "gpt"
+
+def request_for(prompt: str) -> ChatRequest:
+    return ChatRequest(messages=[{"role": "user", "content": prompt}])
+
+def new_cache() -> NearDuplicateCache:
+    return NearDuplicateCache(max_entries=100, ttl_seconds=60, num_perm=128, bands=32, shingle_size=4)
+
+def store_answer(cache: NearDuplicateCache, prompt: str, answer: str) -> None:
+    model = PROVIDER_SETTINGS[PROVIDER]["default_model"]
+    events = [StreamEvent.delta("m", answer, model), StreamEvent.done("m", model)]
+    cache.store_stream(cache.key_for(PROVIDER, request_for(prompt)), events, model)
+
+def lookup(cache: NearDuplicateCache, prompt: str):
+    return cache.lookup(cache.key_for(PROVIDER, request_for(prompt)))
+
+def test_normalize_keeps_operators():
+    """Operators and comparisons survive normalization; sentence punctuation does not."""
+    assert normalize_prompt("What is 2+2?") == "what is 2 + 2"
+    assert normalize_prompt("What is 2*2?") == "what is 2 * 2"
+    assert normalize_prompt("Is x > y?") != normalize_prompt("Is x < y?")
+    assert normalize_prompt("what is 2 + 2") == normalize_prompt("What is 2+2?")
+
+def test_operators_never_share_an_entry():
+    """A cached "2+2" answer is never served for "2*2", "2-2" or "2/2", nor "x > y" for "x < y"."""
+    cache = new_cache()
+    store_answer(cache, "What is 2+2?", "4")
+    assert lookup(cache, "what is 2 + 2") is not None
+    for prompt in ("What is 2*2?", "What is 2-2?", "What is 2/2?", "What is 2+3?"):
+        assert lookup(cache, prompt) is None, prompt
+
+    store_answer(cache, "Is x > y?", "yes")
+    assert lookup(cache, "Is x < y?") is None
+
+def test_changed_words_never_share_an_entry():
+    """Prompts whose shingles nearly match but whose words differ miss, however high their similarity."""
+    context = (
+        "Our quarterly report covers revenue across the three regions, staffing levels in each office, "
+        "and the results of the customer satisfaction survey sent in March. Based on the figures below, "
+        "explain in two short paragraphs why customer churn {verb} during the second quarter of the year."
+    )
+    cache = new_cache()
+    store_answer(cache, context.format(verb="increased"), "Because of the price change.")
+    assert lookup(cache, context.format(verb="increased").upper()) is not None
+    key = cache.key_for(PROVIDER, request_for(context.format(verb="decreased")))
+    assert cache.lookup(key) is None
+
+    question = "Does the sorted function modify its input list in place when called with reverse=True?"
+    store_answer(cache, question, "No.")
+    for prompt in (question.replace("Does", "Does not"), question.replace("sorted", "sort")):
+        assert lookup(cache, prompt) is None, prompt
+    assert lookup(cache, "does the SORTED function modify its input list in place, when called with reverse=True") is not None
+
+def run_tests() -> bool:
+    tests = [test_normalize_keeps_operators, test_operators_never_share_an_entry, test_changed_words_never_share_an_entry]
+    passed = True
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\nOverall result: {'✅ All tests passed' if passed else '❌ Some tests failed'}")
+    return passed
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests() else 1)
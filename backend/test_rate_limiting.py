@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""
+Test script for client rate limiting.
+
+Covers client identification (X-Forwarded-For entries a client prepends must
+not pick its bucket), the local request and token buckets, the Redis path
+(script arguments, result parsing and the local fallback on Redis errors),
+and RateLimitMiddleware. The Redis token bucket script itself runs through
+an in-memory Redis stand-in when the `lupa` Lua runtime is installed. Runs
+without provider credentials, Redis or a network connection.
+"""
+import sys
+import os
+import asyncio
+
+# Add the current directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Configuration requires API keys for the supported providers; none are called here
+for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GEMINI_API_KEY", "GROQ_API_KEY"):
+    os.environ.setdefault(key, "test")
+
+import redis.asyncio as redis
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+from rate_limiting import (
+    REDIS_KEY_PREFIX, REDIS_TOKEN_BUCKET_SCRIPT, RateLimiter, RateLimitMiddleware, client_identity
+)
+
+WINDOW = 60
+
+def scope_for(forwarded=(), client="10.0.0.1", headers=()):
+    """An ASGI scope from the proxy at `client`, with one X-Forwarded-For header per entry of `forwarded`."""
+    raw = [(b"x-forwarded-for", value.encode("latin-1")) for value in forwarded]
+    raw += [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    return {"type": "http", "headers": raw, "client": (client, 50000)}
+
+def new_limiter(max_requests=2, max_tokens=0) -> RateLimiter:
+    return RateLimiter(max_requests, max_tokens, WINDOW, max_clients=100)
+
+def test_forwarded_for_uses_trusted_hop():
+    """The client is the entry the trusted proxies added, counted from the right."""
+    # The client sent "1.1.1.1"; the proxy appended the address it saw
+    spoofed = scope_for(["1.1.1.1, 203.0.113.7"])
+    assert client_identity(spoofed, [], True) == "ip:203.0.113.7"
+    # Two proxies: the second one appended the first one's address
+    assert client_identity(scope_for(["1.1.1.1, 203.0.113.7, 10.0.0.2"]), [], True, 2) == "ip:203.0.113.7"
+    # Repeated headers count as one list
+    assert client_identity(scope_for(["1.1.1.1", "203.0.113.7"]), [], True) == "ip:203.0.113.7"
+    # Too few entries for the configured proxies, or no header: the connecting address
+    assert client_identity(scope_for(["203.0.113.7"]), [], True, 2) == "ip:10.0.0.1"
+    assert client_identity(scope_for(), [], True) == "ip:10.0.0.1"
+    # Untrusted: the header is ignored
+    assert client_identity(spoofed, [], False) == "ip:10.0.0.1"
+
+def test_client_headers_take_precedence():
+    """The first configured header present identifies the client, hashed."""
+    scope = scope_for(["203.0.113.7"], headers=[("x-team", "blue"), ("x-api-key", "secret")])
+    identity = client_identity(scope, ["x-api-key", "x-team"], True)
+    assert identity.startswith("x-api-key:") and "secret" not in identity, identity
+    assert identity == client_identity(scope_for(headers=[("x-api-key", "secret")]), ["x-api-key"], False)
+    assert client_identity(scope, ["x-user"], True) == "ip:203.0.113.7"
+
+def test_request_bucket():
+    """A client gets max_requests at once, then one more per refill interval."""
+    limiter = new_limiter(max_requests=2)
+    assert limiter._check_local("a", 0, now=0.0)[0]
+    assert limiter._check_local("a", 0, now=0.0)[0]
+    allowed, request_level, _, wait = limiter._check_local("a", 0, now=0.0)
+    assert not allowed and request_level == 0 and wait == WINDOW / 2, (allowed, request_level, wait)
+    # Other clients have their own bucket
+    assert limiter._check_local("b", 0, now=0.0)[0]
+    assert not limiter._check_local("a", 0, now=WINDOW / 2 - 1)[0]
+    assert limiter._check_local("a", 0, now=WINDOW / 2)[0]
+
+    decision = asyncio.run(limiter.check("c"))
+    assert decision.allowed and decision.limit == 2 and decision.remaining == 1
+    asyncio.run(limiter.check("c"))
+    decision = asyncio.run(limiter.check("c"))
+    assert not decision.allowed and decision.retry_after == WINDOW // 2, decision.retry_after
+    assert dict(decision.headers())[b"retry-after"] == str(WINDOW // 2).encode()
+    assert (limiter.rejected, limiter.rejected_by_tokens) == (1, 0)
+
+def test_token_bucket():
+    """Prompt tokens are charged to a second bucket; a prompt larger than it costs the whole bucket."""
+    limiter = new_limiter(max_requests=10, max_tokens=100)
+    assert asyncio.run(limiter.check("a", 60)).allowed
+    decision = asyncio.run(limiter.check("a", 60))
+    assert not decision.allowed and decision.remaining == 40, decision.remaining
+    assert limiter.rejected_by_tokens == 1
+    # Reported against the token quota, which is closer to running out
+    assert decision.limit == 100
+
+    decision = asyncio.run(limiter.check("b", 1000))
+    assert decision.allowed and decision.remaining == 0
+
+class RecordingScript:
+    """Stands in for the registered Redis script: records each call and returns a canned reply."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+
+    async def __call__(self, keys, args):
+        self.calls.append((keys, args))
+        if isinstance(self.reply, Exception):
+            raise self.reply
+        return self.reply
+
+def test_redis_arguments():
+    """The script gets both buckets' keys and parameters, and its string replies are parsed."""
+    limiter = new_limiter(max_requests=2, max_tokens=100)
+    limiter._script = RecordingScript([0, "0", "40.5", "12.5"])
+    decision = asyncio.run(limiter.check("ip:203.0.113.7", 1000))
+    keys, args = limiter._script.calls[0]
+    assert keys == [f"{REDIS_KEY_PREFIX}ip:203.0.113.7:requests", f"{REDIS_KEY_PREFIX}ip:203.0.113.7:tokens"]
+    # The oversized prompt is charged the whole token bucket
+    assert args == [2, 2 / WINDOW, 100, 100 / WINDOW, 1, 100], args
+    assert not decision.allowed and decision.retry_after == 13 and decision.limit == 2
+    assert limiter.rejected == 1 and not limiter._buckets
+
+def test_redis_error_falls_back():
+    """A Redis error charges the local bucket instead of failing the request."""
+    limiter = new_limiter(max_requests=1)
+    limiter._script = RecordingScript(redis.ConnectionError("connection refused"))
+    assert asyncio.run(limiter.check("a")).allowed
+    assert not asyncio.run(limiter.check("a")).allowed
+    assert limiter.redis_errors == 2 and len(limiter._script.calls) == 2
+
+class LuaScript:
+    """Runs REDIS_TOKEN_BUCKET_SCRIPT against in-memory hashes, with a settable Redis clock."""
+
+    def __init__(self, lua_runtime):
+        self.lua = lua_runtime
+        self.now = 1000.0
+        self.hashes = {}
+        self.expires = {}
+        self.script = self.lua.eval(f"function(KEYS, ARGV, redis)\n{REDIS_TOKEN_BUCKET_SCRIPT}\nend")
+        self.redis = self.lua.table_from({"call": self._call})
+
+    def _call(self, command, key=None, *args):
+        if command == "TIME":
+            seconds = int(self.now)
+            return self.lua.table_from([str(seconds), str(int(round((self.now - seconds) * 1000000)))])
+        if command == "HMGET":
+            stored = self.hashes.get(key, {})
+            return self.lua.table_from([stored.get(field, False) for field in args])
+        if command == "HSET":
+            self.hashes.setdefault(key, {}).update(zip(args[::2], (str(value) for value in args[1::2])))
+            return len(args) // 2
+        if command == "PEXPIRE":
+            self.expires[key] = args[0]
+            return 1
+        raise AssertionError(f"unexpected Redis command {command}")
+
+    async def __call__(self, keys, args):
+        # Redis passes every argument to the script as a string
+        reply = self.script(self.lua.table_from(keys), self.lua.table_from([str(arg) for arg in args]), self.redis)
+        return list(reply.values())
+
+def test_redis_script():
+    """The Lua token bucket admits, rejects and refills like the local one."""
+    try:
+        from lupa import LuaRuntime
+    except ImportError:
+        print("   (skipped: lupa is not installed)")
+        return
+    limiter = new_limiter(max_requests=2, max_tokens=100)
+    script = LuaScript(LuaRuntime())
+    limiter._script = script
+
+    assert asyncio.run(limiter.check("a", 30)).allowed
+    decision = asyncio.run(limiter.check("a", 30))
+    assert decision.allowed and decision.remaining == 0 and decision.limit == 2
+    decision = asyncio.run(limiter.check("a", 30))
+    assert not decision.allowed and decision.retry_after == WINDOW // 2, decision.retry_after
+    # A rejected request is not charged
+    assert float(script.hashes[f"{REDIS_KEY_PREFIX}a:tokens"]["level"]) == 40
+
+    script.now += WINDOW / 2
+    assert asyncio.run(limiter.check("a", 30)).allowed
+    decision = asyncio.run(limiter.check("a", 30))
+    assert not decision.allowed and limiter.rejected_by_tokens == 0
+    script.now += WINDOW
+    assert asyncio.run(limiter.check("a", 1000)).allowed
+    assert not asyncio.run(limiter.check("a", 1)).allowed
+    assert limiter.redis_errors == 0 and not limiter._buckets
+    # Keys expire once their bucket would be full again
+    assert script.expires[f"{REDIS_KEY_PREFIX}a:tokens"] == WINDOW * 1000 + 1000
+
+async def ok(request: Request) -> Response:
+    return Response("ok")
+
+def new_client(limiter: RateLimiter) -> TestClient:
+    app = Starlette(routes=[Route("/chat/{provider}", ok, methods=["POST"]), Route("/stats", ok)])
+    app.add_middleware(RateLimitMiddleware, limiter=limiter, client_headers=[], trust_forwarded_for=True)
+    return TestClient(app)
+
+def test_middleware():
+    """New chat requests are limited per client with RateLimit headers; changing a spoofed entry does not help."""
+    client = new_client(new_limiter(max_requests=1))
+    headers = {"X-Forwarded-For": "1.1.1.1, 203.0.113.7"}
+    response = client.post("/chat/gpt", json={}, headers=headers)
+    assert response.status_code == 200 and response.headers["ratelimit-remaining"] == "0"
+    response = client.post("/chat/gpt", json={}, headers={"X-Forwarded-For": "2.2.2.2, 203.0.113.7"})
+    assert response.status_code == 429, response.status_code
+    assert response.headers["retry-after"] == str(WINDOW) and response.json()["code"] == 429
+    # Another client, and requests that are not new generations, are not limited
+    assert client.post("/chat/gpt", json={}, headers={"X-Forwarded-For": "203.0.113.8"}).status_code == 200
+    assert client.get("/stats", headers=headers).status_code == 200
+
+def run_tests() -> bool:
+    tests = [
+        test_forwarded_for_uses_trusted_hop,
+        test_client_headers_take_precedence,
+        test_request_bucket,
+        test_token_bucket,
+        test_redis_arguments,
+        test_redis_error_falls_back,
+        test_redis_script,
+        test_middleware,
+    ]
+    passed = True
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            passed = False
+            print(f"❌ {test.__name__}: {e}")
+    print(f"\nOverall result: {'✅ All tests passed' if passed else '❌ Some tests failed'}")
+    return passed
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests() else 1)
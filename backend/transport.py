@@ -0,0 +1,188 @@
+"""
+Shared HTTP transport for provider SDK clients.
+
+Builds one tuned `httpx.AsyncClient` per provider host with explicit pool
+limits, keepalive expiry, HTTP/2 (when the `h2` package is installed) and a
+DNS cache, pre-warms connections at startup and keeps them warm in the
+background so TLS handshakes stay off the request path after idle periods.
+"""
+import asyncio
+import socket
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+import httpx
+import httpcore
+from logging_config import logger, debug_with_context
+from configuration import (
+    TRANSPORT_MAX_CONNECTIONS,
+    TRANSPORT_MAX_KEEPALIVE_CONNECTIONS,
+    TRANSPORT_KEEPALIVE_EXPIRY,
+    TRANSPORT_HTTP2,
+    TRANSPORT_DNS_CACHE_TTL,
+    TRANSPORT_WARM_CONNECTIONS,
+    TRANSPORT_KEEPALIVE_INTERVAL
+)
+
+try:
+    import h2  # noqa: F401  (httpx only needs it to be importable)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# API hosts of the providers whose SDKs accept an injected httpx client.
+# google-genai 1.2.0 issues requests through its own `requests` session, so
+# Gemini keeps its default transport.
+PROVIDER_BASE_URLS: Dict[str, str] = {
+    'gpt': "https://api.openai.com",
+    'claude': "https://api.anthropic.com",
+    'groq': "https://api.groq.com",
+}
+
+class CachingDNSBackend(httpcore.AsyncNetworkBackend):
+    """Network backend that caches DNS lookups for `ttl` seconds.
+
+    TLS still uses the original hostname for SNI and certificate checks, since
+    httpcore passes the origin host to `start_tls` separately.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._backend = httpcore.AnyIOBackend()
+        self._cache: Dict[Tuple[str, int], Tuple[str, float]] = {}
+
+    async def _resolve(self, host: str, port: int) -> str:
+        key = (host, port)
+        cached = self._cache.get(key)
+        now = time.monotonic()
+        if cached and cached[1] > now:
+            return cached[0]
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        address = infos[0][4][0]
+        self._cache[key] = (address, now + self.ttl)
+        return address
+
+    async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                          local_address: Optional[str] = None,
+                          socket_options: Optional[Iterable[Any]] = None) -> httpcore.AsyncNetworkStream:
+        try:
+            address = await self._resolve(host, port)
+            return await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+        except Exception:
+            # Stale or unusable cache entry: resolve again through the default path
+            self._cache.pop((host, port), None)
+            return await self._backend.connect_tcp(host, port, timeout, local_address, socket_options)
+
+    async def connect_unix_socket(self, path: str, timeout: Optional[float] = None,
+                                  socket_options: Optional[Iterable[Any]] = None) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+    @property
+    def cached_hosts(self) -> int:
+        return len(self._cache)
+
+class TransportManager:
+    """Owns the shared provider HTTP clients, their warmup and their pool statistics."""
+
+    def __init__(self):
+        self.http2 = TRANSPORT_HTTP2 and HTTP2_AVAILABLE
+        self._dns = CachingDNSBackend(TRANSPORT_DNS_CACHE_TTL)
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, httpx.AsyncHTTPTransport] = {}
+        self._keepalive_task: Optional[asyncio.Task] = None
+        if TRANSPORT_HTTP2 and not HTTP2_AVAILABLE:
+            logger.warning("TRANSPORT_HTTP2 is enabled but the h2 package is not installed; using HTTP/1.1")
+
+    def client_for(self, provider_name: str) -> Optional[httpx.AsyncClient]:
+        """
+        Get the shared client for a provider.
+
+        Returns:
+            An httpx.AsyncClient, or None if the provider's SDK cannot use one
+        """
+        if provider_name not in PROVIDER_BASE_URLS:
+            return None
+        if provider_name not in self._clients:
+            transport = httpx.AsyncHTTPTransport(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=TRANSPORT_MAX_CONNECTIONS,
+                    max_keepalive_connections=TRANSPORT_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=TRANSPORT_KEEPALIVE_EXPIRY
+                )
+            )
+            # httpx does not expose the network backend; swap in the DNS cache
+            transport._pool._network_backend = self._dns
+            self._transports[provider_name] = transport
+            self._clients[provider_name] = httpx.AsyncClient(
+                transport=transport,
+                http2=self.http2,
+                follow_redirects=True
+            )
+        return self._clients[provider_name]
+
+    async def warm_up(self) -> None:
+        """Open connections to every provider host ahead of the first request."""
+        async def ping(provider_name: str, client: httpx.AsyncClient) -> None:
+            try:
+                # Any response (even 404) leaves a warm TLS connection in the pool
+                await client.head(PROVIDER_BASE_URLS[provider_name], timeout=10.0)
+            except Exception as e:
+                debug_with_context(logger, "Connection warmup failed", provider=provider_name, error=str(e))
+
+        # HTTP/2 multiplexes over one connection; HTTP/1.1 needs one per concurrent request
+        per_host = 1 if self.http2 else TRANSPORT_WARM_CONNECTIONS
+        await asyncio.gather(*[
+            ping(provider_name, client)
+            for provider_name, client in self._clients.items()
+            for _ in range(per_host)
+        ])
+
+    def start_keepalive(self) -> None:
+        """Start re-warming connections periodically so they never idle out."""
+        if TRANSPORT_KEEPALIVE_INTERVAL <= 0 or self._keepalive_task is not None:
+            return
+
+        async def keepalive_loop() -> None:
+            while True:
+                await asyncio.sleep(TRANSPORT_KEEPALIVE_INTERVAL)
+                await self.warm_up()
+
+        self._keepalive_task = asyncio.create_task(keepalive_loop())
+
+    async def close(self) -> None:
+        """Stop the keepalive loop and close all clients."""
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        self._transports.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool statistics per provider: connections in use, idle and waiting requests."""
+        providers = {}
+        for provider_name, transport in self._transports.items():
+            pool = transport._pool
+            connections = pool.connections
+            providers[provider_name] = {
+                "connections": len(connections),
+                "in_use": sum(1 for c in connections if not c.is_idle()),
+                "idle": sum(1 for c in connections if c.is_idle()),
+                "http2": sum(1 for c in connections if "HTTP/2" in c.info()),
+                "waiting": sum(1 for r in pool._requests if getattr(r, "connection", None) is None),
+            }
+        return {
+            "http2_enabled": self.http2,
+            "max_connections": TRANSPORT_MAX_CONNECTIONS,
+            "max_keepalive_connections": TRANSPORT_MAX_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry": TRANSPORT_KEEPALIVE_EXPIRY,
+            "dns_cached_hosts": self._dns.cached_hosts,
+            "providers": providers,
+        }
+
+# Process-wide transport manager
+transport_manager = TransportManager()
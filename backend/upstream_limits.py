@@ -0,0 +1,382 @@
+"""
+Adaptive upstream concurrency limits per (provider, model).
+
+Each model gets a concurrency limit adjusted by AIMD: every completed stream
+that was using at least half the limit raises it by 1/limit (about +1 per
+round of requests), a 429 halves it (UPSTREAM_DECREASE_FACTOR), and a first
+token slower than UPSTREAM_LATENCY_TOLERANCE times the model's baseline
+trims it by UPSTREAM_LATENCY_DECREASE_FACTOR. Only requests started after the
+previous decrease can decrease it again, so one burst of 429s counts once.
+
+Rate-limit signals from the provider are honored as well:
+
+- `Retry-After` / `retry-after-ms` on a 429 blocks the model until then
+- `x-ratelimit-*` (OpenAI, Groq) and `anthropic-ratelimit-*` headers block
+  it once no requests remain, and hold back requests whose estimated input
+  tokens exceed the remaining token budget until the window resets
+
+Requests over the limit wait in a FIFO queue for at most
+UPSTREAM_MAX_QUEUE_WAIT_SECONDS (and never past their deadline). A request
+that cannot start in time raises UpstreamBusy, which moves the failover
+chain to its next step instead of sending one more request into the limit.
+"""
+import asyncio
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Mapping, Optional, Tuple
+from logging_config import logger, debug_with_context
+from configuration import (
+    UPSTREAM_LIMITER_ENABLED,
+    UPSTREAM_INITIAL_CONCURRENCY,
+    UPSTREAM_MIN_CONCURRENCY,
+    UPSTREAM_MAX_CONCURRENCY,
+    UPSTREAM_DECREASE_FACTOR,
+    UPSTREAM_LATENCY_TOLERANCE,
+    UPSTREAM_LATENCY_DECREASE_FACTOR,
+    UPSTREAM_MAX_QUEUE,
+    UPSTREAM_MAX_QUEUE_WAIT_SECONDS,
+    UPSTREAM_DEFAULT_RETRY_AFTER_SECONDS
+)
+
+# Status codes that mean "slow down": rate limited, or overloaded (Anthropic)
+RATE_LIMIT_STATUSES = (429, 529)
+# Weight of a new first-token latency in the baseline EWMA
+BASELINE_ALPHA = 0.05
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+class UpstreamBusy(Exception):
+    """A model's upstream limit did not free up within the allowed wait."""
+
+    def __init__(self, provider: str, model: str, retry_after: float):
+        super().__init__(f"{provider}:{model} is at its upstream rate limit (retry after {retry_after:.1f}s)")
+        self.provider = provider
+        self.model = model
+        self.retry_after = retry_after
+
+def parse_reset(value: Optional[str], now: float) -> Optional[float]:
+    """
+    Parse a rate-limit reset header into a monotonic timestamp.
+
+    Accepts seconds ("1.5"), durations ("6m0s", "20ms"), RFC 3339 timestamps
+    (Anthropic) and HTTP dates (Retry-After).
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return now + max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return now + sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        if "T" in value:
+            moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        else:
+            moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return now + max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+def retry_after(headers: Optional[Mapping[str, str]], now: float) -> Optional[float]:
+    """The monotonic time a 429 asks us to wait until, if it says."""
+    if not headers:
+        return None
+    milliseconds = headers.get("retry-after-ms")
+    if milliseconds:
+        try:
+            return now + float(milliseconds) / 1000
+        except ValueError:
+            pass
+    return parse_reset(headers.get("retry-after"), now)
+
+def _header_int(headers: Mapping[str, str], *names: str) -> Optional[int]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return int(float(value))
+            except ValueError:
+                return None
+    return None
+
+def _header_reset(headers: Mapping[str, str], now: float, *names: str) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return parse_reset(value, now)
+    return None
+
+def rate_limit_status(error: BaseException) -> Optional[int]:
+    """The HTTP status of an SDK error if it is a rate-limit or overload response."""
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status if status in RATE_LIMIT_STATUSES else None
+
+class _Waiter:
+    __slots__ = ("event", "tokens")
+
+    def __init__(self, tokens: int):
+        self.event = asyncio.Event()
+        self.tokens = tokens
+
+class UpstreamLimiter:
+    """AIMD concurrency limit, rate-limit blocks and a bounded FIFO queue for one model."""
+
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self.limit = float(UPSTREAM_INITIAL_CONCURRENCY)
+        self.in_flight = 0
+        # Monotonic time before which no request may start (Retry-After, exhausted request budget)
+        self.blocked_until = 0.0
+        # Token budget from the provider's headers, drawn down locally between responses
+        self.tokens_remaining: Optional[int] = None
+        self.tokens_limit: Optional[int] = None
+        self.tokens_reset_at = 0.0
+        self._baseline_ttft: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: Deque[_Waiter] = deque()
+        self.started = 0
+        self.queued = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.increases = 0
+        self.decreases = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def tracks_tokens(self) -> bool:
+        """Whether a token budget from the provider's headers is in force."""
+        return self.tokens_remaining is not None and time.monotonic() < self.tokens_reset_at
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def token_usage(self) -> Optional[float]:
+        """Fraction of the provider's token budget used in the current window, if known."""
+        if not self.tracks_tokens or not self.tokens_limit:
+            return None
+        return max(0.0, 1.0 - self.tokens_remaining / self.tokens_limit)
+
+    def _tokens_block(self, tokens: int, now: float) -> Optional[float]:
+        """When a request of `tokens` may start as far as the token budget goes (None: now)."""
+        if self.tokens_remaining is None or now >= self.tokens_reset_at or tokens <= self.tokens_remaining:
+            return None
+        # Once the window resets the budget is unknown again until the next response
+        return self.tokens_reset_at
+
+    def _ready_at(self, tokens: int, now: float) -> Optional[float]:
+        """None if a request can start now, else the earliest time to check again (inf: on release)."""
+        blocked = self.blocked_until if self.blocked_until > now else None
+        token_block = self._tokens_block(tokens, now)
+        waits = [t for t in (blocked, token_block) if t is not None]
+        if waits:
+            return max(waits)
+        if self.in_flight >= max(1, int(self.limit)):
+            return float("inf")
+        return None
+
+    def _start(self, tokens: int, now: float) -> float:
+        self.in_flight += 1
+        self.started += 1
+        if self.tokens_remaining is not None and now < self.tokens_reset_at:
+            self.tokens_remaining -= tokens
+        return now
+
+    async def acquire(self, tokens: int = 0, max_wait: Optional[float] = None) -> float:
+        """
+        Wait for a slot; returns the start time to pass back on release.
+
+        Args:
+            tokens: Estimated input tokens, checked against the provider's token budget
+            max_wait: Longest wait in seconds (defaults to UPSTREAM_MAX_QUEUE_WAIT_SECONDS)
+
+        Raises:
+            UpstreamBusy: If no slot frees up in time or the queue is full
+        """
+        now = time.monotonic()
+        if not UPSTREAM_LIMITER_ENABLED:
+            self.in_flight += 1
+            self.started += 1
+            return now
+        if not self._waiters and self._ready_at(tokens, now) is None:
+            return self._start(tokens, now)
+        if len(self._waiters) >= UPSTREAM_MAX_QUEUE:
+            self.rejected += 1
+            raise UpstreamBusy(self.provider, self.model, self._retry_after(tokens, now))
+
+        wait = UPSTREAM_MAX_QUEUE_WAIT_SECONDS if max_wait is None else min(max_wait, UPSTREAM_MAX_QUEUE_WAIT_SECONDS)
+        give_up_at = now + wait
+        waiter = _Waiter(tokens)
+        self._waiters.append(waiter)
+        self.queued += 1
+        started = now
+        try:
+            while True:
+                now = time.monotonic()
+                ready_at = self._ready_at(tokens, now) if self._waiters[0] is waiter else float("inf")
+                if ready_at is None:
+                    self._waiters.popleft()
+                    self._record_wait(now - started)
+                    self._start(tokens, now)
+                    # The next waiter may fit as well
+                    self._wake_next()
+                    return now
+                if now >= give_up_at or (ready_at != float("inf") and ready_at > give_up_at):
+                    # Known not to free up in time: fail now rather than at the end of the wait
+                    self.rejected += 1
+                    self._record_wait(now - started)
+                    raise UpstreamBusy(self.provider, self.model, self._retry_after(tokens, now))
+                waiter.event.clear()
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout=min(ready_at, give_up_at) - now)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._wake_next()
+
+    def _retry_after(self, tokens: int, now: float) -> float:
+        ready_at = self._ready_at(tokens, now)
+        if ready_at is None or ready_at == float("inf"):
+            return UPSTREAM_DEFAULT_RETRY_AFTER_SECONDS
+        return max(0.0, ready_at - now)
+
+    def _record_wait(self, seconds: float) -> None:
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def _wake_next(self) -> None:
+        if self._waiters:
+            self._waiters[0].event.set()
+
+    def release(self, started_at: float, ttft: Optional[float] = None, error: Optional[BaseException] = None) -> None:
+        """
+        Free a slot and adjust the limit from the outcome.
+
+        Args:
+            started_at: Value returned by acquire()
+            ttft: First-token latency of a completed stream
+            error: Exception the stream failed with, if any
+        """
+        self.in_flight -= 1
+        if UPSTREAM_LIMITER_ENABLED:
+            status = rate_limit_status(error) if error is not None else None
+            if status is not None:
+                self._on_rate_limited(started_at, status, getattr(getattr(error, "response", None), "headers", None))
+            elif error is None and ttft is not None:
+                self._on_success(started_at, ttft)
+        self._wake_next()
+
+    def _on_success(self, started_at: float, ttft: float) -> None:
+        baseline = self._baseline_ttft
+        self._baseline_ttft = ttft if baseline is None else baseline + BASELINE_ALPHA * (ttft - baseline)
+        if UPSTREAM_LATENCY_TOLERANCE > 0 and baseline is not None and ttft > UPSTREAM_LATENCY_TOLERANCE * baseline:
+            self._decrease(started_at, UPSTREAM_LATENCY_DECREASE_FACTOR, "latency")
+            return
+        # Only grow a limit that is actually in use
+        if self.in_flight + 1 >= self.limit / 2 and self.limit < UPSTREAM_MAX_CONCURRENCY:
+            self.limit = min(float(UPSTREAM_MAX_CONCURRENCY), self.limit + 1.0 / self.limit)
+            self.increases += 1
+
+    def _on_rate_limited(self, started_at: float, status: int, headers: Optional[Mapping[str, str]]) -> None:
+        now = time.monotonic()
+        self.rate_limited += 1
+        until = retry_after(headers, now) or now + UPSTREAM_DEFAULT_RETRY_AFTER_SECONDS
+        self.blocked_until = max(self.blocked_until, until)
+        if headers:
+            self.observe(headers)
+        self._decrease(started_at, UPSTREAM_DECREASE_FACTOR, f"HTTP {status}")
+
+    def _decrease(self, started_at: float, factor: float, reason: str) -> None:
+        # Requests already in flight at the last decrease saw the old limit
+        if started_at < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        self.limit = max(float(UPSTREAM_MIN_CONCURRENCY), self.limit * factor)
+        self.decreases += 1
+        debug_with_context(logger,
+            "Upstream concurrency limit decreased",
+            provider=self.provider,
+            model=self.model,
+            reason=reason,
+            limit=round(self.limit, 2),
+            in_flight=self.in_flight
+        )
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """Take in the rate-limit headers of a provider response."""
+        if not UPSTREAM_LIMITER_ENABLED:
+            return
+        now = time.monotonic()
+        requests_remaining = _header_int(headers, "x-ratelimit-remaining-requests",
+                                         "anthropic-ratelimit-requests-remaining")
+        if requests_remaining is not None and requests_remaining <= 0:
+            reset_at = _header_reset(headers, now, "x-ratelimit-reset-requests", "anthropic-ratelimit-requests-reset")
+            if reset_at is not None:
+                self.blocked_until = max(self.blocked_until, reset_at)
+        tokens_remaining = _header_int(headers, "x-ratelimit-remaining-tokens",
+                                       "anthropic-ratelimit-input-tokens-remaining",
+                                       "anthropic-ratelimit-tokens-remaining")
+        if tokens_remaining is not None:
+            reset_at = _header_reset(headers, now, "x-ratelimit-reset-tokens",
+                                     "anthropic-ratelimit-input-tokens-reset", "anthropic-ratelimit-tokens-reset")
+            if reset_at is not None:
+                self.tokens_remaining = tokens_remaining
+                self.tokens_reset_at = reset_at
+                self.tokens_limit = _header_int(headers, "x-ratelimit-limit-tokens",
+                                                "anthropic-ratelimit-input-tokens-limit",
+                                                "anthropic-ratelimit-tokens-limit")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "blocked_for_seconds": round(max(0.0, self.blocked_until - now), 3),
+            "tokens_remaining": self.tokens_remaining if self.tokens_remaining is not None and now < self.tokens_reset_at else None,
+            "started": self.started,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "rate_limited": self.rate_limited,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "mean_wait_ms": round(self.wait_seconds / self.queued * 1000, 1) if self.queued else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 1),
+            "baseline_ttft_ms": round(self._baseline_ttft * 1000, 1) if self._baseline_ttft is not None else None,
+        }
+
+class UpstreamLimiterRegistry:
+    """Creates and holds one limiter per (provider, model)."""
+
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, str], UpstreamLimiter] = {}
+
+    def get(self, provider: str, model: str) -> UpstreamLimiter:
+        key = (provider, model)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = self._limiters[key] = UpstreamLimiter(provider, model)
+        return limiter
+
+    def queued(self) -> int:
+        """Requests waiting for any limiter."""
+        return sum(limiter.queue_depth for limiter in self._limiters.values())
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        result: Dict[str, Dict[str, Any]] = {}
+        for (provider, model), limiter in self._limiters.items():
+            result.setdefault(provider, {})[model] = limiter.stats()
+        return result
+
+# Process-wide upstream limiters
+upstream_limits = UpstreamLimiterRegistry()
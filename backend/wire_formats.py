@@ -0,0 +1,130 @@
+"""
+Wire formats for the chat stream, negotiated from the request's Accept header.
+
+SSE is the default and keeps the browser-facing shape unchanged. NDJSON and
+length-prefixed MessagePack are compact formats for server-to-server callers:
+stream-constant fields (`id`, `model`) are sent once in a `start` event and
+each token frame carries only the delta. In a multi-source stream
+(/chat/compare) start and metadata events also carry the `source`.
+
+    {"type": "start", "id": "...", "model": "..."}   # again if the model or source changes
+    {"d": "token text"}
+    {"type": "<metadata event>", ...}
+    {"type": "done"}
+"""
+import json
+import struct
+from typing import Dict, List, Optional, Tuple, Type
+from stream_events import StreamEvent, encode_sse
+
+try:
+    import msgpack
+except ImportError:  # Optional: MessagePack is only offered when installed
+    msgpack = None
+
+class StreamEncoder:
+    """Base class for per-stream wire encoders."""
+    media_type = "text/event-stream"
+
+    def encode(self, event: StreamEvent) -> bytes:
+        raise NotImplementedError
+
+class SSEEncoder(StreamEncoder):
+    """Server-Sent Events, the default browser-facing format."""
+    media_type = "text/event-stream"
+
+    def encode(self, event: StreamEvent) -> bytes:
+        return encode_sse(event).encode("utf-8")
+
+class CompactEncoder(StreamEncoder):
+    """Base for compact formats that send stream-constant fields once."""
+
+    def __init__(self):
+        self._header: Optional[Tuple[str, Optional[str], Optional[str]]] = None
+
+    def frame(self, payload: Dict) -> bytes:
+        raise NotImplementedError
+
+    def encode(self, event: StreamEvent) -> bytes:
+        if event.kind == StreamEvent.DONE:
+            return self.frame({"type": "done"})
+        if event.kind != StreamEvent.DELTA:
+            payload = {"type": event.kind, **(event.data or {})}
+            if event.source is not None:
+                payload["source"] = event.source
+            return self.frame(payload)
+
+        out = b""
+        header = (event.message_id, event.model, event.source)
+        if header != self._header:
+            self._header = header
+            start = {"type": "start", "id": event.message_id, "model": event.model}
+            if event.source is not None:
+                start["source"] = event.source
+            out = self.frame(start)
+        return out + self.frame({"d": event.text})
+
+class NDJSONEncoder(CompactEncoder):
+    """Newline-delimited JSON, one object per line."""
+    media_type = "application/x-ndjson"
+
+    def frame(self, payload: Dict) -> bytes:
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+class MessagePackEncoder(CompactEncoder):
+    """MessagePack maps, each prefixed with a 4-byte big-endian length."""
+    media_type = "application/x-msgpack"
+
+    def frame(self, payload: Dict) -> bytes:
+        body = msgpack.packb(payload, use_bin_type=True)
+        return struct.pack(">I", len(body)) + body
+
+# Accepted media types mapped to their encoder
+STREAM_ENCODERS: Dict[str, Type[StreamEncoder]] = {
+    "text/event-stream": SSEEncoder,
+    "application/x-ndjson": NDJSONEncoder,
+    "application/ndjson": NDJSONEncoder,
+}
+if msgpack is not None:
+    STREAM_ENCODERS.update({
+        "application/x-msgpack": MessagePackEncoder,
+        "application/msgpack": MessagePackEncoder,
+        "application/vnd.msgpack": MessagePackEncoder,
+    })
+
+def _parse_accept(accept: str) -> List[Tuple[str, float]]:
+    """Parse an Accept header into (media_type, q) pairs, highest q first."""
+    entries = []
+    for position, part in enumerate(accept.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media_type = fields[0].lower()
+        if not media_type:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        entries.append((media_type, q, position))
+    entries.sort(key=lambda e: (-e[1], e[2]))
+    return [(media_type, q) for media_type, q, _ in entries]
+
+def negotiate_stream_encoder(accept: Optional[str]) -> StreamEncoder:
+    """
+    Pick a stream encoder for the given Accept header.
+
+    Falls back to SSE when the header is missing, only contains wildcards or
+    names no supported format.
+    """
+    if accept:
+        for media_type, q in _parse_accept(accept):
+            if q <= 0:
+                continue
+            encoder_class = STREAM_ENCODERS.get(media_type)
+            if encoder_class is not None:
+                return encoder_class()
+            if media_type in ("*/*", "text/*"):
+                break
+    return SSEEncoder()